@@ -0,0 +1,102 @@
+import json
+import os
+import tempfile
+import time
+
+import jsonlines
+
+from chatlib.chatbot import DialogueTurn
+from chatlib.chatbot.session_writer import SessionFileWriter
+from chatlib.utils.json_serializer import StdJSONSerializer, get_default_json_serializer
+
+# Micro-benchmark of turn write and read throughput of the session file writer.
+# Run from the repository root: python benchmark_session_writer.py
+
+TURN_COUNT = 20000
+
+
+def make_turns(count: int) -> list[DialogueTurn]:
+    return [DialogueTurn(message=f"This is message number {i}. " * 8, is_user=i % 2 == 0,
+                         processing_time=None if i % 2 == 0 else 1200 + i,
+                         metadata=None if i % 3 else {"state": "explore", "payload": {"index": i, "tags": ["a", "b"]}})
+            for i in range(count)]
+
+
+def measure(label: str, write, read, turns: list[DialogueTurn]):
+    start = time.perf_counter()
+    write(turns)
+    write_elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    dialogue = read()
+    read_elapsed = time.perf_counter() - start
+
+    assert len(dialogue) == len(turns)
+    print(f"{label:<40} write {len(turns) / write_elapsed:>10,.0f} turns/s    read {len(turns) / read_elapsed:>10,.0f} turns/s")
+
+
+def run_legacy(session_id: str, turns: list[DialogueTurn]):
+    # The former implementation: jsonlines with the standard json module, one file open per turn,
+    # and full pydantic validation on read.
+    file_path = os.path.join(os.getcwd(), "data/sessions", session_id, "dialogue.jsonl")
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+
+    def write(turns: list[DialogueTurn]):
+        for turn in turns:
+            with jsonlines.open(file_path, 'a') as writer:
+                writer.write(turn.__dict__)
+
+    def read() -> list[DialogueTurn]:
+        with jsonlines.open(file_path, "r") as reader:
+            return [DialogueTurn(**row) for row in reader]
+
+    measure("before (jsonlines + validation)", write, read, turns)
+
+
+def run_writer(label: str, session_id: str, writer: SessionFileWriter, turns: list[DialogueTurn]):
+    def write(turns: list[DialogueTurn]):
+        for turn in turns:
+            writer.write_turn(session_id, turn)
+
+    measure(label, write, lambda: writer.read_dialogue(session_id), turns)
+
+
+def run_session_info(turns: list[DialogueTurn]):
+    info = {"id": "info", "turns": len(turns), "response_generator": {
+        "state_history": [["explore", {"index": i, "message": turn.message}] for i, turn in enumerate(turns[:2000])]}}
+
+    start = time.perf_counter()
+    for _ in range(20):
+        json.dumps(info, indent=2)
+    before = (time.perf_counter() - start) / 20
+
+    serializer = get_default_json_serializer()
+    start = time.perf_counter()
+    for _ in range(20):
+        serializer.dumps(info)
+    after = (time.perf_counter() - start) / 20
+
+    print(f"{'session info (2000-entry state history)':<40} before {before * 1000:.2f} ms    after {after * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    turns = make_turns(TURN_COUNT)
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as temp_dir:
+        os.chdir(temp_dir)
+        try:
+            print(f"{TURN_COUNT} turns, default serializer: {get_default_json_serializer().name}")
+            run_legacy("legacy", turns)
+            run_writer("after (json)", "std", SessionFileWriter(serializer=StdJSONSerializer()), turns)
+            run_writer(f"after ({get_default_json_serializer().name})", "fast", SessionFileWriter(), turns)
+            trusted_writer = SessionFileWriter(trusted_rows=True)
+            measure(f"after ({get_default_json_serializer().name}, trusted read)",
+                    lambda turns: trusted_writer.write_turns("trusted", turns),
+                    lambda: trusted_writer.read_dialogue("trusted"), turns)
+            writer = SessionFileWriter()
+            measure(f"after ({get_default_json_serializer().name}, compact read)",
+                    lambda turns: writer.write_turns("compact", turns),
+                    lambda: writer.read_compact_dialogue("compact"), turns)
+            run_session_info(turns)
+        finally:
+            os.chdir(cwd)
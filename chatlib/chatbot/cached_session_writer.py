@@ -0,0 +1,219 @@
+from collections import OrderedDict
+from threading import Lock
+
+from pydantic import BaseModel
+
+from chatlib.utils.json_serializer import JSONSerializer, get_default_json_serializer
+from .session_writer import SessionWriterBase
+from .types import DialogueTurn, Dialogue
+
+
+class SessionCacheStats(BaseModel):
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    size_bytes: int = 0
+    session_count: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else 0.0
+
+
+class _CachedSession:
+    def __init__(self):
+        self.dialogue: Dialogue | None = None
+        # Kept serialized, so that the size is known and every read gets its own copy without a deepcopy.
+        self.info_data: bytes | None = None
+        self.dialogue_size = 0
+        self.info_size = 0
+        # Increased on every write, so that a read from the underlying writer does not cache data older than a write
+        # that landed while it was running.
+        self.version = 0
+
+    @property
+    def size(self) -> int:
+        return self.dialogue_size + self.info_size
+
+
+def _estimate_turn_size(turn: DialogueTurn, serializer: JSONSerializer) -> int:
+    # Rough in-memory footprint: the text plus the fixed fields and the serialized metadata.
+    return len(turn.message) + 64 + (len(serializer.dumps(turn.metadata)) if turn.metadata is not None else 0)
+
+
+class CachedSessionWriter(SessionWriterBase):
+    """
+    Keeps the dialogues and info dicts of recently used sessions in memory in front of another writer.
+    Writes go through to the underlying writer. Sessions are evicted in LRU order beyond max_size_bytes.
+    """
+
+    def __init__(self, writer: SessionWriterBase, max_size_bytes: int = 64 * 1024 * 1024,
+                 serializer: JSONSerializer | None = None):
+        self.__writer = writer
+        self.max_size_bytes = max_size_bytes
+        self.__serializer = serializer or get_default_json_serializer()
+
+        self.__sessions: OrderedDict[str, _CachedSession] = OrderedDict()
+        self.__size = 0
+        self.__lock = Lock()
+        self.__stats = SessionCacheStats()
+
+    @property
+    def writer(self) -> SessionWriterBase:
+        return self.__writer
+
+    @property
+    def stats(self) -> SessionCacheStats:
+        with self.__lock:
+            return self.__stats.model_copy(update=dict(size_bytes=self.__size, session_count=len(self.__sessions)))
+
+    def __get_entry(self, session_id: str, create: bool = False) -> _CachedSession | None:
+        entry = self.__sessions.get(session_id)
+        if entry is not None:
+            self.__sessions.move_to_end(session_id)
+        elif create:
+            entry = _CachedSession()
+            self.__sessions[session_id] = entry
+        return entry
+
+    def __resize(self, entry: _CachedSession, dialogue_size: int | None = None, info_size: int | None = None):
+        self.__size -= entry.size
+        if dialogue_size is not None:
+            entry.dialogue_size = dialogue_size
+        if info_size is not None:
+            entry.info_size = info_size
+        self.__size += entry.size
+
+        while self.__size > self.max_size_bytes and len(self.__sessions) > 1:
+            _, evicted = self.__sessions.popitem(last=False)
+            self.__size -= evicted.size
+            self.__stats.evictions += 1
+
+    def __evict(self, session_id: str):
+        entry = self.__sessions.pop(session_id, None)
+        if entry is not None:
+            self.__size -= entry.size
+
+    def __begin_read(self, session_id: str) -> tuple[_CachedSession, int]:
+        entry = self.__get_entry(session_id, create=True)
+        return entry, entry.version
+
+    def __is_read_current(self, session_id: str, entry: _CachedSession, version: int) -> bool:
+        # False if the entry was evicted or written since the read began.
+        return self.__sessions.get(session_id) is entry and entry.version == version
+
+    def __drop_if_empty(self, session_id: str, entry: _CachedSession):
+        # Do not leave an entry created by a read behind if nothing was cached in it.
+        if self.__sessions.get(session_id) is entry and entry.dialogue is None and entry.info_data is None:
+            self.__evict(session_id)
+
+    def exists(self, session_id: str) -> bool:
+        with self.__lock:
+            entry = self.__get_entry(session_id)
+            if entry is not None and entry.info_data is not None:
+                return True
+        return self.__writer.exists(session_id)
+
+    def write_turn(self, session_id: str, turn: DialogueTurn):
+        self.__writer.write_turn(session_id, turn)
+        with self.__lock:
+            entry = self.__get_entry(session_id)
+            if entry is not None:
+                entry.version += 1
+                if entry.dialogue is not None:
+                    entry.dialogue.append(turn)
+                    self.__resize(entry, dialogue_size=entry.dialogue_size
+                                                      + _estimate_turn_size(turn, self.__serializer))
+
+    def delete_turn(self, session_id: str, turn_id: str) -> DialogueTurn | None:
+        deleted_turn = self.__writer.delete_turn(session_id, turn_id)
+        with self.__lock:
+            entry = self.__get_entry(session_id)
+            if entry is not None:
+                entry.version += 1
+                if entry.dialogue is not None:
+                    for i in range(len(entry.dialogue) - 1, -1, -1):
+                        if entry.dialogue[i].id == turn_id:
+                            turn = entry.dialogue.pop(i)
+                            self.__resize(entry, dialogue_size=entry.dialogue_size
+                                                              - _estimate_turn_size(turn, self.__serializer))
+                            break
+        return deleted_turn
+
+    def read_dialogue(self, session_id: str) -> Dialogue | None:
+        with self.__lock:
+            entry = self.__get_entry(session_id)
+            if entry is not None and entry.dialogue is not None:
+                self.__stats.hits += 1
+                # Turns are immutable, so a shallow copy keeps the cached list safe from the caller.
+                return list(entry.dialogue)
+            self.__stats.misses += 1
+            entry, version = self.__begin_read(session_id)
+
+        dialogue = self.__writer.read_dialogue(session_id)
+        with self.__lock:
+            if dialogue is not None and self.__is_read_current(session_id, entry, version):
+                entry.dialogue = list(dialogue)
+                self.__resize(entry, dialogue_size=sum([_estimate_turn_size(turn, self.__serializer)
+                                                        for turn in dialogue]))
+            self.__drop_if_empty(session_id, entry)
+        return dialogue
+
+    def write_dialogue(self, session_id: str, dialog: Dialogue):
+        self.__writer.write_dialogue(session_id, dialog)
+        with self.__lock:
+            # The underlying writer may ignore the write (e.g., no dialogue yet), so do not cache it.
+            self.__evict(session_id)
+
+    def write_session_info(self, session_id, session_info: dict):
+        self.__writer.write_session_info(session_id, session_info)
+        # Response generators put their live state into the info dict, so cache a serialized snapshot.
+        info_data = self.__serializer.dumps(session_info)
+        with self.__lock:
+            entry = self.__get_entry(session_id, create=True)
+            entry.version += 1
+            entry.info_data = info_data
+            self.__resize(entry, info_size=len(info_data))
+
+    def write_serialized_session_info(self, session_id, data: bytes):
+        self.__writer.write_serialized_session_info(session_id, data)
+        with self.__lock:
+            entry = self.__get_entry(session_id, create=True)
+            entry.version += 1
+            entry.info_data = data
+            self.__resize(entry, info_size=len(data))
+
+    def read_session_info(self, session_id) -> dict:
+        with self.__lock:
+            entry = self.__get_entry(session_id)
+            if entry is not None and entry.info_data is not None:
+                self.__stats.hits += 1
+                info_data = entry.info_data
+            else:
+                self.__stats.misses += 1
+                entry, version = self.__begin_read(session_id)
+                info_data = None
+
+        if info_data is not None:
+            return self.__serializer.loads(info_data)
+
+        session_info = self.__writer.read_session_info(session_id)
+        info_data = self.__serializer.dumps(session_info) if session_info is not None else None
+        with self.__lock:
+            if info_data is not None and self.__is_read_current(session_id, entry, version):
+                entry.info_data = info_data
+                self.__resize(entry, info_size=len(info_data))
+            self.__drop_if_empty(session_id, entry)
+        return session_info
+
+    def clear_data(self, session_id) -> bool:
+        with self.__lock:
+            self.__evict(session_id)
+        return self.__writer.clear_data(session_id)
+
+    def clear_cache(self):
+        with self.__lock:
+            self.__sessions.clear()
+            self.__size = 0
+            self.__stats = SessionCacheStats()
@@ -0,0 +1,187 @@
+import json
+from array import array
+from typing import Sequence, Iterator, Iterable, overload
+
+from .types import DialogueTurn, Dialogue
+
+_NO_PROCESSING_TIME = -1
+
+
+class CompactDialogueTurn:
+    """
+    A lightweight handle to a turn in a CompactDialogue. Fields are decoded from the columns on access.
+    It exposes the same attributes as DialogueTurn, so it can be passed to code that reads turns.
+    """
+
+    __slots__ = ("__store", "__index")
+
+    def __init__(self, store: 'CompactDialogue', index: int):
+        self.__store = store
+        self.__index = index
+
+    @property
+    def message(self) -> str:
+        return self.__store.get_message(self.__index)
+
+    @property
+    def is_user(self) -> bool:
+        return self.__store.get_is_user(self.__index)
+
+    @property
+    def id(self) -> str:
+        return self.__store.get_id(self.__index)
+
+    @property
+    def timestamp(self) -> int:
+        return self.__store.get_timestamp(self.__index)
+
+    @property
+    def processing_time(self) -> int | None:
+        return self.__store.get_processing_time(self.__index)
+
+    @property
+    def metadata(self) -> dict | None:
+        return self.__store.get_metadata(self.__index)
+
+    def to_turn(self) -> DialogueTurn:
+        return self.__store.get_turn(self.__index)
+
+    def __repr__(self) -> str:
+        return f"CompactDialogueTurn(id={self.id!r}, is_user={self.is_user}, message={self.message!r})"
+
+
+class CompactDialogue(Sequence[CompactDialogueTurn]):
+    """
+    Columnar storage of dialogue turns for large corpora.
+    Messages and ids are kept in UTF-8 buffers with offset arrays, flags and timestamps in typed arrays,
+    and metadata as JSON bytes that are decoded only when accessed.
+    A turn takes roughly the size of its text and metadata plus a few dozen bytes, instead of a pydantic model.
+    """
+
+    def __init__(self, turns: Iterable[DialogueTurn] | None = None):
+        self.__messages = bytearray()
+        self.__message_offsets = array('Q', [0])
+        self.__ids = bytearray()
+        self.__id_offsets = array('Q', [0])
+        self.__is_user = array('B')
+        self.__timestamps = array('q')
+        self.__processing_times = array('q')
+        self.__metadata: list[bytes | None] = []
+
+        if turns is not None:
+            self.extend(turns)
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[dict]) -> 'CompactDialogue':
+        """
+        Build from serialized turn dicts (e.g., rows of dialogue.jsonl) without creating DialogueTurn models.
+        """
+        dialogue = cls()
+        for row in rows:
+            dialogue.append_values(message=row["message"], is_user=row.get("is_user", True), id=row["id"],
+                                   timestamp=row["timestamp"], processing_time=row.get("processing_time"),
+                                   metadata=row.get("metadata"))
+        return dialogue
+
+    def append_values(self, message: str, is_user: bool, id: str, timestamp: int, processing_time: int | None,
+                      metadata: dict | None):
+        self.__messages += message.encode("utf-8")
+        self.__message_offsets.append(len(self.__messages))
+        self.__ids += id.encode("utf-8")
+        self.__id_offsets.append(len(self.__ids))
+        self.__is_user.append(1 if is_user else 0)
+        self.__timestamps.append(timestamp)
+        self.__processing_times.append(processing_time if processing_time is not None else _NO_PROCESSING_TIME)
+        self.__metadata.append(json.dumps(metadata, ensure_ascii=False).encode("utf-8") if metadata is not None else None)
+
+    def append(self, turn: DialogueTurn):
+        self.append_values(turn.message, turn.is_user, turn.id, turn.timestamp, turn.processing_time, turn.metadata)
+
+    def extend(self, turns: Iterable[DialogueTurn]):
+        for turn in turns:
+            self.append(turn)
+
+    def __len__(self) -> int:
+        return len(self.__is_user)
+
+    def __check_index(self, index: int) -> int:
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("dialogue index out of range")
+        return index
+
+    @overload
+    def __getitem__(self, index: int) -> CompactDialogueTurn:
+        ...
+
+    @overload
+    def __getitem__(self, index: slice) -> list[CompactDialogueTurn]:
+        ...
+
+    def __getitem__(self, index: int | slice) -> CompactDialogueTurn | list[CompactDialogueTurn]:
+        if isinstance(index, slice):
+            return [CompactDialogueTurn(self, i) for i in range(*index.indices(len(self)))]
+        else:
+            return CompactDialogueTurn(self, self.__check_index(index))
+
+    def __iter__(self) -> Iterator[CompactDialogueTurn]:
+        for i in range(len(self)):
+            yield CompactDialogueTurn(self, i)
+
+    def get_message(self, index: int) -> str:
+        index = self.__check_index(index)
+        return self.__messages[self.__message_offsets[index]:self.__message_offsets[index + 1]].decode("utf-8")
+
+    def get_id(self, index: int) -> str:
+        index = self.__check_index(index)
+        return self.__ids[self.__id_offsets[index]:self.__id_offsets[index + 1]].decode("utf-8")
+
+    def get_is_user(self, index: int) -> bool:
+        return self.__is_user[self.__check_index(index)] == 1
+
+    def get_timestamp(self, index: int) -> int:
+        return self.__timestamps[self.__check_index(index)]
+
+    def get_processing_time(self, index: int) -> int | None:
+        processing_time = self.__processing_times[self.__check_index(index)]
+        return processing_time if processing_time != _NO_PROCESSING_TIME else None
+
+    def get_metadata(self, index: int) -> dict | None:
+        metadata = self.__metadata[self.__check_index(index)]
+        return json.loads(metadata) if metadata is not None else None
+
+    def get_turn(self, index: int) -> DialogueTurn:
+        return DialogueTurn(message=self.get_message(index), is_user=self.get_is_user(index),
+                            id=self.get_id(index), timestamp=self.get_timestamp(index),
+                            processing_time=self.get_processing_time(index), metadata=self.get_metadata(index))
+
+    @property
+    def timestamps(self) -> array:
+        """
+        The timestamps of all turns, for analytics without materializing turns.
+        """
+        return array('q', self.__timestamps)
+
+    @property
+    def is_user_flags(self) -> array:
+        return array('B', self.__is_user)
+
+    def message_lengths(self) -> list[int]:
+        """
+        The UTF-8 byte lengths of the messages.
+        """
+        return [self.__message_offsets[i + 1] - self.__message_offsets[i] for i in range(len(self))]
+
+    def to_dialogue(self) -> Dialogue:
+        return [self.get_turn(i) for i in range(len(self))]
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Approximate memory used by the columns.
+        """
+        return (len(self.__messages) + len(self.__ids)
+                + (len(self.__message_offsets) + len(self.__id_offsets)) * self.__message_offsets.itemsize
+                + len(self.__is_user) + (len(self.__timestamps) + len(self.__processing_times)) * 8
+                + sum([len(m) for m in self.__metadata if m is not None]) + len(self.__metadata) * 8)
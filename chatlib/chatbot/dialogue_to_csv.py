@@ -1,7 +1,10 @@
 import csv
+from datetime import datetime, tzinfo
+from functools import cache
 from io import StringIO
+from itertools import islice
 from numbers import Number
-from typing import TypeAlias, Callable
+from typing import TypeAlias, Callable, Iterable, Iterator, Sequence
 
 import pendulum
 
@@ -16,7 +19,12 @@ class TurnValueExtractor(ColumnValueExtractor):
         self.property_name = property_name
 
     def __call__(self, turn: DialogueTurn, index: int, params: dict | None) -> str | Number | None:
-        return dict_utils.get_nested_value(turn.__dict__, self.property_name)
+        # Read attributes rather than __dict__, so compact turns without a __dict__ work as well.
+        if isinstance(self.property_name, list):
+            value = getattr(turn, self.property_name[0], None)
+            return dict_utils.get_nested_value(value, self.property_name[1:]) if len(self.property_name) > 1 else value
+        else:
+            return getattr(turn, self.property_name, None)
 
 
 class ParameterValueExtractor(ColumnValueExtractor):
@@ -27,6 +35,39 @@ class ParameterValueExtractor(ColumnValueExtractor):
         return dict_utils.get_nested_value(params, self.key)
 
 
+@cache
+def _get_timezone(name: str | None) -> tzinfo:
+    return pendulum.timezone(name) if name is not None else pendulum.UTC
+
+
+def format_timestamps(timestamps: Sequence[int], timezone: str | None = None) -> list[str]:
+    """
+    Format millisecond timestamps the same as pendulum's "YYYY-MM-DD hh:mm:ss.SSS zz", without pendulum's
+    per-call format parsing. Note that "hh" is the 12-hour clock.
+    """
+    tz = _get_timezone(timezone)
+    fromtimestamp = datetime.fromtimestamp
+    formatted = []
+    for timestamp in timestamps:
+        seconds, milliseconds = divmod(timestamp, 1000)
+        dt = fromtimestamp(seconds, tz)
+        formatted.append(f"{dt.year:04d}-{dt.month:02d}-{dt.day:02d} {(dt.hour % 12) or 12:02d}:{dt.minute:02d}:"
+                         f"{dt.second:02d}.{milliseconds:03d} {dt.tzname()}")
+    return formatted
+
+
+class TimestampValueExtractor(ColumnValueExtractor):
+    """
+    Formats the turn timestamp in the timezone given by the "timezone" parameter. Supports batch extraction.
+    """
+
+    def __call__(self, turn: DialogueTurn, index: int, params: dict | None) -> str | Number | None:
+        return self.extract_batch([turn], params)[0]
+
+    def extract_batch(self, turns: Sequence[DialogueTurn], params: dict | None) -> list[str]:
+        return format_timestamps([turn.timestamp for turn in turns], dict_utils.get_nested_value(params, "timezone"))
+
+
 class DialogueCSVWriter:
     def __init__(self, columns: list[str] = None, column_extractors: list[ColumnValueExtractor] | None = None):
         self.columns = ["id", "turn_index", "role", "message", "regenerated"] + (columns or []) + ["timestamp",
@@ -39,11 +80,7 @@ class DialogueCSVWriter:
                                      lambda turn, index, params: "Yes" if dict_utils.get_nested_value(turn.metadata,
                                                                                                       "regenerated") is True else "No"
                                  ] + (column_extractors or []) + [
-                                     lambda turn, index, params: pendulum.from_timestamp(turn.timestamp / 1000,
-                                                                                         tz=dict_utils.get_nested_value(
-                                                                                             params,
-                                                                                             "timezone")).format(
-                                         "YYYY-MM-DD hh:mm:ss.SSS zz"),
+                                     TimestampValueExtractor(),
                                      TurnValueExtractor("processing_time")
                                  ]
 
@@ -60,9 +97,54 @@ class DialogueCSVWriter:
     def convert_turn_to_row(self, turn: DialogueTurn, index: int, params: dict | None) -> list[str]:
         return [ext(turn, index, params) for ext in self.column_extractors]
 
+    def convert_turns_to_rows(self, turns: Sequence[DialogueTurn], indices: Sequence[int],
+                              params: dict | None) -> list[list]:
+        # Extractors with extract_batch (e.g., timestamp formatting) process the whole batch at once.
+        columns = [ext.extract_batch(turns, params) if hasattr(ext, "extract_batch")
+                   else [ext(turn, index, params) for turn, index in zip(turns, indices)]
+                   for ext in self.column_extractors]
+        return [list(row) for row in zip(*columns)]
+
+    def _iter_row_batches(self, dialogue: Iterable[DialogueTurn], params: dict | None = None,
+                          batch_size: int = 1000) -> Iterator[list[list]]:
+        turns = iter(dialogue)
+        index = 0
+        while True:
+            batch = list(islice(turns, batch_size))
+            if len(batch) == 0:
+                break
+            yield self.convert_turns_to_rows(batch, range(index, index + len(batch)), params)
+            index += len(batch)
+
     def _write_csv(self, writer: csv.writer, dialogue: Dialogue, params: dict | None = None):
         writer.writerow(self.columns)
-        writer.writerows([self.convert_turn_to_row(turn, i, params) for i, turn in enumerate(dialogue)])
+        for rows in self._iter_row_batches(dialogue, params):
+            writer.writerows(rows)
+
+    def _write_sessions_csv(self, writer: csv.writer, sessions: Iterable[tuple[str, Iterable[DialogueTurn]]],
+                            params: dict | None = None, batch_size: int = 1000, session_id_column: str = "session_id"):
+        writer.writerow([session_id_column] + self.columns)
+        for session_id, dialogue in sessions:
+            for rows in self._iter_row_batches(dialogue, params, batch_size):
+                writer.writerows([[session_id] + row for row in rows])
+
+    def iter_sessions_csv_lines(self, sessions: Iterable[tuple[str, Iterable[DialogueTurn]]],
+                                params: dict | None = None, batch_size: int = 1000,
+                                session_id_column: str = "session_id") -> Iterator[str]:
+        """
+        Stream the CSV of many sessions in chunks of at most batch_size rows, e.g., for an HTTP response.
+        """
+        output = StringIO()
+        writer = self._get_csv_writer(output)
+        writer.writerow([session_id_column] + self.columns)
+        for session_id, dialogue in sessions:
+            for rows in self._iter_row_batches(dialogue, params, batch_size):
+                writer.writerows([[session_id] + row for row in rows])
+                yield output.getvalue()
+                output.seek(0)
+                output.truncate()
+        if output.tell() > 0:
+            yield output.getvalue()
 
     def _get_csv_writer(self, output) -> csv.writer:
         return csv.writer(output, quoting=csv.QUOTE_NONNUMERIC)
@@ -80,6 +162,16 @@ class DialogueCSVWriter:
             writer = self._get_csv_writer(file)
             self._write_csv(writer, dialogue, params)
 
+    def sessions_to_csv_file(self, path: str, sessions: Iterable[tuple[str, Iterable[DialogueTurn]]],
+                             params: dict | None = None, batch_size: int = 1000, session_id_column: str = "session_id"):
+        """
+        Write many sessions into one CSV file with a leading session id column.
+        Sessions are consumed lazily and rows are written in batches, so memory does not grow with the total turns.
+        """
+        with open(path, 'w', newline='', encoding='utf-8') as file:
+            writer = self._get_csv_writer(file)
+            self._write_sessions_csv(writer, sessions, params, batch_size, session_id_column)
+
 
 # Test code
 if __name__ == "__main__":
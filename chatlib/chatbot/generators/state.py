@@ -1,7 +1,7 @@
 from abc import ABC, abstractmethod
-from typing import TypeVar, Generic
+from typing import TypeVar, Generic, AsyncIterator
 
-from chatlib.chatbot import ResponseGenerator, Dialogue
+from chatlib.chatbot import ResponseGenerator, Dialogue, ResponseStreamChunk
 from chatlib.chatbot.message_transformer import MessageTransformerChain
 from chatlib.utils import dict_utils
 
@@ -60,7 +60,7 @@ class StateBasedResponseGenerator(ResponseGenerator, Generic[StateType], ABC):
         """
         pass
 
-    async def _get_response_impl(self, dialog: Dialogue, dry: bool = False) -> tuple[str, dict | None]:
+    async def __update_state(self, dialog: Dialogue, dry: bool):
         if dry is False:  # Update state only when the dry flag is False.
             # Calculate state and update response generator if the state was changed:
             next_state, next_state_payload = await self.calc_next_state_info(self.current_state, dialog) or (None, None)
@@ -80,13 +80,29 @@ class StateBasedResponseGenerator(ResponseGenerator, Generic[StateType], ABC):
             elif self.__current_generator is None:  # No state change but initial run.
                 self.__current_generator = self.get_generator(self.current_state, self.current_state_payload)
 
+    def __append_state_metadata(self, metadata: dict | None) -> dict:
+        metadata = dict_utils.set_nested_value(metadata, "state", self.current_state)
+        metadata = dict_utils.set_nested_value(metadata, "payload", self.current_state_payload)
+        return metadata
+
+    async def _get_response_impl(self, dialog: Dialogue, dry: bool = False) -> tuple[str, dict | None]:
+        await self.__update_state(dialog, dry)
+
         # Generate response from the child generator:
         message, metadata, elapsed = await self.__current_generator.get_response(dialog, dry)
 
-        metadata = dict_utils.set_nested_value(metadata, "state", self.current_state)
-        metadata = dict_utils.set_nested_value(metadata, "payload", self.current_state_payload)
+        return message, self.__append_state_metadata(metadata)
 
-        return message, metadata
+    async def _get_response_stream_impl(self, dialog: Dialogue, dry: bool = False) -> AsyncIterator[ResponseStreamChunk]:
+        await self.__update_state(dialog, dry)
+
+        # Stream response from the child generator:
+        async for chunk in self.__current_generator.get_response_stream(dialog, dry):
+            if chunk.is_final:
+                yield ResponseStreamChunk(is_final=True, message=chunk.message,
+                                          metadata=self.__append_state_metadata(chunk.metadata))
+            else:
+                yield chunk
 
     def state_num_appearance(self, state: StateType) -> int:
         """
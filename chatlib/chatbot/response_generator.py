@@ -1,8 +1,9 @@
 import json
 from abc import ABC, abstractmethod
+from dataclasses import dataclass
 from functools import cache
 from time import perf_counter
-from typing import TypeAlias, Callable, Awaitable, Any, Optional
+from typing import TypeAlias, Callable, Awaitable, Any, Optional, AsyncIterator
 
 from jinja2 import Template
 from pydantic import BaseModel, Field, ConfigDict
@@ -12,10 +13,23 @@ from chatlib.chatbot.message_transformer import MessageTransformerChain, run_mes
     SpecialTokenListExtractionTransformer
 from chatlib.llm.chat_completion_api import ChatCompletionMessage, ChatCompletionAPI, ChatCompletionMessageRole, \
     TokenLimitExceedError, ChatCompletionFinishReason, ChatCompletionResult
+from chatlib.llm.token_accounting import IncrementalTokenCounter
 from .types import Dialogue, RegenerateRequestException
 from ..utils import dict_utils
 
 
+@dataclass(frozen=True)
+class ResponseStreamChunk:
+    # Raw text delta of the response. The message transformer chain is not applied to deltas.
+    delta: str = ""
+
+    # The following are set only on the last chunk of a stream.
+    is_final: bool = False
+    message: str | None = None
+    metadata: dict | None = None
+    processing_time: int | None = None
+
+
 class ResponseGenerator(ABC):
 
     def __init__(self,
@@ -44,15 +58,64 @@ class ResponseGenerator(ABC):
         except Exception as ex:
             raise ex
 
+        response, metadata = self.__apply_message_transformers(response, metadata)
+
+        end = perf_counter()
+
+        return response, metadata, int((end - start) * 1000)
+
+    def __apply_message_transformers(self, response: str, metadata: dict | None) -> tuple[str, dict | None]:
         if self._message_transformers is not None:
             cleaned_response, metadata = run_message_transformer_chain(response, metadata, self._message_transformers)
             if cleaned_response != response:
                 metadata = dict_utils.set_nested_value(metadata, "original_message", response)
                 response = cleaned_response
+        return response, metadata
+
+    async def _get_response_stream_impl(self, dialog: Dialogue, dry: bool = False) -> AsyncIterator[ResponseStreamChunk]:
+        """
+        Yield delta chunks, and finally a chunk with is_final=True carrying the untransformed message and metadata.
+        Generators without streaming support emit the whole response at once.
+        """
+        response, metadata = await self._get_response_impl(dialog, dry)
+        yield ResponseStreamChunk(delta=response)
+        yield ResponseStreamChunk(is_final=True, message=response, metadata=metadata)
+
+    async def get_response_stream(self, dialog: Dialogue, dry: bool = False) -> AsyncIterator[ResponseStreamChunk]:
+        start = perf_counter()
+
+        self._pre_get_response(dialog)
+
+        final_chunk: ResponseStreamChunk | None = None
+        deltas: list[str] = []
+        try:
+            async for chunk in self._get_response_stream_impl(dialog, dry):
+                if chunk.is_final:
+                    final_chunk = chunk
+                else:
+                    deltas.append(chunk.delta)
+                    yield chunk
+        except RegenerateRequestException as regen:
+            if len(deltas) > 0:
+                raise regen
+            print(f"Regenerate response. Reason: {regen.reason}")
+            async for chunk in self._get_response_stream_impl(dialog, dry):
+                if chunk.is_final:
+                    final_chunk = chunk
+                else:
+                    deltas.append(chunk.delta)
+                    yield chunk
+
+        if final_chunk is None:
+            # The stream ended without a final chunk. Fall back to the streamed text.
+            final_chunk = ResponseStreamChunk(is_final=True, message="".join(deltas), metadata=None)
+
+        response, metadata = self.__apply_message_transformers(final_chunk.message, final_chunk.metadata)
 
         end = perf_counter()
 
-        return response, metadata, int((end - start) * 1000)
+        yield ResponseStreamChunk(is_final=True, message=response, metadata=metadata,
+                                  processing_time=int((end - start) * 1000))
 
     @abstractmethod
     def write_to_json(self, parcel: dict):
@@ -134,6 +197,7 @@ class ChatCompletionResponseGenerator(ResponseGenerator):
 
         self.__token_limit_exceed_handler = token_limit_exceed_handler
         self.__token_limit_tolerance = token_limit_tolerance
+        self.__token_counter = IncrementalTokenCounter(api)
 
         if special_tokens is not None and len(special_tokens) > 0:
 
@@ -185,7 +249,24 @@ class ChatCompletionResponseGenerator(ResponseGenerator):
             self.__instruction_parameters = params
         self.__resolve_instruction()
 
-    async def _get_response_impl(self, dialog: Dialogue, dry: bool = False) -> tuple[str, dict | None]:
+    def __is_messages_within_token_limit(self, messages: list[ChatCompletionMessage]) -> bool:
+        token_limit = self.__api.get_token_limit(self.model)
+        if token_limit is not None:
+            max_tokens = token_limit - self.__token_limit_tolerance
+            estimated_tokens = self.__token_counter.estimate(messages, self.model)
+            if estimated_tokens is not None:
+                margin = self.__api.get_token_estimate_margin(self.model)
+                if margin is None or abs(estimated_tokens - max_tokens) > token_limit * margin:
+                    return estimated_tokens < max_tokens
+
+                # Too close to the limit to trust the estimate. The exact count also calibrates it.
+                num_tokens = self.__api.count_token_in_messages(messages, self.model)
+                self.__token_counter.calibrate(messages, self.model, num_tokens)
+                return num_tokens < max_tokens
+
+        return self.__api.is_messages_within_token_limit(messages, self.model, self.__token_limit_tolerance)
+
+    def __convert_dialogue_to_messages(self, dialog: Dialogue) -> list[ChatCompletionMessage]:
         dialogue_converted: list[ChatCompletionMessage] = []
         for turn in dialog:
             function_messages = dict_utils.get_nested_value(turn.metadata, ["chatcompletion", "function_messages"])
@@ -213,9 +294,33 @@ class ChatCompletionResponseGenerator(ResponseGenerator):
         else:
             messages = dialogue_converted
 
+        return messages
+
+    @staticmethod
+    def __make_base_metadata(result: ChatCompletionResult) -> dict:
+        metadata = {"chatcompletion": {
+            "provider": result.provider,
+            "model": result.model,
+            "usage": {"prompt_tokens": result.prompt_tokens, "completion_tokens": result.completion_tokens,
+                      "total_tokens": result.total_tokens}
+        }}
+        if result.usage_estimated:
+            metadata["chatcompletion"]["usage_estimated"] = True
+        return metadata
+
+    def __calibrate_token_counter(self, messages: list[ChatCompletionMessage], result: ChatCompletionResult):
+        # Calibrating with a local estimate would only fit the counter to itself.
+        if not result.usage_estimated:
+            self.__token_counter.calibrate(messages, self.model, result.prompt_tokens)
+
+    async def _get_response_impl(self, dialog: Dialogue, dry: bool = False) -> tuple[str, dict | None]:
+        messages = self.__convert_dialogue_to_messages(dialog)
+
         result: ChatCompletionResult
-        if self.__api.is_messages_within_token_limit(messages, self.model, self.__token_limit_tolerance):
+        if self.__is_messages_within_token_limit(messages):
             result = await self.__api.run_chat_completion(self.model, messages, self.__params.dict())
+            if result is not None:
+                self.__calibrate_token_counter(messages, result)
         else:
             print(f"Token overflow - {len(messages)} message(s).")
             if self.__token_limit_exceed_handler is not None:
@@ -223,12 +328,7 @@ class ChatCompletionResponseGenerator(ResponseGenerator):
             else:
                 raise TokenLimitExceedError()
 
-        base_metadata = {"chatcompletion": {
-            "provider": result.provider,
-            "model": result.model,
-            "usage": {"prompt_tokens": result.prompt_tokens, "completion_tokens": result.completion_tokens,
-                      "total_tokens": result.total_tokens}
-        }}
+        base_metadata = self.__make_base_metadata(result)
 
         if result.finish_reason == ChatCompletionFinishReason.Stop:
             response_text = result.message.content
@@ -260,6 +360,37 @@ class ChatCompletionResponseGenerator(ResponseGenerator):
         else:
             raise Exception(f"ChatCompletion error - {result.finish_reason}")
 
+    async def _get_response_stream_impl(self, dialog: Dialogue, dry: bool = False) -> AsyncIterator[ResponseStreamChunk]:
+        messages = self.__convert_dialogue_to_messages(dialog)
+
+        # Function calls and token limit handling need the completed result, so they take the non-streaming path.
+        if self.__params.tools is not None or not self.__is_messages_within_token_limit(messages):
+            async for chunk in super()._get_response_stream_impl(dialog, dry):
+                yield chunk
+            return
+
+        result: ChatCompletionResult | None = None
+        deltas = []
+        async for chunk in self.__api.run_chat_completion_stream(self.model, messages, self.__params.dict()):
+            if len(chunk.delta) > 0:
+                deltas.append(chunk.delta)
+                yield ResponseStreamChunk(delta=chunk.delta)
+            if chunk.result is not None:
+                result = chunk.result
+
+        if result is None:
+            # The stream ended without a result chunk, so only the streamed text is known.
+            yield ResponseStreamChunk(is_final=True, message="".join(deltas), metadata=None)
+            return
+
+        self.__calibrate_token_counter(messages, result)
+
+        if result.finish_reason == ChatCompletionFinishReason.Stop:
+            yield ResponseStreamChunk(is_final=True, message=result.message.content,
+                                      metadata=self.__make_base_metadata(result))
+        else:
+            raise Exception(f"ChatCompletion error - {result.finish_reason}")
+
     def write_to_json(self, parcel: dict):
         parcel["model"] = self.model
         parcel["params"] = self.__params.dict()
@@ -1,25 +1,60 @@
+import asyncio
 from abc import ABC
-from typing import Callable
+from dataclasses import dataclass
+from enum import StrEnum
+from typing import Callable, AsyncIterator
 
 from chatlib.utils.dict_utils import set_nested_value
+from chatlib.utils.json_serializer import get_default_json_serializer
 from .response_generator import ResponseGenerator
-from .session_writer import SessionWriterBase, session_writer
-from .types import Dialogue, DialogueTurn
+from .session_writer import SessionWriterBase, session_writer, AsyncSessionWriterBase, get_async_session_writer
+from .types import Dialogue, DialogueTurn, DialogueView
+
+
+@dataclass(frozen=True)
+class DialogueTurnStreamChunk:
+    delta: str = ""
+
+    # Set only on the last chunk, after the turn was pushed to the session.
+    turn: DialogueTurn | None = None
+
+
+class SessionSavePolicy(StrEnum):
+    # Write session info as soon as possible after a change. Changes made in the same event loop tick are coalesced.
+    Immediate = "immediate"
+    # Write session info at most once per save interval.
+    Interval = "interval"
+    # Write session info only on close(), aclose() or an explicit save().
+    OnClose = "on_close"
 
 
 class ChatSessionBase(ABC):
     def __init__(self, id: str,
                  response_generator: ResponseGenerator,
-                 writer: SessionWriterBase | None = session_writer
+                 writer: SessionWriterBase | AsyncSessionWriterBase | None = session_writer,
+                 save_policy: SessionSavePolicy = SessionSavePolicy.Immediate,
+                 save_interval: float = 5.0
                  ):
         self.id = id
         self._response_generator = response_generator
         self._dialog: Dialogue = []
-        self._session_writer = writer
+
+        # The async writer is used in async paths, and the sync writer where the session cannot await.
+        self._async_session_writer = get_async_session_writer(writer) if writer is not None else None
+        self._session_writer = self._async_session_writer.sync_writer if writer is not None else None
+
+        self.save_policy = save_policy
+        self.save_interval = save_interval
+        # A new session has not been written yet.
+        self.__is_dirty = True
+        self.__save_task: asyncio.Task | None = None
+        self.__flush_lock = asyncio.Lock()
 
     def __del__(self):
-        if self._session_writer is not None:
-            print("======Write session info.======")
+        # The attributes are missing if __init__ failed.
+        if getattr(self, "_session_writer", None) is not None and getattr(self, "_ChatSessionBase__is_dirty", False):
+            # Wait for writes still running on the writer thread, so that this write is not overwritten by them.
+            self._async_session_writer.flush_sync()
             self._session_writer.write_session_info(self.id, self._to_info_dict())
 
     @property
@@ -27,6 +62,14 @@ class ChatSessionBase(ABC):
         return self._response_generator
 
     def load(self) -> bool:
+        """
+        Load the session synchronously, blocking until the writes queued by the async writer are persisted.
+        Use aload() inside an event loop.
+        """
+        if self._async_session_writer is not None:
+            # Writes queued by the async writer must be persisted before reading through the sync writer.
+            self._async_session_writer.flush_sync()
+
         if self._session_writer is not None and self._session_writer.exists(self.id):
             dialogue = self._session_writer.read_dialogue(self.id)
             if dialogue is not None:
@@ -35,18 +78,111 @@ class ChatSessionBase(ABC):
             session_info = self._session_writer.read_session_info(self.id)
             if session_info is not None:
                 self._restore_from_info_dict(session_info)
+            self.__is_dirty = False
             return True
         else:
             return False
 
+    async def aload(self) -> bool:
+        if self._async_session_writer is None:
+            return False
+
+        # Wait for the queued writes without blocking the event loop.
+        await self._async_session_writer.flush()
+        if await self._async_session_writer.exists(self.id):
+            dialogue = await self._async_session_writer.read_dialogue(self.id)
+            if dialogue is not None:
+                self._dialog = dialogue
+
+            session_info = await self._async_session_writer.read_session_info(self.id)
+            if session_info is not None:
+                self._restore_from_info_dict(session_info)
+            self.__is_dirty = False
+            return True
+        else:
+            return False
+
+    @property
+    def is_dirty(self) -> bool:
+        return self.__is_dirty
+
     def save(self) -> bool:
+        """
+        Write session info synchronously, regardless of the save policy.
+        """
         if self._session_writer is not None:
+            self.__is_dirty = False
             session_info = self._to_info_dict()
             self._session_writer.write_session_info(self.id, session_info)
             return True
         else:
             return False
 
+    async def flush(self) -> bool:
+        """
+        Write session info if it changed since the last write. The file is written off the event loop.
+        """
+        if self._async_session_writer is None:
+            return False
+
+        async with self.__flush_lock:
+            while self.__is_dirty:
+                self.__is_dirty = False
+                # Snapshot on the event loop, since the response generator may mutate its state during the write.
+                # Serializing once is the snapshot, and the writer thread writes the bytes as they are.
+                session_info_data = get_default_json_serializer().dumps(self._to_info_dict())
+                await self._async_session_writer.write_serialized_session_info(self.id, session_info_data)
+        return True
+
+    def _mark_dirty(self):
+        if self._async_session_writer is None:
+            return
+
+        self.__is_dirty = True
+        if self.save_policy == SessionSavePolicy.OnClose:
+            return
+
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            if self.save_policy == SessionSavePolicy.Immediate:
+                self.save()
+            return
+
+        if self.__save_task is None or self.__save_task.done():
+            delay = self.save_interval if self.save_policy == SessionSavePolicy.Interval else 0
+            self.__save_task = loop.create_task(self.__flush_later(delay))
+
+    async def __flush_later(self, delay: float):
+        # Even without a delay, yield once so that consecutive changes are written together.
+        await asyncio.sleep(delay)
+        await self.flush()
+
+    def close(self):
+        """
+        Write pending session info synchronously. Use aclose() inside an event loop.
+        """
+        if self.__save_task is not None and not self.__save_task.done():
+            self.__save_task.cancel()
+        self.__save_task = None
+        if self._async_session_writer is not None:
+            # Cancelling the task does not stop a write already running on the writer thread, so wait for it.
+            self._async_session_writer.flush_sync()
+        if self.__is_dirty:
+            self.save()
+
+    async def aclose(self):
+        if self.__save_task is not None and not self.__save_task.done():
+            self.__save_task.cancel()
+            try:
+                await self.__save_task
+            except asyncio.CancelledError:
+                pass
+        self.__save_task = None
+        await self.flush()
+        if self._async_session_writer is not None:
+            await self._async_session_writer.flush()
+
     def _restore_from_info_dict(self, data: dict):
         if "response_generator" in data:
             self._response_generator.restore_from_json(data["response_generator"])
@@ -57,19 +193,43 @@ class ChatSessionBase(ABC):
         return parcel
 
     @property
-    def dialog(self):
-        return self._dialog.copy()
+    def dialog(self) -> DialogueView:
+        return DialogueView(self._dialog)
+
+    async def _apush_new_turn(self, turn: DialogueTurn):
+        self._dialog.append(turn)
+        if self._async_session_writer is not None:
+            await self._async_session_writer.write_turn(self.id, turn)
+        self._mark_dirty()
+
+    async def _apop_last_turn(self) -> DialogueTurn | None:
+        if len(self._dialog) > 0:
+            pop = self._dialog[-1]
+            # Replace the list instead of popping in place, since views of the dialogue may be alive.
+            self._dialog = self._dialog[:-1]
+            if self._async_session_writer is not None:
+                await self._async_session_writer.delete_turn(self.id, pop.id)
+            return pop
 
     def _push_new_turn(self, turn: DialogueTurn):
+        """
+        Synchronous version of _apush_new_turn, which blocks on the writer. Use _apush_new_turn in coroutines.
+        """
         self._dialog.append(turn)
         if self._session_writer is not None:
+            self._async_session_writer.flush_sync()
             self._session_writer.write_turn(self.id, turn)
-        self.save()
+        self._mark_dirty()
 
     def _pop_last_turn(self) -> DialogueTurn | None:
+        """
+        Synchronous version of _apop_last_turn, which blocks on the writer. Use _apop_last_turn in coroutines.
+        """
         if len(self._dialog) > 0:
-            pop = self._dialog.pop()
+            pop = self._dialog[-1]
+            self._dialog = self._dialog[:-1]
             if self._session_writer is not None:
+                self._async_session_writer.flush_sync()
                 self._session_writer.delete_turn(self.id, pop.id)
             return pop
 
@@ -77,27 +237,42 @@ class ChatSessionBase(ABC):
 class TurnTakingChatSession(ChatSessionBase):
 
     async def initialize(self) -> DialogueTurn:
-        self._dialog.clear()
-        initial_message, metadata, elapsed = await self._response_generator.get_response(self._dialog)
+        self._dialog = []
+        initial_message, metadata, elapsed = await self._response_generator.get_response(self.dialog)
         system_turn = DialogueTurn(message=initial_message, is_user=False, processing_time=elapsed, metadata=metadata)
-        self._push_new_turn(system_turn)
+        await self._apush_new_turn(system_turn)
         return system_turn
 
     async def push_user_message(self, user_turn: DialogueTurn) -> DialogueTurn:
-        self._push_new_turn(user_turn)
-        system_message, metadata, elapsed = await self._response_generator.get_response(self._dialog)
+        await self._apush_new_turn(user_turn)
+        system_message, metadata, elapsed = await self._response_generator.get_response(self.dialog)
         system_turn = DialogueTurn(message=system_message, is_user=False, processing_time=elapsed, metadata=metadata)
-        self._push_new_turn(system_turn)
+        await self._apush_new_turn(system_turn)
         return system_turn
 
+    async def push_user_message_stream(self, user_turn: DialogueTurn) -> AsyncIterator[DialogueTurnStreamChunk]:
+        """
+        Same as push_user_message, but yields the system response as text deltas while it is being generated.
+        The last chunk carries the system turn, persisted the same way as push_user_message.
+        """
+        await self._apush_new_turn(user_turn)
+        async for chunk in self._response_generator.get_response_stream(self.dialog):
+            if chunk.is_final:
+                system_turn = DialogueTurn(message=chunk.message, is_user=False, processing_time=chunk.processing_time,
+                                           metadata=chunk.metadata)
+                await self._apush_new_turn(system_turn)
+                yield DialogueTurnStreamChunk(turn=system_turn)
+            else:
+                yield DialogueTurnStreamChunk(delta=chunk.delta)
+
     async def regenerate_last_system_message(self) -> DialogueTurn | None:
         if len(self.dialog) > 0 and self.dialog[len(self.dialog) - 1].is_user is False:
-            popped_system_turn = self._pop_last_turn()
-            system_message, metadata, elapsed = await self._response_generator.get_response(self._dialog, dry=True)
+            popped_system_turn = await self._apop_last_turn()
+            system_message, metadata, elapsed = await self._response_generator.get_response(self.dialog, dry=True)
             metadata = set_nested_value(metadata, "regenerated", True)
             metadata = set_nested_value(metadata, "original_turn", popped_system_turn.__dict__)
             new_system_turn = DialogueTurn(message=system_message, is_user=False, processing_time=elapsed, metadata=metadata)
-            self._push_new_turn(new_system_turn)
+            await self._apush_new_turn(new_system_turn)
             return new_system_turn
         else:
             return None
@@ -108,9 +283,11 @@ class MultiAgentChatSession(ChatSessionBase):
     def __init__(self, id: str,
                  response_generator: ResponseGenerator,
                  user_generator: ResponseGenerator,
-                 session_writer: SessionWriterBase | None = session_writer
+                 session_writer: SessionWriterBase | AsyncSessionWriterBase | None = session_writer,
+                 save_policy: SessionSavePolicy = SessionSavePolicy.Immediate,
+                 save_interval: float = 5.0
                  ):
-        super().__init__(id, response_generator, session_writer)
+        super().__init__(id, response_generator, session_writer, save_policy, save_interval)
         self.__user_generator = user_generator
 
         self.__is_running = False
@@ -143,7 +320,7 @@ class MultiAgentChatSession(ChatSessionBase):
                                     max_turns: int,
                                     on_message: Callable[[DialogueTurn], None]
                                     ) -> Dialogue:
-        self.dialog.clear()
+        self._dialog = []
         self.__is_running = True
         self.__is_stop_requested = False
 
@@ -152,7 +329,7 @@ class MultiAgentChatSession(ChatSessionBase):
             turn_count += 1
             system_message, payload, elapsed = await self._response_generator.get_response(self.dialog)
             system_turn = DialogueTurn(message=system_message, is_user=False, processing_time=elapsed, metadata=payload)
-            self._push_new_turn(system_turn)
+            await self._apush_new_turn(system_turn)
             on_message(system_turn)
 
             role_reverted_dialog = [DialogueTurn(message=turn.message, is_user=turn.is_user is False) for turn in
@@ -161,7 +338,7 @@ class MultiAgentChatSession(ChatSessionBase):
             user_message, payload, elapsed = await self.__user_generator.get_response(role_reverted_dialog)
 
             user_turn = DialogueTurn(message=user_message, is_user=True, processing_time=elapsed, metadata=payload)
-            self._push_new_turn(user_turn)
+            await self._apush_new_turn(user_turn)
             on_message(user_turn)
 
-        return self.dialog
+        return self._dialog.copy()
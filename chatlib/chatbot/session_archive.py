@@ -0,0 +1,216 @@
+import gzip
+from os import path, makedirs
+from typing import Iterator, Iterable, Any
+
+from chatlib.utils.json_serializer import JSONSerializer, get_default_json_serializer
+from .session_writer import SessionWriterBase
+from .types import DialogueTurn, Dialogue
+
+# An archive is a directory with a manifest.json and shards. Each shard stores every turn column in its own gzipped
+# NDJSON file (one value per line, aligned by line), so a subset of columns is read without touching the others.
+# Session info dicts are stored in a separate gzipped NDJSON file per shard.
+
+ARCHIVE_FORMAT_VERSION = 1
+
+TURN_COLUMNS = ["session_id", "id", "message", "is_user", "timestamp", "processing_time", "metadata"]
+
+_MANIFEST_FILE_NAME = "manifest.json"
+
+
+def _get_column_file_name(shard_index: int, column: str) -> str:
+    return f"turns-{shard_index:05d}.{column}.ndjson.gz"
+
+
+def _get_session_file_name(shard_index: int) -> str:
+    return f"sessions-{shard_index:05d}.ndjson.gz"
+
+
+class SessionArchiveWriter:
+    """
+    Streams sessions into an archive. Shards are rolled over every shard_size turns, and only the lines of the
+    current shard are buffered in memory.
+    """
+
+    def __init__(self, dir_path: str, shard_size: int = 100000, compress_level: int = 6,
+                 serializer: JSONSerializer | None = None):
+        self.dir_path = dir_path
+        self.shard_size = shard_size
+        self.compress_level = compress_level
+        self.__serializer = serializer or get_default_json_serializer()
+
+        if not path.exists(dir_path):
+            makedirs(dir_path)
+
+        self.__shards: list[dict] = []
+        self.__column_files: dict[str, gzip.GzipFile] | None = None
+        self.__session_file: gzip.GzipFile | None = None
+        self.__shard_turn_count = 0
+        self.__shard_session_count = 0
+        self.__is_closed = False
+
+    def __enter__(self) -> 'SessionArchiveWriter':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __open_file(self, file_name: str) -> gzip.GzipFile:
+        return gzip.open(path.join(self.dir_path, file_name), "wb", compresslevel=self.compress_level)
+
+    def __open_shard(self):
+        shard_index = len(self.__shards)
+        self.__column_files = {column: self.__open_file(_get_column_file_name(shard_index, column))
+                               for column in TURN_COLUMNS}
+        self.__session_file = self.__open_file(_get_session_file_name(shard_index))
+        self.__shard_turn_count = 0
+        self.__shard_session_count = 0
+
+    def __close_shard(self):
+        if self.__column_files is not None:
+            for file in self.__column_files.values():
+                file.close()
+            self.__session_file.close()
+            self.__shards.append(dict(index=len(self.__shards), turns=self.__shard_turn_count,
+                                      sessions=self.__shard_session_count))
+            self.__column_files = None
+            self.__session_file = None
+
+    def add_session(self, session_id: str, dialogue: Iterable[DialogueTurn], info: dict | None = None):
+        if self.__is_closed:
+            raise ValueError("The archive writer is already closed.")
+
+        if self.__column_files is None:
+            self.__open_shard()
+        elif self.__shard_turn_count >= self.shard_size:
+            self.__close_shard()
+            self.__open_shard()
+
+        dumps = self.__serializer.dumps
+        columns: dict[str, list[bytes]] = {column: [] for column in TURN_COLUMNS}
+        session_id_line = dumps(session_id)
+        for turn in dialogue:
+            columns["session_id"].append(session_id_line)
+            columns["id"].append(dumps(turn.id))
+            columns["message"].append(dumps(turn.message))
+            columns["is_user"].append(dumps(turn.is_user))
+            columns["timestamp"].append(dumps(turn.timestamp))
+            columns["processing_time"].append(dumps(turn.processing_time))
+            columns["metadata"].append(dumps(turn.metadata))
+
+        for column, lines in columns.items():
+            if len(lines) > 0:
+                self.__column_files[column].write(b"\n".join(lines) + b"\n")
+
+        self.__session_file.write(dumps(dict(id=session_id, info=info, turns=len(columns["id"]))) + b"\n")
+        self.__shard_turn_count += len(columns["id"])
+        self.__shard_session_count += 1
+
+    def add_from_writer(self, writer: SessionWriterBase, session_ids: Iterable[str]):
+        """
+        Export sessions stored by a session writer.
+        """
+        for session_id in session_ids:
+            dialogue = writer.read_dialogue(session_id) or []
+            info = writer.read_session_info(session_id) if writer.exists(session_id) else None
+            self.add_session(session_id, dialogue, info)
+
+    def close(self):
+        if self.__is_closed:
+            return
+        self.__close_shard()
+        with open(path.join(self.dir_path, _MANIFEST_FILE_NAME), "wb") as f:
+            f.write(self.__serializer.dumps(dict(version=ARCHIVE_FORMAT_VERSION, columns=TURN_COLUMNS,
+                                                 shards=self.__shards)))
+        self.__is_closed = True
+
+
+class SessionArchiveReader:
+
+    def __init__(self, dir_path: str, serializer: JSONSerializer | None = None):
+        self.dir_path = dir_path
+        self.__serializer = serializer or get_default_json_serializer()
+        with open(path.join(dir_path, _MANIFEST_FILE_NAME), "rb") as f:
+            self.__manifest = self.__serializer.loads(f.read())
+
+        if self.__manifest["version"] > ARCHIVE_FORMAT_VERSION:
+            raise ValueError(f"Unsupported archive version: {self.__manifest['version']}")
+
+    @property
+    def columns(self) -> list[str]:
+        return list(self.__manifest["columns"])
+
+    @property
+    def turn_count(self) -> int:
+        return sum([shard["turns"] for shard in self.__manifest["shards"]])
+
+    @property
+    def session_count(self) -> int:
+        return sum([shard["sessions"] for shard in self.__manifest["shards"]])
+
+    def __iter_lines(self, file_name: str) -> Iterator[bytes]:
+        with gzip.open(path.join(self.dir_path, file_name), "rb") as f:
+            for line in f:
+                yield line
+
+    def iter_rows(self, columns: list[str] | None = None) -> Iterator[dict[str, Any]]:
+        """
+        Stream turn rows with only the given columns. Files of the other columns are not read.
+        """
+        columns = columns or self.columns
+        for column in columns:
+            if column not in self.__manifest["columns"]:
+                raise KeyError(f"Unknown column: {column}")
+
+        loads = self.__serializer.loads
+        for shard in self.__manifest["shards"]:
+            line_iterators = [self.__iter_lines(_get_column_file_name(shard["index"], column)) for column in columns]
+            for lines in zip(*line_iterators):
+                yield {column: loads(line) for column, line in zip(columns, lines)}
+
+    def read_column(self, column: str) -> list[Any]:
+        return [row[column] for row in self.iter_rows([column])]
+
+    def iter_session_infos(self) -> Iterator[tuple[str, dict | None]]:
+        loads = self.__serializer.loads
+        for shard in self.__manifest["shards"]:
+            for line in self.__iter_lines(_get_session_file_name(shard["index"])):
+                row = loads(line)
+                yield row["id"], row["info"]
+
+    def iter_sessions(self) -> Iterator[tuple[str, Dialogue, dict | None]]:
+        """
+        Stream sessions one at a time as (session id, dialogue, session info).
+        """
+        loads = self.__serializer.loads
+        turn_columns = [column for column in TURN_COLUMNS if column != "session_id"]
+        for shard in self.__manifest["shards"]:
+            turn_rows = zip(*[self.__iter_lines(_get_column_file_name(shard["index"], column))
+                              for column in turn_columns])
+            for line in self.__iter_lines(_get_session_file_name(shard["index"])):
+                session = loads(line)
+                dialogue = []
+                for _ in range(session["turns"]):
+                    values = next(turn_rows)
+                    dialogue.append(DialogueTurn.model_validate(
+                        {column: loads(value) for column, value in zip(turn_columns, values)}))
+                yield session["id"], dialogue, session["info"]
+
+    def import_into(self, writer: SessionWriterBase, overwrite: bool = False) -> int:
+        """
+        Write the sessions of the archive through a session writer.
+        :param overwrite: Clear existing sessions with the same ids first. Otherwise, existing sessions are skipped.
+        :return: The number of imported sessions.
+        """
+        count = 0
+        for session_id, dialogue, info in self.iter_sessions():
+            if writer.exists(session_id) and not overwrite:
+                continue
+            # Also clears turns without session info (exists() is False for them), e.g., of an earlier import.
+            writer.clear_data(session_id)
+
+            for turn in dialogue:
+                writer.write_turn(session_id, turn)
+            if info is not None:
+                writer.write_session_info(session_id, info)
+            count += 1
+        return count
@@ -0,0 +1,157 @@
+import sqlite3
+from os import path, getcwd, makedirs
+from threading import Lock
+from time import time
+
+from chatlib.utils.json_serializer import JSONSerializer, get_default_json_serializer
+from .session_writer import SessionWriterBase
+from .types import DialogueTurn, Dialogue
+
+
+class SessionSQLiteWriter(SessionWriterBase):
+    """
+    Stores all sessions in a single SQLite database in WAL mode, instead of a directory per session.
+    """
+
+    # SQLite limits the number of bound variables in a query.
+    __MAX_QUERY_VARIABLES = 900
+
+    def __init__(self, db_path: str | None = None, serializer: JSONSerializer | None = None):
+        """
+        :param serializer: JSON serializer for session info and turn metadata. Defaults to the fastest one available.
+        """
+        self.__serializer = serializer or get_default_json_serializer()
+        db_path = db_path or path.join(getcwd(), "data/sessions.db")
+        dir_path = path.dirname(db_path)
+        if dir_path != "" and not path.exists(dir_path):
+            makedirs(dir_path)
+
+        self.__lock = Lock()
+        self.__connection = sqlite3.connect(db_path, check_same_thread=False)
+        self.__connection.row_factory = sqlite3.Row
+        with self.__connection:
+            self.__connection.execute("PRAGMA journal_mode=WAL")
+            self.__connection.execute("PRAGMA synchronous=NORMAL")
+            self.__connection.execute("""CREATE TABLE IF NOT EXISTS sessions (
+                id TEXT PRIMARY KEY,
+                info TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            )""")
+            self.__connection.execute("""CREATE TABLE IF NOT EXISTS turns (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id TEXT NOT NULL,
+                id TEXT NOT NULL,
+                message TEXT NOT NULL,
+                is_user INTEGER NOT NULL,
+                timestamp INTEGER NOT NULL,
+                processing_time INTEGER,
+                metadata TEXT
+            )""")
+            self.__connection.execute("CREATE INDEX IF NOT EXISTS turns_session_id_seq ON turns (session_id, seq)")
+            self.__connection.execute("CREATE INDEX IF NOT EXISTS turns_id ON turns (id)")
+            self.__connection.execute("CREATE INDEX IF NOT EXISTS turns_timestamp ON turns (timestamp)")
+            self.__connection.execute("CREATE INDEX IF NOT EXISTS sessions_updated_at ON sessions (updated_at)")
+
+    def __dumps(self, obj) -> str:
+        # Stored as TEXT, so that the columns stay readable with the JSON functions of SQLite.
+        return self.__serializer.dumps(obj).decode("utf-8")
+
+    def __turn_to_row(self, session_id: str, turn: DialogueTurn) -> tuple:
+        return (session_id, turn.id, turn.message, turn.is_user, turn.timestamp, turn.processing_time,
+                self.__dumps(turn.metadata) if turn.metadata is not None else None)
+
+    def __row_to_turn(self, row: sqlite3.Row) -> DialogueTurn:
+        return DialogueTurn(id=row["id"], message=row["message"], is_user=bool(row["is_user"]),
+                            timestamp=row["timestamp"], processing_time=row["processing_time"],
+                            metadata=self.__serializer.loads(row["metadata"]) if row["metadata"] is not None else None)
+
+    def __insert_turns(self, session_id: str, turns: Dialogue):
+        self.__connection.executemany("""INSERT INTO turns
+            (session_id, id, message, is_user, timestamp, processing_time, metadata) VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                                      [self.__turn_to_row(session_id, turn) for turn in turns])
+
+    def exists(self, session_id: str) -> bool:
+        with self.__lock:
+            return self.__connection.execute("SELECT 1 FROM sessions WHERE id = ?", (session_id,)).fetchone() is not None
+
+    def write_turn(self, session_id: str, turn: DialogueTurn):
+        with self.__lock, self.__connection:
+            self.__insert_turns(session_id, [turn])
+
+    def delete_turn(self, session_id: str, turn_id: str) -> DialogueTurn | None:
+        with self.__lock, self.__connection:
+            row = self.__connection.execute(
+                "SELECT * FROM turns WHERE session_id = ? AND id = ? ORDER BY seq DESC LIMIT 1",
+                (session_id, turn_id)).fetchone()
+            if row is None:
+                return None
+            self.__connection.execute("DELETE FROM turns WHERE seq = ?", (row["seq"],))
+            return self.__row_to_turn(row)
+
+    def read_dialogue(self, session_id: str) -> Dialogue | None:
+        """
+        :return: None if the session has no turns, as SessionFileWriter does without a dialogue file.
+        """
+        return self.read_dialogues([session_id]).get(session_id)
+
+    def read_dialogues(self, session_ids: list[str]) -> dict[str, Dialogue]:
+        """
+        Read the dialogues of many sessions in a few queries. Sessions without turns are omitted.
+        """
+        dialogues: dict[str, Dialogue] = dict()
+        with self.__lock:
+            for start in range(0, len(session_ids), self.__MAX_QUERY_VARIABLES):
+                chunk = session_ids[start:start + self.__MAX_QUERY_VARIABLES]
+                rows = self.__connection.execute(
+                    f"SELECT * FROM turns WHERE session_id IN ({','.join('?' * len(chunk))}) ORDER BY session_id, seq",
+                    chunk)
+                for row in rows:
+                    dialogues.setdefault(row["session_id"], []).append(self.__row_to_turn(row))
+        return dialogues
+
+    def write_dialogue(self, session_id: str, dialog: Dialogue):
+        with self.__lock, self.__connection:
+            self.__connection.execute("DELETE FROM turns WHERE session_id = ?", (session_id,))
+            self.__insert_turns(session_id, dialog)
+
+    def write_session_info(self, session_id, session_info: dict):
+        with self.__lock, self.__connection:
+            self.__connection.execute("INSERT OR REPLACE INTO sessions (id, info, updated_at) VALUES (?, ?, ?)",
+                                      (session_id, self.__dumps(session_info), time()))
+
+    def write_serialized_session_info(self, session_id, data: bytes):
+        with self.__lock, self.__connection:
+            self.__connection.execute("INSERT OR REPLACE INTO sessions (id, info, updated_at) VALUES (?, ?, ?)",
+                                      (session_id, data.decode("utf-8"), time()))
+
+    def read_session_info(self, session_id) -> dict | None:
+        with self.__lock:
+            row = self.__connection.execute("SELECT info FROM sessions WHERE id = ?", (session_id,)).fetchone()
+        return self.__serializer.loads(row["info"]) if row is not None else None
+
+    def list_sessions(self, limit: int = 100, after: str | None = None) -> list[str]:
+        """
+        List session ids in ascending order, a page at a time.
+        :param after: The last session id of the previous page.
+        """
+        with self.__lock:
+            if after is None:
+                rows = self.__connection.execute("SELECT id FROM sessions ORDER BY id LIMIT ?", (limit,))
+            else:
+                rows = self.__connection.execute("SELECT id FROM sessions WHERE id > ? ORDER BY id LIMIT ?",
+                                                 (after, limit))
+            return [row["id"] for row in rows]
+
+    def count_sessions(self) -> int:
+        with self.__lock:
+            return self.__connection.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+    def clear_data(self, session_id) -> bool:
+        with self.__lock, self.__connection:
+            deleted_turns = self.__connection.execute("DELETE FROM turns WHERE session_id = ?", (session_id,)).rowcount
+            deleted_sessions = self.__connection.execute("DELETE FROM sessions WHERE id = ?", (session_id,)).rowcount
+            return deleted_turns + deleted_sessions > 0
+
+    def close(self):
+        with self.__lock:
+            self.__connection.close()
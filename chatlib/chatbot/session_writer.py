@@ -1,10 +1,17 @@
-import json
+import asyncio
+import os
 import shutil
 from abc import ABC, abstractmethod
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future, wait
 from os import path, getcwd, makedirs
+from tempfile import NamedTemporaryFile
+from threading import Lock, local
+from typing import Iterator, Iterable, Callable, TypeVar, Hashable
+from weakref import WeakKeyDictionary
 
-import jsonlines
-
+from chatlib.utils.json_serializer import JSONSerializer, get_default_json_serializer
+from .compact_dialogue import CompactDialogue
 from .types import DialogueTurn, Dialogue
 
 
@@ -34,6 +41,13 @@ class SessionWriterBase(ABC):
     def write_session_info(self, session_id, session_info: dict):
         pass
 
+    def write_serialized_session_info(self, session_id, data: bytes):
+        """
+        Write session info already serialized to JSON, e.g., snapshotted on the event loop.
+        Writers that store JSON override this to skip deserializing it.
+        """
+        self.write_session_info(session_id, get_default_json_serializer().loads(data))
+
     @abstractmethod
     def read_session_info(self, session_id) -> dict:
         pass
@@ -43,7 +57,95 @@ class SessionWriterBase(ABC):
         pass
 
 
+# A row of dialogue.jsonl with this key marks the deletion of the turn with the given id.
+TOMBSTONE_KEY = "__deleted_turn_id"
+
+
+def _read_lines_reversed(file_path: str, chunk_size: int = 65536) -> Iterator[bytes]:
+    with open(file_path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        position = f.tell()
+        remainder = b""
+        while position > 0:
+            read_size = min(chunk_size, position)
+            position -= read_size
+            f.seek(position)
+            lines = (f.read(read_size) + remainder).split(b"\n")
+            remainder = lines.pop(0)
+            for line in reversed(lines):
+                if len(line.strip()) > 0:
+                    yield line
+        if len(remainder.strip()) > 0:
+            yield remainder
+
+
+def _replay_dialogue_log(rows: Iterable[dict]) -> tuple[list[dict], int]:
+    """
+    :return: The turn rows left after applying the tombstones, and the number of tombstones.
+    """
+    turn_rows: dict[str, dict] = dict()
+    tombstone_count = 0
+    for row in rows:
+        if TOMBSTONE_KEY in row:
+            turn_rows.pop(row[TOMBSTONE_KEY], None)
+            tombstone_count += 1
+        else:
+            turn_rows.pop(row["id"], None)
+            turn_rows[row["id"]] = row
+    return list(turn_rows.values()), tombstone_count
+
+
 class SessionFileWriter(SessionWriterBase):
+    """
+    Stores each session in a directory with info.json and dialogue.jsonl.
+    dialogue.jsonl is an append-only log: a deletion appends a tombstone row, and the log is rewritten
+    without the deleted turns once the number of tombstones reaches the compaction threshold.
+    """
+
+    def __init__(self, compaction_threshold: int = 32, serializer: JSONSerializer | None = None,
+                 fsync: bool = False, trusted_rows: bool = False):
+        """
+        :param serializer: JSON serializer for the files. Defaults to the fastest one available.
+        :param trusted_rows: Create turns read from the files with DialogueTurn.model_construct, without validation.
+        Only for files written by this writer. Off by default, since with pydantic 2 the validation runs in the
+        compiled core and is faster than model_construct (see benchmark_session_writer.py).
+        :param fsync: Flush rewritten files to the disk before replacing the old ones, so that they survive a power
+        loss. Off by default, since every session info write would wait for the disk. Files are replaced
+        atomically either way, so a crashed process never leaves a partial file.
+        """
+        self.compaction_threshold = compaction_threshold
+        self.fsync = fsync
+        self.trusted_rows = trusted_rows
+        self.__serializer = serializer or get_default_json_serializer()
+        self.__tombstone_counts: dict[str, int] = dict()
+        # One lock per session, so that writes to different sessions run in parallel.
+        self.__locks: dict[str, Lock] = dict()
+
+    def __row_to_turn(self, row: dict) -> DialogueTurn:
+        if self.trusted_rows:
+            return DialogueTurn.model_construct(**row)
+        else:
+            return DialogueTurn.model_validate(row)
+
+    def __get_lock(self, session_id: str) -> Lock:
+        # setdefault is atomic, so concurrent callers get the same lock.
+        return self.__locks.setdefault(session_id, Lock())
+
+    def __read_log(self, file_path: str) -> tuple[list[dict], int]:
+        """
+        :return: The live turn rows of the dialogue log and the number of tombstones in it.
+        """
+        with open(file_path, "rb") as f:
+            data = f.read()
+        rows = [self.__serializer.loads(line) for line in data.splitlines() if len(line.strip()) > 0]
+        if TOMBSTONE_KEY.encode("utf-8") in data:
+            return _replay_dialogue_log(rows)
+        else:
+            return rows, 0
+
+    def __append_rows(self, file_path: str, rows: Iterable[dict]):
+        with open(file_path, "ab") as f:
+            f.write(b"".join([self.__serializer.dumps(row) + b"\n" for row in rows]))
 
     @staticmethod
     def __get_dialogue_directory_path(session_id: str, create: bool = False) -> str:
@@ -66,46 +168,117 @@ class SessionFileWriter(SessionWriterBase):
         return path.exists(self.__get_session_info_file_path(session_id))
 
     def write_session_info(self, session_id, session_info: dict):
-        with open(self.__get_session_info_file_path(session_id, True), "w", encoding='utf-8') as f:
-            json.dump(session_info, f, indent=2)
+        # Atomic, since info may be written from the writer thread and from synchronous close() of a session.
+        self.__write_file_atomic(self.__get_session_info_file_path(session_id, True),
+                                 self.__serializer.dumps(session_info))
+
+    def write_serialized_session_info(self, session_id, data: bytes):
+        self.__write_file_atomic(self.__get_session_info_file_path(session_id, True), data)
 
     def read_session_info(self, session_id) -> dict:
-        with open(self.__get_session_info_file_path(session_id), 'r', encoding='utf-8') as f:
-            return json.load(f)
+        with open(self.__get_session_info_file_path(session_id), 'rb') as f:
+            return self.__serializer.loads(f.read())
 
     def write_turn(self, session_id: str, turn: DialogueTurn):
-        with jsonlines.open(self.__get_dialogue_file_path(session_id, True), 'a') as writer:
-            writer.write(turn.__dict__)
+        with self.__get_lock(session_id):
+            self.__append_rows(self.__get_dialogue_file_path(session_id, True), [turn.__dict__])
+
+    def write_turns(self, session_id: str, turns: Dialogue):
+        with self.__get_lock(session_id):
+            self.__append_rows(self.__get_dialogue_file_path(session_id, True), [turn.__dict__ for turn in turns])
 
     def delete_turn(self, session_id: str, turn_id: str) -> DialogueTurn | None:
-        dialogue = self.read_dialogue(session_id)
-        deleted_turn = None
-        for i, turn in enumerate(dialogue):
-            if turn.id == turn_id:
-                deleted_turn = dialogue.pop(i)
-                break
+        fp = self.__get_dialogue_file_path(session_id)
+        if not path.exists(fp):
+            return None
+
+        with self.__get_lock(session_id):
+            deleted_turn = self.__find_live_turn(fp, turn_id)
+            if deleted_turn is None:
+                return None
 
-        if deleted_turn is not None:
-            self.write_dialogue(session_id, dialogue)
+            self.__append_rows(fp, [{TOMBSTONE_KEY: turn_id}])
+
+            tombstone_count = self.__tombstone_counts.get(session_id, 0) + 1
+            self.__tombstone_counts[session_id] = tombstone_count
+            if tombstone_count >= self.compaction_threshold:
+                self.__compact(session_id)
 
         return deleted_turn
 
+    def __find_live_turn(self, file_path: str, turn_id: str) -> DialogueTurn | None:
+        # Deleted turns are mostly the latest ones (e.g., regeneration), so scan from the end of the log.
+        # The latest row about the turn decides whether it is alive.
+        for line in _read_lines_reversed(file_path):
+            row = self.__serializer.loads(line)
+            if row.get(TOMBSTONE_KEY) == turn_id:
+                return None
+            elif row.get("id") == turn_id:
+                return self.__row_to_turn(row)
+        return None
+
     def read_dialogue(self, session_id: str) -> Dialogue | None:
         fp = self.__get_dialogue_file_path(session_id)
         if path.exists(fp):
-            with jsonlines.open(fp, "r") as reader:
-                return [DialogueTurn(**row) for row in reader]
+            rows, tombstone_count = self.__read_log(fp)
+            self.__tombstone_counts[session_id] = tombstone_count
+            return [self.__row_to_turn(row) for row in rows]
         else:
             return None
 
+    def read_compact_dialogue(self, session_id: str) -> CompactDialogue | None:
+        """
+        Read the dialogue into a CompactDialogue, without creating a DialogueTurn for each row.
+        """
+        fp = self.__get_dialogue_file_path(session_id)
+        if path.exists(fp):
+            rows, _ = self.__read_log(fp)
+            return CompactDialogue.from_rows(rows)
+        else:
+            return None
+
+    def compact(self, session_id: str):
+        """
+        Rewrite the dialogue log without tombstones and deleted turns.
+        """
+        with self.__get_lock(session_id):
+            self.__compact(session_id)
+
+    def __compact(self, session_id: str):
+        dialogue = self.read_dialogue(session_id)
+        if dialogue is not None:
+            self.__write_dialogue_atomic(self.__get_dialogue_file_path(session_id), dialogue)
+            self.__tombstone_counts[session_id] = 0
+
+    def __write_dialogue_atomic(self, file_path: str, dialog: Dialogue):
+        self.__write_file_atomic(file_path, b"".join([self.__serializer.dumps(turn.__dict__) + b"\n" for turn in dialog]))
+
+    def __write_file_atomic(self, file_path: str, data: bytes):
+        # Write to a temporary file in the same directory and swap it in, so a crash never leaves a partial file.
+        with NamedTemporaryFile("wb", dir=path.dirname(file_path), suffix=".tmp", delete=False) as f:
+            temp_path = f.name
+            try:
+                f.write(data)
+                if self.fsync:
+                    f.flush()
+                    os.fsync(f.fileno())
+            except BaseException:
+                f.close()
+                os.remove(temp_path)
+                raise
+        os.replace(temp_path, file_path)
+
     def write_dialogue(self, session_id: str, dialog: Dialogue):
         fp = self.__get_dialogue_file_path(session_id)
         if path.exists(fp):
-            with jsonlines.open(fp, "w") as writer:
-                writer.write_all([turn.__dict__ for turn in dialog])
+            with self.__get_lock(session_id):
+                self.__write_dialogue_atomic(fp, dialog)
+                self.__tombstone_counts[session_id] = 0
 
     def clear_data(self, session_id) -> bool:
         dir_path = SessionFileWriter.__get_dialogue_directory_path(session_id)
+        self.__tombstone_counts.pop(session_id, None)
+        self.__locks.pop(session_id, None)
         if path.exists(dir_path):
             try:
                 shutil.rmtree(dir_path)
@@ -118,3 +291,303 @@ class SessionFileWriter(SessionWriterBase):
 
 
 session_writer = SessionFileWriter()
+
+
+##################
+
+T = TypeVar('T')
+
+
+class AsyncSessionWriterBase(ABC):
+
+    @property
+    def sync_writer(self) -> SessionWriterBase | None:
+        """
+        A synchronous writer over the same storage, used where a session cannot await (e.g., __del__).
+        """
+        return None
+
+    @abstractmethod
+    async def exists(self, session_id: str) -> bool:
+        pass
+
+    @abstractmethod
+    async def write_turn(self, session_id: str, turn: DialogueTurn):
+        pass
+
+    @abstractmethod
+    async def delete_turn(self, session_id: str, turn_id: str) -> DialogueTurn | None:
+        pass
+
+    @abstractmethod
+    async def read_dialogue(self, session_id: str) -> Dialogue | None:
+        pass
+
+    @abstractmethod
+    async def write_dialogue(self, session_id: str, dialog: Dialogue):
+        pass
+
+    @abstractmethod
+    async def write_session_info(self, session_id, session_info: dict):
+        pass
+
+    async def write_serialized_session_info(self, session_id, data: bytes):
+        """
+        Write session info already serialized to JSON, so that the caller's snapshot is not copied again.
+        """
+        await self.write_session_info(session_id, get_default_json_serializer().loads(data))
+
+    @abstractmethod
+    async def read_session_info(self, session_id) -> dict:
+        pass
+
+    @abstractmethod
+    async def clear_data(self, session_id) -> bool:
+        pass
+
+    async def flush(self):
+        """
+        Wait until all writes requested so far are persisted.
+        """
+        pass
+
+    def flush_sync(self):
+        """
+        Block until all writes requested so far are persisted, for callers that cannot await and are about to use
+        sync_writer directly.
+        """
+        pass
+
+    async def aclose(self):
+        await self.flush()
+
+
+_writer_thread_state = local()
+
+
+def _mark_writer_thread():
+    _writer_thread_state.is_writer_thread = True
+
+
+def _is_writer_thread() -> bool:
+    return getattr(_writer_thread_state, "is_writer_thread", False)
+
+
+class _KeyedSerialExecutor:
+    """
+    Runs functions on a thread pool. Functions submitted with the same key run one at a time in the submitted order,
+    while those with different keys run in parallel.
+    """
+
+    def __init__(self, max_workers: int):
+        self.__executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="session-writer",
+                                             initializer=_mark_writer_thread)
+        self.__queues: dict[Hashable, deque[tuple[Future, Callable, tuple]]] = dict()
+        self.__last_futures: dict[Hashable, Future] = dict()
+        self.__lock = Lock()
+
+    def submit(self, key: Hashable, func: Callable[..., T], *args) -> Future:
+        future = Future()
+        with self.__lock:
+            self.__last_futures[key] = future
+            queue = self.__queues.get(key)
+            if queue is None:
+                # No function of the key is running, so start draining its queue on a worker.
+                self.__queues[key] = deque([(future, func, args)])
+                self.__executor.submit(self.__drain, key)
+            else:
+                queue.append((future, func, args))
+        return future
+
+    def __drain(self, key: Hashable):
+        while True:
+            with self.__lock:
+                queue = self.__queues[key]
+                if len(queue) == 0:
+                    del self.__queues[key]
+                    if self.__last_futures.get(key) is not None and self.__last_futures[key].done():
+                        del self.__last_futures[key]
+                    return
+                future, func, args = queue.popleft()
+
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(func(*args))
+                except BaseException as e:
+                    future.set_exception(e)
+
+    def get_pending_futures(self) -> list[Future]:
+        """
+        :return: The last submitted future of each key. When they are done, all functions submitted so far are done.
+        """
+        with self.__lock:
+            return list(self.__last_futures.values())
+
+
+class SyncSessionWriterAdapter(AsyncSessionWriterBase):
+    """
+    Runs a synchronous writer on a thread pool. Operations on the same session run one at a time in the requested
+    order, and operations on different sessions run in parallel. The writer must be thread-safe.
+    """
+
+    def __init__(self, writer: SessionWriterBase, max_workers: int = 4):
+        self.__writer = writer
+        self.__executor = _KeyedSerialExecutor(max_workers)
+
+    @property
+    def sync_writer(self) -> SessionWriterBase | None:
+        return self.__writer
+
+    def _submit(self, session_id: str, func: Callable[..., T], *args) -> asyncio.Future:
+        # Queued right away, so the order of calls is the order of execution within the session.
+        return asyncio.wrap_future(self.__executor.submit(session_id, func, *args))
+
+    def _submit_sync(self, session_id: str, func: Callable[..., T], *args) -> Future:
+        return self.__executor.submit(session_id, func, *args)
+
+    async def _run(self, session_id: str, func: Callable[..., T], *args) -> T:
+        return await self._submit(session_id, func, *args)
+
+    async def exists(self, session_id: str) -> bool:
+        return await self._run(session_id, self.__writer.exists, session_id)
+
+    async def write_turn(self, session_id: str, turn: DialogueTurn):
+        await self._run(session_id, self.__writer.write_turn, session_id, turn)
+
+    async def delete_turn(self, session_id: str, turn_id: str) -> DialogueTurn | None:
+        return await self._run(session_id, self.__writer.delete_turn, session_id, turn_id)
+
+    async def read_dialogue(self, session_id: str) -> Dialogue | None:
+        return await self._run(session_id, self.__writer.read_dialogue, session_id)
+
+    async def write_dialogue(self, session_id: str, dialog: Dialogue):
+        await self._run(session_id, self.__writer.write_dialogue, session_id, dialog)
+
+    async def write_session_info(self, session_id, session_info: dict):
+        await self._run(session_id, self.__writer.write_session_info, session_id, session_info)
+
+    async def write_serialized_session_info(self, session_id, data: bytes):
+        await self._run(session_id, self.__writer.write_serialized_session_info, session_id, data)
+
+    async def read_session_info(self, session_id) -> dict:
+        return await self._run(session_id, self.__writer.read_session_info, session_id)
+
+    async def clear_data(self, session_id) -> bool:
+        return await self._run(session_id, self.__writer.clear_data, session_id)
+
+    async def flush(self):
+        # Errors are raised by the operations themselves, to their own callers.
+        await asyncio.gather(*[asyncio.wrap_future(future) for future in self.__executor.get_pending_futures()],
+                             return_exceptions=True)
+
+    def flush_sync(self):
+        if _is_writer_thread():
+            # E.g., a session garbage-collected on a writer thread. Waiting for writer threads there may deadlock.
+            return
+        wait(self.__executor.get_pending_futures())
+
+
+class AsyncSessionFileWriter(SyncSessionWriterAdapter):
+    """
+    An asynchronous SessionFileWriter that batches turn writes.
+    write_turn returns immediately; the turns of a session queued within max_batch_delay are appended to the log with
+    a single file open. Any other operation on the session first submits its queued turns, so the order of operations
+    is kept. A failed batch is raised from the next awaited operation, e.g., flush().
+    """
+
+    def __init__(self, writer: SessionFileWriter | None = None, max_batch_delay: float = 0.05, max_workers: int = 4):
+        self.__file_writer = writer or SessionFileWriter()
+        super().__init__(self.__file_writer, max_workers)
+        self.max_batch_delay = max_batch_delay
+        self.__pending_turns: dict[str, Dialogue] = dict()
+        self.__batch_task: asyncio.Task | None = None
+        self.__batch_error: BaseException | None = None
+
+    def __take_pending_turns(self, session_id: str | None = None) -> dict[str, Dialogue]:
+        """
+        :param session_id: If given, only the turns of the session are taken.
+        """
+        if session_id is None:
+            pending_turns = self.__pending_turns
+            self.__pending_turns = dict()
+            return pending_turns
+        elif session_id in self.__pending_turns:
+            return {session_id: self.__pending_turns.pop(session_id)}
+        else:
+            return dict()
+
+    def __submit_pending_turns(self, session_id: str | None = None) -> list[asyncio.Future]:
+        futures = [super(AsyncSessionFileWriter, self)._submit(sid, self.__file_writer.write_turns, sid, turns)
+                   for sid, turns in self.__take_pending_turns(session_id).items()]
+        for future in futures:
+            future.add_done_callback(self.__record_batch_error)
+        return futures
+
+    def __record_batch_error(self, future: asyncio.Future):
+        if not future.cancelled() and future.exception() is not None and self.__batch_error is None:
+            self.__batch_error = future.exception()
+
+    def __raise_batch_error(self):
+        if self.__batch_error is not None:
+            error = self.__batch_error
+            self.__batch_error = None
+            raise error
+
+    async def __write_batch_later(self):
+        try:
+            await asyncio.sleep(self.max_batch_delay)
+        except asyncio.CancelledError:
+            # The loop is shutting down (e.g., asyncio.run returned) before the batch was due. Write it now.
+            self.flush_sync()
+            raise
+        await asyncio.gather(*self.__submit_pending_turns(), return_exceptions=True)
+
+    def _submit(self, session_id: str, func: Callable[..., T], *args) -> asyncio.Future:
+        self.__submit_pending_turns(session_id)
+        return super()._submit(session_id, func, *args)
+
+    async def _run(self, session_id: str, func: Callable[..., T], *args) -> T:
+        result = await super()._run(session_id, func, *args)
+        # Queued batches of the session ran before this operation.
+        self.__raise_batch_error()
+        return result
+
+    async def write_turn(self, session_id: str, turn: DialogueTurn):
+        self.__raise_batch_error()
+        self.__pending_turns.setdefault(session_id, []).append(turn)
+        if self.__batch_task is None or self.__batch_task.done():
+            self.__batch_task = asyncio.get_running_loop().create_task(self.__write_batch_later())
+
+    async def flush(self):
+        await asyncio.gather(*self.__submit_pending_turns(), return_exceptions=True)
+        await super().flush()
+        self.__raise_batch_error()
+
+    def flush_sync(self):
+        if _is_writer_thread():
+            return
+        futures = [self._submit_sync(session_id, self.__file_writer.write_turns, session_id, turns)
+                   for session_id, turns in self.__take_pending_turns().items()]
+        super().flush_sync()
+        for future in futures:
+            future.result()
+        self.__raise_batch_error()
+
+
+_async_session_writer_adapters: WeakKeyDictionary[SessionWriterBase, SyncSessionWriterAdapter] = WeakKeyDictionary()
+
+
+def get_async_session_writer(writer: SessionWriterBase | AsyncSessionWriterBase) -> AsyncSessionWriterBase:
+    """
+    Get the asynchronous interface of a writer. Sync writers share one adapter, so that the operations on a session
+    stay ordered even if several session objects write it.
+    """
+    if isinstance(writer, AsyncSessionWriterBase):
+        return writer
+
+    adapter = _async_session_writer_adapters.get(writer)
+    if adapter is None:
+        adapter = SyncSessionWriterAdapter(writer)
+        _async_session_writer_adapters[writer] = adapter
+    return adapter
+
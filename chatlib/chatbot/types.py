@@ -1,4 +1,4 @@
-from typing import TypeAlias, Optional
+from typing import TypeAlias, Optional, Sequence, Iterator, overload
 
 import nanoid
 from pydantic import BaseModel, Field, ConfigDict
@@ -23,3 +23,65 @@ class DialogueTurn(BaseModel):
 
 
 Dialogue: TypeAlias = list[DialogueTurn]
+
+
+class DialogueView(Sequence[DialogueTurn]):
+    """
+    A read-only view of the first turns of a dialogue list, without copying it.
+    The view is fixed to the length at creation, so the owner may keep appending to the list.
+    The owner must replace the list instead of removing or reordering turns in place.
+    """
+
+    __slots__ = ("__turns", "__start", "__stop")
+
+    def __init__(self, turns: list[DialogueTurn], start: int = 0, stop: int | None = None):
+        self.__turns = turns
+        self.__start = start
+        self.__stop = len(turns) if stop is None else stop
+
+    def __len__(self) -> int:
+        return self.__stop - self.__start
+
+    @overload
+    def __getitem__(self, index: int) -> DialogueTurn:
+        ...
+
+    @overload
+    def __getitem__(self, index: slice) -> Sequence[DialogueTurn]:
+        ...
+
+    def __getitem__(self, index: int | slice) -> DialogueTurn | Sequence[DialogueTurn]:
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step == 1:
+                return DialogueView(self.__turns, self.__start + start, self.__start + max(start, stop))
+            else:
+                return [self.__turns[self.__start + i] for i in range(start, stop, step)]
+        else:
+            if index < 0:
+                index += len(self)
+            if not 0 <= index < len(self):
+                raise IndexError("dialogue index out of range")
+            return self.__turns[self.__start + index]
+
+    def __iter__(self) -> Iterator[DialogueTurn]:
+        for i in range(self.__start, self.__stop):
+            yield self.__turns[i]
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, (DialogueView, list, tuple)):
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        return NotImplemented
+
+    def __add__(self, other: Sequence[DialogueTurn]) -> Dialogue:
+        return self.copy() + list(other)
+
+    def __radd__(self, other: Sequence[DialogueTurn]) -> Dialogue:
+        return list(other) + self.copy()
+
+    def __repr__(self) -> str:
+        return f"DialogueView({self.copy()!r})"
+
+    def copy(self) -> Dialogue:
+        return self.__turns[self.__start:self.__stop]
+
@@ -1,13 +1,21 @@
+import asyncio
 from abc import ABC, abstractmethod
 from dataclasses import dataclass
 from enum import StrEnum
 from functools import cache
-from typing import Optional
+from typing import Optional, AsyncIterator, TYPE_CHECKING
 
 from pydantic import BaseModel, ConfigDict, Field
 
+from chatlib.llm.client_registry import client_registry
+from chatlib.llm.model_registry import model_registry, ModelSpec
+from chatlib.llm.rate_limiter import BackoffPolicy, rate_limiter_registry, classify_retryable_error, \
+    AdaptiveRateLimiter
 from chatlib.utils.integration import IntegrationService
 
+if TYPE_CHECKING:
+    from chatlib.llm.response_cache import ChatCompletionResponseCache
+
 
 class ChatCompletionMessageRole(StrEnum):
     USER = "user"
@@ -64,6 +72,17 @@ class ChatCompletionResult(BaseModel):
     completion_tokens: int | None = None
     prompt_tokens: int | None = None
     total_tokens: int | None = None
+    # True if the token counts were estimated locally instead of reported by the provider.
+    usage_estimated: bool = False
+
+
+class ChatCompletionChunk(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
+    delta: str = ""
+
+    # Set only on the last chunk of a stream.
+    result: ChatCompletionResult | None = None
 
 
 class TokenLimitExceedError(Exception):
@@ -77,16 +96,29 @@ class ChatCompletionRetryRequestedException(Exception):
 
 class ChatCompletionAPIGlobalConfig(BaseModel):
     verbose: bool | None = False
+    retry_backoff: BackoffPolicy = BackoffPolicy()
 
 
 class ChatCompletionAPI(IntegrationService, ABC):
 
     def __init__(self):
         self.__config = ChatCompletionAPIGlobalConfig(verbose=False)
+        self.__response_cache: Optional['ChatCompletionResponseCache'] = None
 
     def config(self) -> ChatCompletionAPIGlobalConfig:
         return self.__config
 
+    @property
+    def response_cache(self) -> Optional['ChatCompletionResponseCache']:
+        return self.__response_cache
+
+    def set_response_cache(self, cache: Optional['ChatCompletionResponseCache']):
+        """
+        Serve identical (provider, model, messages, params) requests with temperature 0 from the cache.
+        Pass None to disable caching.
+        """
+        self.__response_cache = cache
+
     @abstractmethod
     def is_messages_within_token_limit(self, messages: list[ChatCompletionMessage], model: str,
                                        tolerance: int = 120) -> bool:
@@ -97,27 +129,198 @@ class ChatCompletionAPI(IntegrationService, ABC):
                                         params: dict) -> ChatCompletionResult:
         pass
 
+    def __estimate_request_tokens(self, messages: list[ChatCompletionMessage], model: str, params: dict) -> int:
+        try:
+            counts = self.count_token_in_each_message(messages, model)
+        except Exception:
+            counts = None
+
+        if counts is not None:
+            prompt_tokens = sum(counts) + self.count_token_overhead(model)
+        else:
+            prompt_tokens = sum([len(message.content or "") for message in messages]) // 4
+        return prompt_tokens + (params.get("max_tokens") or 0)
+
+    async def __acquire_rate_limit(self, limiter: AdaptiveRateLimiter | None, messages: list[ChatCompletionMessage],
+                                   model: str, params: dict) -> int:
+        if limiter is None:
+            return 0
+        estimated_tokens = self.__estimate_request_tokens(messages, model, params) if limiter.is_token_budgeted else 0
+        await limiter.acquire(estimated_tokens)
+        return estimated_tokens
+
+    async def __handle_retryable_error(self, error: Exception, limiter: AdaptiveRateLimiter | None, trial: int,
+                                       trial_count: int) -> bool:
+        """
+        :return: False if the error is not retryable. Otherwise wait for the backoff delay and return True.
+        """
+        is_retryable, status_code, retry_after = classify_retryable_error(error)
+        if isinstance(error, ChatCompletionRetryRequestedException):
+            is_retryable = True
+
+        if not is_retryable:
+            return False
+
+        delay = self.config().retry_backoff.get_delay(trial, retry_after)
+        if limiter is not None and status_code == 429:
+            # Throttle every request to this model, not only the one that failed.
+            limiter.pause(delay)
+
+        if self.config().verbose:
+            print(f"Retry chat completion of {self.provider_name()} in {delay:.2f} sec - {error}")
+
+        if trial <= trial_count:
+            await asyncio.sleep(delay)
+        return True
+
+    def __make_cache_key(self, model: str, messages: list[ChatCompletionMessage], params: dict) -> str | None:
+        """
+        :return: None if the request should not be served from the response cache.
+        """
+        if self.__response_cache is not None and self.__response_cache.is_cacheable(params):
+            return self.__response_cache.make_key(self.provider_name(), model, messages, params)
+        else:
+            return None
+
     async def run_chat_completion(self, model: str, messages: list[ChatCompletionMessage],
                                   params: dict,
                                   trial_count: int = 5) -> ChatCompletionResult | None:
         self.assert_authorize()
+
+        cache_key = self.__make_cache_key(model, messages, params)
+        if cache_key is not None:
+            cached_result = await self.__response_cache.aget(cache_key)
+            if cached_result is not None:
+                return cached_result
+
+        limiter = rate_limiter_registry.get_limiter(self.provider_name(), model)
         trial = 0
         result = None
         while trial <= trial_count and result is None:
             try:
+                estimated_tokens = await self.__acquire_rate_limit(limiter, messages, model, params)
+
                 if self.config().verbose:
                     print(f"Run chat completion on {model} with messages:", messages)
 
                 result = await self._run_chat_completion_impl(model, messages, params)
-            except ChatCompletionRetryRequestedException as e:
+
+                if limiter is not None:
+                    limiter.reconcile(estimated_tokens, result.total_tokens)
+            except Exception as e:
                 result = None
                 trial += 1
+                if not await self.__handle_retryable_error(e, limiter, trial, trial_count):
+                    raise e
 
-                if self.config().verbose:
-                    print(f"Retry chat completion of {self.provider_name} - {e.caused_by}")
+        if cache_key is not None and result is not None:
+            await self.__response_cache.aput(cache_key, result)
 
         return result
 
+    async def _run_chat_completion_stream_impl(self, model: str, messages: list[ChatCompletionMessage],
+                                               params: dict) -> AsyncIterator[ChatCompletionChunk]:
+        # Providers without streaming support emit the whole message as a single chunk.
+        async for chunk in self.__run_chat_completion_as_single_chunk(model, messages, params):
+            yield chunk
+
+    async def __run_chat_completion_as_single_chunk(self, model: str, messages: list[ChatCompletionMessage],
+                                                    params: dict) -> AsyncIterator[ChatCompletionChunk]:
+        result = await self._run_chat_completion_impl(model, messages, params)
+        yield ChatCompletionChunk(delta=result.message.content or "", result=result)
+
+    async def run_chat_completion_stream(self, model: str, messages: list[ChatCompletionMessage],
+                                         params: dict,
+                                         trial_count: int = 5) -> AsyncIterator[ChatCompletionChunk]:
+        """
+        Stream a chat completion as text deltas. The last chunk carries the completed ChatCompletionResult.
+        A retry is only possible until the first chunk was emitted.
+        """
+        self.assert_authorize()
+
+        cache_key = self.__make_cache_key(model, messages, params)
+        if cache_key is not None:
+            cached_result = await self.__response_cache.aget(cache_key)
+            if cached_result is not None:
+                yield ChatCompletionChunk(delta=cached_result.message.content or "", result=cached_result)
+                return
+
+        spec = self.get_model_spec(model)
+        stream_impl = self._run_chat_completion_stream_impl if spec is None or spec.supports_streaming \
+            else self.__run_chat_completion_as_single_chunk
+
+        limiter = rate_limiter_registry.get_limiter(self.provider_name(), model)
+        trial = 0
+        while True:
+            is_chunk_emitted = False
+            try:
+                estimated_tokens = await self.__acquire_rate_limit(limiter, messages, model, params)
+
+                if self.config().verbose:
+                    print(f"Run chat completion stream on {model} with messages:", messages)
+
+                async for chunk in stream_impl(model, messages, params):
+                    is_chunk_emitted = True
+                    if chunk.result is not None:
+                        if limiter is not None:
+                            limiter.reconcile(estimated_tokens, chunk.result.total_tokens)
+                        if cache_key is not None:
+                            await self.__response_cache.aput(cache_key, chunk.result)
+                    yield chunk
+                return
+            except Exception as e:
+                trial += 1
+                if is_chunk_emitted or trial > trial_count or not await self.__handle_retryable_error(e, limiter, trial, trial_count):
+                    raise e
+
     @abstractmethod
     def count_token_in_messages(self, messages: list[ChatCompletionMessage], model: str) -> int:
         pass
+
+    def get_model_spec(self, model: str) -> ModelSpec | None:
+        return model_registry.find(model, self.provider_name())
+
+    def get_token_limit(self, model: str) -> int | None:
+        spec = self.get_model_spec(model)
+        return spec.context_window if spec is not None else None
+
+    def get_token_estimate_margin(self, model: str) -> float | None:
+        """
+        The fraction of the token limit around the limit where a local token estimate is not trusted, and the tokens
+        are counted with count_token_in_messages instead.
+        :return: None if the estimate is always trusted.
+        """
+        return None
+
+    def count_token_in_message(self, message: ChatCompletionMessage, model: str) -> int | None:
+        """
+        Count the tokens of a single message, including its per-message overhead.
+        :return: None if the provider cannot count messages individually.
+        """
+        return None
+
+    def count_token_in_each_message(self, messages: list[ChatCompletionMessage], model: str) -> list[int] | None:
+        """
+        Count the tokens of each message. Override this to count many messages in a batch.
+        :return: None if the provider cannot count messages individually.
+        """
+        counts = []
+        for message in messages:
+            count = self.count_token_in_message(message, model)
+            if count is None:
+                return None
+            counts.append(count)
+        return counts
+
+    def count_token_overhead(self, model: str) -> int:
+        """
+        Tokens counted once per request on top of the messages (e.g., reply priming).
+        """
+        spec = self.get_model_spec(model)
+        return spec.tokens_per_request if spec is not None else 0
+
+    async def aclose(self):
+        """
+        Close the pooled clients of this provider. A new client is created on the next call.
+        """
+        await client_registry.aclose(self.provider_name())
@@ -0,0 +1,172 @@
+import asyncio
+import weakref
+from threading import Lock
+from typing import Any, Callable, Hashable, TypeVar, AsyncIterator
+
+import httpx
+from pydantic import BaseModel, ConfigDict
+
+ClientType = TypeVar('ClientType')
+
+
+class ClientPoolConfig(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
+    max_connections: int = 100
+    max_keepalive_connections: int = 20
+    keepalive_expiry: float = 30.0
+    timeout: float = 600.0
+    connect_timeout: float = 10.0
+
+    def httpx_limits(self) -> httpx.Limits:
+        return httpx.Limits(max_connections=self.max_connections,
+                            max_keepalive_connections=self.max_keepalive_connections,
+                            keepalive_expiry=self.keepalive_expiry)
+
+    def httpx_timeout(self) -> httpx.Timeout:
+        return httpx.Timeout(self.timeout, connect=self.connect_timeout)
+
+
+def make_async_http_client(config: ClientPoolConfig, **kwargs) -> httpx.AsyncClient:
+    return httpx.AsyncClient(limits=config.httpx_limits(), timeout=config.httpx_timeout(), **kwargs)
+
+
+def _get_running_loop() -> asyncio.AbstractEventLoop | None:
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+
+
+class ClientRegistry:
+    """
+    Keeps one long-lived SDK client per (provider, credentials) so that every chat completion call reuses
+    warm HTTP connections instead of building a new connection pool.
+    Async clients are bound to the event loop that created them, so clients are also kept per running loop,
+    and clients of closed loops are dropped (e.g., between consecutive asyncio.run calls).
+    Loops are referenced weakly, so the registry does not keep a finished loop alive.
+    """
+
+    def __init__(self, config: ClientPoolConfig | None = None):
+        self.__config = config or ClientPoolConfig()
+        self.__provider_configs: dict[str, ClientPoolConfig] = dict()
+        # Keyed by the id of the loop, with a weak reference to the loop next to the client.
+        self.__clients: dict[tuple[str, Hashable, int | None], tuple[Any, weakref.ref | None]] = dict()
+        self.__lock = Lock()
+
+    @property
+    def config(self) -> ClientPoolConfig:
+        return self.__config
+
+    def configure(self, config: ClientPoolConfig, provider: str | None = None):
+        """
+        Set the pool configuration globally or for a single provider.
+        Clients created before this call keep their configuration until they are closed.
+        """
+        with self.__lock:
+            if provider is None:
+                self.__config = config
+            else:
+                self.__provider_configs[provider] = config
+
+    def get_config(self, provider: str) -> ClientPoolConfig:
+        return self.__provider_configs.get(provider, self.__config)
+
+    @staticmethod
+    def __is_loop_finished(loop_ref: weakref.ref | None) -> bool:
+        if loop_ref is None:
+            return False
+        loop = loop_ref()
+        return loop is None or loop.is_closed()
+
+    def __drop_clients_of_closed_loops(self):
+        # Their connections cannot be closed anymore since the loop is gone, so they are only released.
+        for key in [key for key, (_, loop_ref) in self.__clients.items() if self.__is_loop_finished(loop_ref)]:
+            del self.__clients[key]
+
+    def __find_client(self, key: tuple, loop: asyncio.AbstractEventLoop | None) -> Any | None:
+        entry = self.__clients.get(key)
+        if entry is not None:
+            client, loop_ref = entry
+            # The id of a garbage-collected loop may be reused by a new loop.
+            if loop_ref is None or loop_ref() is loop:
+                return client
+        return None
+
+    def get_client(self, provider: str, credentials: Hashable,
+                   factory: Callable[[ClientPoolConfig], ClientType]) -> ClientType:
+        loop = _get_running_loop()
+        key = (provider, credentials, id(loop) if loop is not None else None)
+        client = self.__find_client(key, loop)
+        if client is None:
+            with self.__lock:
+                client = self.__find_client(key, loop)
+                if client is None:
+                    self.__drop_clients_of_closed_loops()
+                    client = factory(self.get_config(provider))
+                    self.__clients[key] = (client, weakref.ref(loop) if loop is not None else None)
+        return client
+
+    def has_client(self, provider: str, credentials: Hashable) -> bool:
+        loop = _get_running_loop()
+        return self.__find_client((provider, credentials, id(loop) if loop is not None else None), loop) is not None
+
+    async def aclose(self, provider: str | None = None):
+        """
+        Close the clients of the running loop. Clients of other loops are closed with their own loop or dropped
+        when that loop is closed.
+        """
+        loop = _get_running_loop()
+        loop_id = id(loop) if loop is not None else None
+        with self.__lock:
+            # Clients of a finished loop whose id was reused are dropped here, not closed on the new loop.
+            self.__drop_clients_of_closed_loops()
+            keys = [key for key in self.__clients.keys()
+                    if (provider is None or key[0] == provider) and key[2] in (loop_id, None)]
+            clients = [self.__clients.pop(key)[0] for key in keys]
+
+        for client in clients:
+            await _close_client(client)
+
+
+async def iter_sse_data(response: httpx.Response) -> AsyncIterator[str]:
+    """
+    Yield the data of each server-sent event of a streaming response, until the OpenAI-style [DONE] marker.
+    """
+    data_lines = []
+    async for line in response.aiter_lines():
+        if line == "":
+            if len(data_lines) > 0:
+                data = "\n".join(data_lines)
+                data_lines = []
+                if data == "[DONE]":
+                    return
+                yield data
+        elif line.startswith("data:"):
+            data = line[5:]
+            data_lines.append(data[1:] if data.startswith(" ") else data)
+        # Comments and the other fields (event, id, retry) are not used by the providers.
+
+    if len(data_lines) > 0:
+        data = "\n".join(data_lines)
+        if data != "[DONE]":
+            yield data
+
+
+async def _close_client(client: Any):
+    close = getattr(client, "aclose", None) or getattr(client, "close", None)
+    if close is not None:
+        result = close()
+        if asyncio.iscoroutine(result):
+            await result
+
+
+client_registry = ClientRegistry()
+
+
+def get_http_client(provider: str, credentials: Hashable = None) -> httpx.AsyncClient:
+    """
+    A pooled HTTP client for providers called over raw HTTP. Connections are kept alive and limited per provider.
+    """
+    return client_registry.get_client(provider, credentials, make_async_http_client)
+
@@ -1,6 +1,42 @@
-from .anthropic_api import AnthropicChatCompletionAPI, AnthropicModel
-from .azure_llama2_api import AzureLlama2ChatCompletionAPI
-from .cohere_api import CohereModel, CohereChatAPI
-from .gemini_api import GeminiAPI
-from .openai_api import ChatGPTModel, GPTChatCompletionAPI
-from .together_api import TogetherAPI, TogetherAIModel
+# Provider modules import their SDKs (and transformers, for Llama) at the top, so they are only loaded
+# when one of their classes is first accessed. This keeps `import chatlib` fast for single-provider services.
+from importlib import import_module
+from typing import TYPE_CHECKING, Any
+
+if TYPE_CHECKING:
+    from .anthropic_api import AnthropicChatCompletionAPI, AnthropicModel
+    from .azure_llama2_api import AzureLlama2ChatCompletionAPI
+    from .cohere_api import CohereModel, CohereChatAPI
+    from .gemini_api import GeminiAPI
+    from .openai_api import ChatGPTModel, GPTChatCompletionAPI
+    from .together_api import TogetherAPI, TogetherAIModel
+
+_lazy_exports: dict[str, str] = {
+    "AnthropicChatCompletionAPI": ".anthropic_api",
+    "AnthropicModel": ".anthropic_api",
+    "AzureLlama2ChatCompletionAPI": ".azure_llama2_api",
+    "CohereModel": ".cohere_api",
+    "CohereChatAPI": ".cohere_api",
+    "GeminiAPI": ".gemini_api",
+    "ChatGPTModel": ".openai_api",
+    "GPTChatCompletionAPI": ".openai_api",
+    "TogetherAPI": ".together_api",
+    "TogetherAIModel": ".together_api",
+}
+
+__all__ = list(_lazy_exports.keys())
+
+
+def __getattr__(name: str) -> Any:
+    module_name = _lazy_exports.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    value = getattr(import_module(module_name, __name__), name)
+    # Cache on the package so that later accesses do not go through __getattr__.
+    globals()[name] = value
+    return value
+
+
+def __dir__() -> list[str]:
+    return sorted(list(globals().keys()) + __all__)
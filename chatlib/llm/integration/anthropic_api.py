@@ -1,11 +1,15 @@
 from enum import StrEnum
 from functools import cache
-from typing import Any, Literal
+from importlib.resources import files
+from typing import Any, Literal, AsyncIterator
 
-from anthropic import Client, Anthropic, HUMAN_PROMPT, AI_PROMPT
+from anthropic import AsyncAnthropic, HUMAN_PROMPT, AI_PROMPT
+from tokenizers import Tokenizer
 
 from chatlib.llm.chat_completion_api import ChatCompletionAPI, ChatCompletionMessage, ChatCompletionResult, \
-    ChatCompletionMessageRole, ChatCompletionFinishReason
+    ChatCompletionMessageRole, ChatCompletionFinishReason, ChatCompletionChunk
+from chatlib.llm.client_registry import client_registry, make_async_http_client
+from chatlib.llm.token_accounting import message_token_count_cache
 from chatlib.utils.integration import APIAuthorizationVariableType, APIAuthorizationVariableSpec
 
 
@@ -42,11 +46,29 @@ def convert_anthropic_stop_reason(reason: str | Literal["end_turn", "max_tokens"
         return ChatCompletionFinishReason.Stop
 
 
+@cache
+def get_anthropic_tokenizer() -> Tokenizer:
+    # The Anthropic SDK bundles its tokenizer, so counting runs locally without a client.
+    return Tokenizer.from_str(files("anthropic").joinpath("tokenizer.json").read_text(encoding="utf-8"))
+
+
+def _get_anthropic_message_prefix(role: ChatCompletionMessageRole) -> str:
+    if role == ChatCompletionMessageRole.USER:
+        return HUMAN_PROMPT
+    elif role == ChatCompletionMessageRole.ASSISTANT:
+        return AI_PROMPT
+    else:
+        return ""
+
+
 class AnthropicModel(StrEnum):
     CLAUDE_21 = "claude-2.1"
     CLAUDE_3_OPUS_20240229 = "claude-3-opus-20240229"
 
 
+# Used for Claude models missing from the model registry, e.g., ones released after it was updated.
+ANTHROPIC_DEFAULT_TOKEN_LIMIT = 200000
+
 # https://docs.anthropic.com/claude/reference/messages_post
 
 class AnthropicChatCompletionAPI(ChatCompletionAPI):
@@ -67,40 +89,82 @@ class AnthropicChatCompletionAPI(ChatCompletionAPI):
         return True
 
     @property
-    def __client(self) -> Client:
-        return Anthropic(api_key=self.get_auth_variable_for_spec(self.__api_key_spec))
+    def __client(self) -> AsyncAnthropic:
+        api_key = self.get_auth_variable_for_spec(self.__api_key_spec)
+        return client_registry.get_client(self.provider_name(), api_key,
+                                          lambda config: AsyncAnthropic(api_key=api_key, max_retries=0,
+                                                                        http_client=make_async_http_client(config)))
 
+    def get_token_limit(self, model: str) -> int | None:
+        token_limit = super().get_token_limit(model)
+        return token_limit if token_limit is not None else ANTHROPIC_DEFAULT_TOKEN_LIMIT
 
     def is_messages_within_token_limit(self, messages: list[ChatCompletionMessage], model: str,
                                        tolerance: int = 120) -> bool:
-        return self.count_token_in_messages(messages, model) <= 200000 - tolerance
+        return self.count_token_in_messages(messages, model) <= self.get_token_limit(model) - tolerance
 
-    async def _run_chat_completion_impl(self, model: str, messages: list[ChatCompletionMessage],
-                                        params: dict) -> ChatCompletionResult:
+    @staticmethod
+    def __split_system_prompt(messages: list[ChatCompletionMessage]) -> tuple[str | None, list[ChatCompletionMessage]]:
         if len(messages) > 0 and messages[0].role is ChatCompletionMessageRole.SYSTEM:
             # Exists system prompt
-            system_prompt = messages[0].content
-            messages = messages[1:]
+            return messages[0].content, messages[1:]
         else:
-            system_prompt = None
-
-        completion_result = self.__client.beta.messages.create(model=model,
-                                                               system=system_prompt if system_prompt is not None else None,
-                                                               messages=[msg.dict() for msg in messages],
-                                                               max_tokens=1024,
-                                                               **params,
-                                                               )
+            return None, messages
 
+    def __convert_result(self, model: str, message) -> ChatCompletionResult:
         return ChatCompletionResult(
-            message=ChatCompletionMessage(content=completion_result.content[0].text, role=ChatCompletionMessageRole.ASSISTANT),
-            finish_reason=convert_anthropic_stop_reason(completion_result.stop_reason) if completion_result.stop_reason is not None else ChatCompletionFinishReason.Stop,
+            message=ChatCompletionMessage(content=message.content[0].text, role=ChatCompletionMessageRole.ASSISTANT),
+            finish_reason=convert_anthropic_stop_reason(message.stop_reason) if message.stop_reason is not None else ChatCompletionFinishReason.Stop,
             model=model,
             provider=self.provider_name(),
-            prompt_tokens=completion_result.usage.input_tokens,
-            completion_tokens=completion_result.usage.output_tokens,
-            total_tokens=completion_result.usage.input_tokens + completion_result.usage.output_tokens
+            prompt_tokens=message.usage.input_tokens,
+            completion_tokens=message.usage.output_tokens,
+            total_tokens=message.usage.input_tokens + message.usage.output_tokens
         )
 
+    async def _run_chat_completion_impl(self, model: str, messages: list[ChatCompletionMessage],
+                                        params: dict) -> ChatCompletionResult:
+        system_prompt, messages = self.__split_system_prompt(messages)
+
+        completion_result = await self.__client.beta.messages.create(model=model,
+                                                                     system=system_prompt if system_prompt is not None else None,
+                                                                     messages=[msg.dict() for msg in messages],
+                                                                     max_tokens=1024,
+                                                                     **params,
+                                                                     )
+
+        return self.__convert_result(model, completion_result)
+
+    async def _run_chat_completion_stream_impl(self, model: str, messages: list[ChatCompletionMessage],
+                                               params: dict) -> AsyncIterator[ChatCompletionChunk]:
+        system_prompt, messages = self.__split_system_prompt(messages)
+
+        async with self.__client.beta.messages.stream(model=model,
+                                                      system=system_prompt if system_prompt is not None else None,
+                                                      messages=[msg.dict() for msg in messages],
+                                                      max_tokens=1024,
+                                                      **params) as stream:
+            async for text in stream.text_stream:
+                yield ChatCompletionChunk(delta=text)
+
+            yield ChatCompletionChunk(result=self.__convert_result(model, await stream.get_final_message()))
+
+    def count_token_in_each_message(self, messages: list[ChatCompletionMessage], model: str) -> list[int]:
+        counts = [message_token_count_cache.get("anthropic", message) for message in messages]
+        uncounted_indices = [i for i, count in enumerate(counts) if count is None]
+        if len(uncounted_indices) > 0:
+            encodings = get_anthropic_tokenizer().encode_batch(
+                [f"{_get_anthropic_message_prefix(messages[i].role)} {messages[i].content or ''}" for i in uncounted_indices])
+            for i, encoding in zip(uncounted_indices, encodings):
+                counts[i] = len(encoding.ids)
+                message_token_count_cache.put("anthropic", messages[i], counts[i])
+        return counts
+
+    def count_token_in_message(self, message: ChatCompletionMessage, model: str) -> int:
+        return self.count_token_in_each_message([message], model)[0]
+
+    def count_token_overhead(self, model: str) -> int:
+        return len(get_anthropic_tokenizer().encode(AI_PROMPT).ids)
+
     def count_token_in_messages(self, messages: list[ChatCompletionMessage], model: str) -> int:
-        self.assert_authorize()
-        return self.__client.count_tokens(create_anthropic_prompt(messages))
+        return sum(self.count_token_in_each_message(messages, model)) + self.count_token_overhead(model)
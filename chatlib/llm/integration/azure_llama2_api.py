@@ -1,24 +1,36 @@
 # https://learn.microsoft.com/en-us/azure/ai-studio/how-to/deploy-models-llama?tabs=azure-studio
 import json
-from asyncio import to_thread
 from enum import StrEnum
 from functools import cache
 from http import HTTPStatus
-from http.client import HTTPResponse
-from typing import Any
-from urllib import request, error, parse
+from os import path
+from typing import Any, AsyncIterator, TYPE_CHECKING
+from urllib import parse
 
-from transformers import AutoTokenizer
+import httpx
 
 from chatlib.llm.chat_completion_api import ChatCompletionAPI, ChatCompletionMessage, TokenLimitExceedError, \
     ChatCompletionRetryRequestedException, \
-    ChatCompletionResult
+    ChatCompletionResult, ChatCompletionChunk, ChatCompletionFinishReason, ChatCompletionMessageRole
+from chatlib.llm.client_registry import get_http_client, iter_sse_data
+from chatlib.llm.model_registry import model_registry, ModelSpec
+from chatlib.llm.token_accounting import message_token_count_cache, get_pretrained_tokenizer, get_proxy_encoding, \
+    PROXY_TOKENIZER_ENCODING
+from chatlib.utils.env_helper import get_env_variable
 from chatlib.utils.integration import APIAuthorizationVariableType, APIAuthorizationVariableSpec
 
+if TYPE_CHECKING:
+    from tokenizers import Tokenizer
+
+
+LLAMA2_TOKENIZER_PATH_ENV_KEY = "LLAMA2_TOKENIZER_PATH"
+LLAMA2_PRETRAINED_TOKENIZER = "meta-llama/Llama-2-70b-chat-hf"
+
 
 class AzureLlama2Environment:
     _host: str | None = None
     _key: str | None = None
+    _tokenizer_path: str | None = None
 
     ENDPOINT_CHAT_COMPLETION = '/v1/chat/completions'
 
@@ -51,6 +63,19 @@ class AzureLlama2Environment:
         cls.set_host(host)
         cls.set_key(key)
 
+    @classmethod
+    def get_tokenizer_path(cls) -> str | None:
+        return cls._tokenizer_path
+
+    @classmethod
+    def set_tokenizer_path(cls, tokenizer_path: str | None):
+        """
+        :param tokenizer_path: A tokenizer.json file or a directory containing it. If None, the path is read from
+        the LLAMA2_TOKENIZER_PATH environment variable. If that is not set either, the tokenizer loaded with
+        token_accounting.warm_up_tokenizers is used, and tokens are estimated with the proxy encoding until then.
+        """
+        cls._tokenizer_path = tokenizer_path
+
     @classmethod
     @cache
     def get_chat_completions_endpoint(cls) -> str:
@@ -62,6 +87,28 @@ class AzureLlama2Environment:
         return {'Content-Type': 'application/json', 'Authorization': ('Bearer ' + cls._key)}
 
 
+@cache
+def _get_env_tokenizer_path() -> str | None:
+    # Read once, since get_env_variable loads the .env file and tokens are counted on every request.
+    return get_env_variable(LLAMA2_TOKENIZER_PATH_ENV_KEY)
+
+
+def _get_llama2_tokenizer_name() -> str:
+    tokenizer_path = AzureLlama2Environment.get_tokenizer_path() or _get_env_tokenizer_path()
+    if tokenizer_path is not None:
+        return path.join(tokenizer_path, "tokenizer.json") if path.isdir(tokenizer_path) else tokenizer_path
+    else:
+        # Available only after warm_up_tokenizers downloaded it (the repository is gated, so HF_TOKEN may be needed).
+        return LLAMA2_PRETRAINED_TOKENIZER
+
+
+def get_llama2_tokenizer() -> 'Tokenizer | None':
+    """
+    :return: None if the tokenizer is neither at the configured path nor loaded with warm_up_tokenizers.
+    """
+    return get_pretrained_tokenizer(_get_llama2_tokenizer_name())
+
+
 class Llama2Model(StrEnum):
     Llama2_70b_chat = "Llama2_70b_chat"
 
@@ -85,25 +132,29 @@ class AzureLlama2ChatCompletionAPI(ChatCompletionAPI):
         AzureLlama2Environment.set_key(variables[cls.__key_spec])
         return True
 
-    @cache
-    def get_tokenizer(self):
-        tokenizer = AutoTokenizer.from_pretrained("meta-llama/Llama-2-70b-chat-hf")
-        return tokenizer
+    def get_tokenizer(self) -> 'Tokenizer | None':
+        return get_llama2_tokenizer()
+
+    def get_model_spec(self, model: str) -> ModelSpec | None:
+        # The deployment behind the endpoint decides the model, so unknown names are treated as Llama 2 70B chat.
+        return super().get_model_spec(model) or model_registry.get(Llama2Model.Llama2_70b_chat, self.provider_name())
 
     def is_messages_within_token_limit(self, messages: list[ChatCompletionMessage], model: str,
                                        tolerance: int = 120) -> bool:
-        return self.count_token_in_messages(messages, model) < 4096 + tolerance
+        return self.count_token_in_messages(messages, model) < self.get_token_limit(model) - tolerance
 
-    async def _run_chat_completion_impl(self, model: str, messages: list[ChatCompletionMessage], params: dict) -> Any:
-        req = request.Request(AzureLlama2Environment.get_chat_completions_endpoint(), str.encode(json.dumps({
-            "messages": [msg.dict() for msg in messages],
-            **params
-        })), AzureLlama2Environment.get_request_headers(), method="POST")
+    def __get_client(self) -> httpx.AsyncClient:
+        return get_http_client(self.provider_name(), AzureLlama2Environment.get_host())
 
+    async def _run_chat_completion_impl(self, model: str, messages: list[ChatCompletionMessage], params: dict) -> Any:
         try:
-            response: HTTPResponse = await to_thread(request.urlopen, url=req)
-            if response.status == HTTPStatus.OK:
-                json_response = json.loads(response.read())
+            response = await self.__get_client().post(AzureLlama2Environment.get_chat_completions_endpoint(), json={
+                "messages": [msg.dict() for msg in messages],
+                **params
+            }, headers=AzureLlama2Environment.get_request_headers())
+
+            if response.status_code == HTTPStatus.OK:
+                json_response = response.json()
                 return ChatCompletionResult(
                     message=ChatCompletionMessage(**json_response["choices"][0]["message"]),
                     finish_reason=json_response["choices"][0]["finish_reason"],
@@ -112,27 +163,91 @@ class AzureLlama2ChatCompletionAPI(ChatCompletionAPI):
                     **json_response["usage"]
                 )
             else:
-                raise ChatCompletionRetryRequestedException()
-        except (error.HTTPError, TokenLimitExceedError) as e:
+                raise ChatCompletionRetryRequestedException(httpx.HTTPStatusError(
+                    f"{response.status_code} {response.reason_phrase}", request=response.request, response=response))
+        except (httpx.HTTPError, TokenLimitExceedError) as e:
+            raise ChatCompletionRetryRequestedException(e) from e
+
+    async def _run_chat_completion_stream_impl(self, model: str, messages: list[ChatCompletionMessage],
+                                               params: dict) -> AsyncIterator[ChatCompletionChunk]:
+        content_deltas = []
+        finish_reason = ChatCompletionFinishReason.Stop
+        usage = dict()
+        try:
+            async with self.__get_client().stream("POST", AzureLlama2Environment.get_chat_completions_endpoint(), json={
+                "messages": [msg.dict() for msg in messages],
+                **params,
+                "stream": True
+            }, headers=AzureLlama2Environment.get_request_headers()) as response:
+                if response.status_code != HTTPStatus.OK:
+                    await response.aread()
+                    raise ChatCompletionRetryRequestedException(httpx.HTTPStatusError(
+                        f"{response.status_code} {response.reason_phrase}", request=response.request, response=response))
+
+                async for data in iter_sse_data(response):
+                    json_chunk = json.loads(data)
+                    usage = json_chunk.get("usage") or usage
+                    if len(json_chunk.get("choices") or []) == 0:
+                        continue
+
+                    choice = json_chunk["choices"][0]
+                    delta = (choice.get("delta") or dict()).get("content")
+                    if delta:
+                        content_deltas.append(delta)
+                        yield ChatCompletionChunk(delta=delta)
+
+                    if choice.get("finish_reason") is not None:
+                        finish_reason = ChatCompletionFinishReason(choice["finish_reason"])
+        except httpx.HTTPError as e:
             raise ChatCompletionRetryRequestedException(e) from e
 
+        yield ChatCompletionChunk(result=ChatCompletionResult(
+            message=ChatCompletionMessage(content="".join(content_deltas), role=ChatCompletionMessageRole.ASSISTANT),
+            finish_reason=finish_reason,
+            provider=self.provider_name(),
+            model=model,
+            **usage
+        ))
+
+    def count_token_in_message(self, message: ChatCompletionMessage, model: str) -> int:
+        return self.count_token_in_each_message([message], model)[0]
+
+    def count_token_in_each_message(self, messages: list[ChatCompletionMessage], model: str) -> list[int]:
+        spec = self.get_model_spec(model)
+        tokens_per_message = spec.tokens_per_message
+        tokens_per_name = spec.tokens_per_name
+
+        tokenizer = self.get_tokenizer()
+        encoder_key = (_get_llama2_tokenizer_name() if tokenizer is not None else PROXY_TOKENIZER_ENCODING,
+                       tokens_per_message, tokens_per_name)
+        counts = [message_token_count_cache.get(encoder_key, message) for message in messages]
+        uncounted_indices = [i for i, count in enumerate(counts) if count is None]
+
+        if len(uncounted_indices) > 0:
+            texts = []
+            text_owner_indices = []
+            for i in uncounted_indices:
+                counts[i] = tokens_per_message
+                for key, value in messages[i].dict().items():
+                    # Non-text fields (e.g., tool_calls) are not counted.
+                    if isinstance(value, str):
+                        texts.append(value)
+                        text_owner_indices.append(i)
+
+                    if key == "name":
+                        counts[i] += tokens_per_name
+
+            if tokenizer is not None:
+                token_counts = [len(encoding.ids) for encoding in tokenizer.encode_batch(texts, add_special_tokens=False)]
+            else:
+                token_counts = [len(tokens) for tokens in get_proxy_encoding().encode_ordinary_batch(texts)]
+            for i, token_count in zip(text_owner_indices, token_counts):
+                counts[i] += token_count
+
+            for i in uncounted_indices:
+                message_token_count_cache.put(encoder_key, messages[i], counts[i])
+
+        return counts
+
     def count_token_in_messages(self, messages: list[ChatCompletionMessage], model: str) -> int:
-        tokens_per_message = 3
-        tokens_per_name = 1
-
-        num_tokens = 0
-        for message in messages:
-            num_tokens += tokens_per_message
-            for key, value in message.dict().items():
-                try:
-                    num_tokens += len(self.get_tokenizer().encode(value))
-                except Exception as e:
-                    print(e)
-                    print(f"Error on token counting - {key}: {value}")
-
-                if key == "name":
-                    num_tokens += tokens_per_name
-        num_tokens += 3  # every reply is primed with <|start|>assistant<|message|>
-
-        print("Estimated token count: ", num_tokens)
-        return num_tokens
+        return sum(self.count_token_in_each_message(messages, model)) + self.count_token_overhead(model)
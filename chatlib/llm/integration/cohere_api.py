@@ -6,6 +6,8 @@ from cohere import AsyncClient
 
 from chatlib.llm.chat_completion_api import ChatCompletionAPI, ChatCompletionMessage, ChatCompletionResult, \
     ChatCompletionMessageRole, ChatCompletionFinishReason
+from chatlib.llm.client_registry import client_registry
+from chatlib.llm.token_accounting import count_tokens_in_each_message_locally
 from chatlib.utils.integration import APIAuthorizationVariableType, APIAuthorizationVariableSpec
 
 
@@ -54,11 +56,20 @@ class CohereChatAPI(ChatCompletionAPI):
 
     @property
     def __client(self) -> AsyncClient:
-        return AsyncClient(api_key=self.get_auth_variable_for_spec(self.__api_key_spec))
+        api_key = self.get_auth_variable_for_spec(self.__api_key_spec)
+        # Cohere's aiohttp backend keeps its own session; num_workers bounds concurrent connections.
+        return client_registry.get_client(self.provider_name(), api_key,
+                                          lambda config: AsyncClient(api_key=api_key,
+                                                                     num_workers=config.max_connections,
+                                                                     max_retries=0,
+                                                                     timeout=config.timeout))
 
     def is_messages_within_token_limit(self, messages: list[ChatCompletionMessage], model: str,
                                        tolerance: int = 120) -> bool:
-        return True
+        token_limit = self.get_token_limit(model)
+        if token_limit is None:
+            return True
+        return self.count_token_in_messages(messages, model) < token_limit - tolerance
 
     async def _run_chat_completion_impl(self, model: str, messages: list[ChatCompletionMessage],
                                         params: dict) -> ChatCompletionResult:
@@ -78,7 +89,15 @@ class CohereChatAPI(ChatCompletionAPI):
             total_tokens=response.token_count['total_tokens']
         )
 
+    def count_token_in_message(self, message: ChatCompletionMessage, model: str) -> int:
+        return self.count_token_in_each_message([message], model)[0]
+
+    def count_token_in_each_message(self, messages: list[ChatCompletionMessage], model: str) -> list[int]:
+        # Cohere does not publish its tokenizer, so the counts are proxy estimates calibrated with the token counts
+        # returned by the chat endpoint.
+        return count_tokens_in_each_message_locally(messages, self.get_model_spec(model))
+
     def count_token_in_messages(self, messages: list[ChatCompletionMessage], model: str) -> int:
-        pass
+        return sum(self.count_token_in_each_message(messages, model)) + self.count_token_overhead(model)
 
     __api_key_spec = APIAuthorizationVariableSpec(APIAuthorizationVariableType.ApiKey)
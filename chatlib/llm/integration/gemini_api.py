@@ -9,6 +9,8 @@ from google.generativeai.types import GenerateContentResponse
 from chatlib.llm.chat_completion_api import ChatCompletionAPI, ChatCompletionMessage, ChatCompletionMessageRole
 from chatlib.utils.integration import APIAuthorizationVariableType, APIAuthorizationVariableSpec
 from chatlib.llm.chat_completion_api import ChatCompletionResult
+from chatlib.llm.model_registry import model_registry, ModelSpec
+from chatlib.llm.token_accounting import count_tokens_in_each_message_locally
 
 # https://ai.google.dev/tutorials/python_quickstart
 # https://github.com/google/generative-ai-python/blob/main/google/generativeai/generative_models.py#L382-L423
@@ -21,7 +23,11 @@ _SAFETY_SETTINGS_BLOCK_NONE = [
                        "HARM_CATEGORY_DANGEROUS_CONTENT"]
 ]
 
-GEMINI_PRO_TOKEN_LIMIT = 30720
+GEMINI_PRO_MODEL = "gemini-pro"
+
+GEMINI_PROVIDER_NAME = "Google"
+
+GEMINI_PRO_TOKEN_LIMIT = model_registry.get(GEMINI_PRO_MODEL, GEMINI_PROVIDER_NAME).context_window
 
 
 class GeminiChatMessageRole(StrEnum):
@@ -72,7 +78,7 @@ class GeminiAPI(ChatCompletionAPI):
     @classmethod
     @cache
     def provider_name(cls) -> str:
-        return "Google"
+        return GEMINI_PROVIDER_NAME
 
     @classmethod
     def get_auth_variable_specs(cls) -> list[APIAuthorizationVariableSpec]:
@@ -85,19 +91,32 @@ class GeminiAPI(ChatCompletionAPI):
 
     def __init__(self,
                  safety_settings: list[dict] | None = None,
-                 injected_initial_system_message: str = "Okay I will diligently follow that instruction."):
+                 injected_initial_system_message: str = "Okay I will diligently follow that instruction.",
+                 remote_count_margin: float = 0.1):
+        """
+        :param remote_count_margin: The fraction of the token limit around the limit where the local estimate is not
+        trusted and the tokens are counted remotely. The estimate is kept by the caller (e.g., an
+        IncrementalTokenCounter of each response generator), since this API is shared by conversations.
+        """
         super().__init__()
         self.__injected_initial_system_message = injected_initial_system_message
         self.__safety_settings = safety_settings or _SAFETY_SETTINGS_BLOCK_NONE
+        self.__remote_count_margin = remote_count_margin
 
     @cache
     def model(self) -> genai.GenerativeModel:
-        return genai.GenerativeModel('gemini-pro')
+        return genai.GenerativeModel(GEMINI_PRO_MODEL)
+
+    def get_model_spec(self, model: str) -> ModelSpec | None:
+        # Requests always go to gemini-pro regardless of the model name.
+        return super().get_model_spec(model) or model_registry.get(GEMINI_PRO_MODEL, self.provider_name())
+
+    def get_token_estimate_margin(self, model: str) -> float | None:
+        return self.__remote_count_margin
 
     def is_messages_within_token_limit(self, messages: list[ChatCompletionMessage], model: str,
                                        tolerance: int = 120) -> bool:
-        self.assert_authorize()
-        return self.count_token_in_messages(messages, model) < GEMINI_PRO_TOKEN_LIMIT - tolerance
+        return self.count_token_in_messages(messages, model) < self.get_model_spec(model).context_window - tolerance
 
     def __convert_messages(self, messages: list[ChatCompletionMessage]) -> list[ChatCompletionMessage]:
         # Tweak system instruction
@@ -120,7 +139,7 @@ class GeminiAPI(ChatCompletionAPI):
                 ChatCompletionMessage(content="Hi!", role=ChatCompletionMessageRole.USER)]
 
     async def _run_chat_completion_impl(self, model: str, messages: list[ChatCompletionMessage], params: dict) -> ChatCompletionResult:
-        injected_messages = self.__convert_messages(messages)
+        injected_messages = self.__convert_messages(list(messages))
 
         converted_messages = convert_to_gemini_messages(injected_messages)
         response: GenerateContentResponse = await self.model().generate_content_async(
@@ -133,16 +152,37 @@ class GeminiAPI(ChatCompletionAPI):
 
         safety_ratings = {r.category: r.probability for r in response.prompt_feedback.safety_ratings}
 
+        usage = dict()
+        usage_metadata = getattr(response, "usage_metadata", None)
+        if usage_metadata is not None:
+            usage = dict(prompt_tokens=usage_metadata.prompt_token_count,
+                         completion_tokens=usage_metadata.candidates_token_count,
+                         total_tokens=usage_metadata.total_token_count)
+
         return ChatCompletionResult(
                 message=ChatCompletionMessage(**top_choice["message"]),
                 finish_reason=top_choice["finish_reason"],
                 provider=self.provider_name(),
-                model=model
+                model=model,
+                **usage
             )
 
+    def count_token_in_message(self, message: ChatCompletionMessage, model: str) -> int:
+        return self.count_token_in_each_message([message], model)[0]
+
+    def count_token_in_each_message(self, messages: list[ChatCompletionMessage], model: str) -> list[int]:
+        """
+        Estimate the tokens of each message locally. Gemini's tokenizer is not available offline, so these are
+        uncalibrated proxy counts.
+        """
+        return count_tokens_in_each_message_locally(messages, self.get_model_spec(model))
+
     def count_token_in_messages(self, messages: list[ChatCompletionMessage], model: str) -> int:
+        """
+        Count the tokens exactly with a remote call to the Gemini API.
+        """
         self.assert_authorize()
-        injected_messages = self.__convert_messages(messages)
+        injected_messages = self.__convert_messages(list(messages))
 
         converted_messages = convert_to_gemini_messages(injected_messages)
 
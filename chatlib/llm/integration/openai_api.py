@@ -1,12 +1,18 @@
 from enum import StrEnum
 from functools import cache
-from typing import Any
+from itertools import chain
+from threading import Lock, Thread
+from typing import Any, Iterable, AsyncIterator
 
 import tiktoken
 from openai import AsyncOpenAI
 
 from chatlib.llm.chat_completion_api import ChatCompletionMessage, ChatCompletionAPI, ChatCompletionResult, \
-    ChatCompletionFinishReason
+    ChatCompletionFinishReason, ChatCompletionChunk, ChatCompletionMessageRole, ChatCompletionToolCall, \
+    ChatCompletionFunction
+from chatlib.llm.client_registry import client_registry, make_async_http_client
+from chatlib.llm.model_registry import model_registry
+from chatlib.llm.token_accounting import message_token_count_cache
 from chatlib.utils.integration import APIAuthorizationVariableType, APIAuthorizationVariableSpec
 
 
@@ -24,21 +30,11 @@ class ChatGPTModel(StrEnum):
     GPT_4_1106 = "gpt-4-1106-preview"
 
 
-def get_token_limit(model: str):
-    if model is ChatGPTModel.GPT_4_32k_latest:
-        return 32000
-    elif model is ChatGPTModel.GPT_3_5_16k_latest or model is ChatGPTModel.GPT_3_5_0125 or model is ChatGPTModel.GPT_3_5_1106:
-        return 16000
-    elif model is ChatGPTModel.GPT_4_0125 or model is ChatGPTModel.GPT_4_1106:
-        return 128000
-    elif model.startswith("gpt-4-turbo"):
-        return 128000
-    elif model.startswith("gpt-3.5"):
-        return 4096
-    elif model.startswith("gpt-4"):
-        return 8192
-    else:
+def get_token_limit(model: str) -> int:
+    token_limit = model_registry.get_token_limit(model, GPTChatCompletionAPI.provider_name())
+    if token_limit is None:
         raise NotImplementedError(f"token limit for model {model} is not implemented.")
+    return token_limit
 
 
 class GPTChatCompletionAPI(ChatCompletionAPI):
@@ -59,7 +55,10 @@ class GPTChatCompletionAPI(ChatCompletionAPI):
 
     @property
     def __client(self) -> AsyncOpenAI:
-        return AsyncOpenAI(api_key=self.get_auth_variable_for_spec(self.__api_key_spec))
+        api_key = self.get_auth_variable_for_spec(self.__api_key_spec)
+        return client_registry.get_client(self.provider_name(), api_key,
+                                          lambda config: AsyncOpenAI(api_key=api_key, max_retries=0,
+                                                                     http_client=make_async_http_client(config)))
 
     def is_messages_within_token_limit(self, messages: list[ChatCompletionMessage], model: str,
                                        tolerance: int = 120) -> bool:
@@ -82,56 +81,194 @@ class GPTChatCompletionAPI(ChatCompletionAPI):
 
         return converted_result
 
-    def count_token_in_messages(self, messages: list[ChatCompletionMessage], model: str) -> int:
-        encoding = get_encoder_for_model(model)
-
-        if model in {
-            "gpt-3.5-turbo-0613",
-            "gpt-3.5-turbo-16k-0613",
-            "gpt-4-0314",
-            "gpt-4-32k-0314",
-            "gpt-4-0613",
-            "gpt-4-32k-0613",
-            "gpt-4-0125-preview"
-        }:
-            tokens_per_message = 3
-            tokens_per_name = 1
-        elif model == "gpt-3.5-turbo-0301":
-            tokens_per_message = 4  # every message follows <|start|>{role/name}\n{content}<|end|>\n
-            tokens_per_name = -1  # if there's a name, the role is omitted
-        elif "gpt-3.5-turbo" in model:
-            if self.config().verbose:
-                print("Warning: gpt-3.5-turbo may update over time. Returning num tokens assuming gpt-3.5-turbo-0613.")
-            return self.count_token_in_messages(messages, model=ChatGPTModel.GPT_3_5_0613)
-        elif "gpt-4-turbo-preview" in model:
-            return self.count_token_in_messages(messages, model=ChatGPTModel.GPT_4_0125)
-        elif "gpt-4" in model:
-            if self.config().verbose:
-                print("Warning: gpt-4 may update over time. Returning num tokens assuming gpt-4-0613.")
-            return self.count_token_in_messages(messages, model=ChatGPTModel.GPT_4_0613)
-        else:
+    async def _run_chat_completion_stream_impl(self, model: str, messages: list[ChatCompletionMessage],
+                                               params: dict) -> AsyncIterator[ChatCompletionChunk]:
+        stream = await self.__client.chat.completions.create(
+            model=model,
+            messages=[message.dict() for message in messages],
+            stream=True,
+            **params
+        )
+
+        result_model = model
+        content_deltas = []
+        tool_calls: dict[int, dict] = dict()
+        finish_reason = ChatCompletionFinishReason.Stop
+        async for chunk in stream:
+            result_model = chunk.model or result_model
+            if len(chunk.choices) == 0:
+                continue
+
+            choice = chunk.choices[0]
+            if choice.delta.content:
+                content_deltas.append(choice.delta.content)
+                yield ChatCompletionChunk(delta=choice.delta.content)
+
+            if choice.delta.tool_calls is not None:
+                for tool_call_delta in choice.delta.tool_calls:
+                    tool_call = tool_calls.setdefault(tool_call_delta.index, dict(id=None, name="", arguments=""))
+                    if tool_call_delta.id is not None:
+                        tool_call["id"] = tool_call_delta.id
+                    if tool_call_delta.function is not None:
+                        tool_call["name"] += tool_call_delta.function.name or ""
+                        tool_call["arguments"] += tool_call_delta.function.arguments or ""
+
+            if choice.finish_reason is not None:
+                finish_reason = ChatCompletionFinishReason(choice.finish_reason)
+
+        yield ChatCompletionChunk(result=ChatCompletionResult(
+            **self.__count_stream_usage(model, messages, content_deltas, tool_calls),
+            message=ChatCompletionMessage(
+                content="".join(content_deltas) if len(content_deltas) > 0 or len(tool_calls) == 0 else None,
+                role=ChatCompletionMessageRole.ASSISTANT,
+                tool_calls=[ChatCompletionToolCall(index=index, id=tool_call["id"],
+                                                   function=ChatCompletionFunction(name=tool_call["name"],
+                                                                                   arguments=tool_call["arguments"]))
+                            for index, tool_call in sorted(tool_calls.items())] if len(tool_calls) > 0 else None
+            ),
+            finish_reason=finish_reason,
+            provider=self.provider_name(),
+            model=result_model
+        ))
+
+    def __count_stream_usage(self, model: str, messages: list[ChatCompletionMessage], content_deltas: list[str],
+                             tool_calls: dict[int, dict]) -> dict:
+        # The SDK version in use cannot request usage on streams (stream_options), so it is counted locally.
+        try:
+            prompt_tokens = self.count_token_in_messages(messages, model)
+            encoding_model, _, _ = self.__resolve_token_counting_spec(model)
+        except NotImplementedError:
+            return dict()
+
+        completion_texts = ["".join(content_deltas)] + list(chain.from_iterable(
+            [tool_call["name"], tool_call["arguments"]] for tool_call in tool_calls.values()))
+        completion_tokens = sum(count_tokens_in_texts(get_encoder_for_model(encoding_model), completion_texts))
+        return dict(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+                    total_tokens=prompt_tokens + completion_tokens, usage_estimated=True)
+
+    def __resolve_token_counting_spec(self, model: str) -> tuple[str, int, int]:
+        spec = self.get_model_spec(model)
+        if spec is None:
             raise NotImplementedError(
                 f"""num_tokens_from_messages() is not implemented for model {model}. See https://github.com/openai/openai-python/blob/main/chatml.md for information on how messages are converted to tokens."""
             )
 
-        num_tokens = 0
-        for message in messages:
-            num_tokens += tokens_per_message
-            for key, value in message.dict().items():
+        return spec.tokenizer or model, spec.tokens_per_message, spec.tokens_per_name
+
+    def count_token_in_message(self, message: ChatCompletionMessage, model: str) -> int:
+        return self.count_token_in_each_message([message], model)[0]
+
+    def count_token_in_each_message(self, messages: list[ChatCompletionMessage], model: str) -> list[int]:
+        encoding_model, tokens_per_message, tokens_per_name = self.__resolve_token_counting_spec(model)
+        encoding = get_encoder_for_model(encoding_model)
+        encoder_key = (encoding.name, tokens_per_message, tokens_per_name)
+
+        counts = [message_token_count_cache.get(encoder_key, message) for message in messages]
+        uncounted_indices = [i for i, count in enumerate(counts) if count is None]
+
+        if len(uncounted_indices) > 0:
+            texts = []
+            text_owner_indices = []
+            for i in uncounted_indices:
+                counts[i] = tokens_per_message
+                for key, value in messages[i].dict().items():
+                    if isinstance(value, str):
+                        texts.append(value)
+                        text_owner_indices.append(i)
+                    else:
+                        print(f"Error on token counting - {key}: {value}")
+
+                    if key == "name":
+                        counts[i] += tokens_per_name
+
+            for i, num_tokens in zip(text_owner_indices, count_tokens_in_texts(encoding, texts)):
+                counts[i] += num_tokens
+
+            for i in uncounted_indices:
+                message_token_count_cache.put(encoder_key, messages[i], counts[i])
+
+        return counts
+
+    def count_token_in_messages(self, messages: list[ChatCompletionMessage], model: str) -> int:
+        return self.count_token_in_messages_batch([messages], model)[0]
+
+    def count_token_in_messages_batch(self, message_lists: list[list[ChatCompletionMessage]], model: str) -> list[int]:
+        """
+        Count tokens of many message lists at once, encoding all uncached messages in a single batch.
+        """
+        counts = self.count_token_in_each_message(list(chain.from_iterable(message_lists)), model)
+        overhead = self.count_token_overhead(model)
+
+        num_tokens_list = []
+        pointer = 0
+        for messages in message_lists:
+            num_tokens_list.append(sum(counts[pointer:pointer + len(messages)]) + overhead)
+            pointer += len(messages)
+        return num_tokens_list
+
+
+_encoders: dict[str, tiktoken.Encoding] = dict()
+_encoders_lock = Lock()
+
+# Below this number of texts, encoding one by one is faster than spawning encode_batch threads.
+BATCH_ENCODING_MIN_TEXTS = 16
+BATCH_ENCODING_NUM_THREADS = 8
+
+
+def get_encoder_for_model(model: ChatGPTModel | str) -> tiktoken.Encoding:
+    encoder = _encoders.get(model)
+    if encoder is None:
+        with _encoders_lock:
+            encoder = _encoders.get(model)
+            if encoder is None:
                 try:
-                    num_tokens += len(encoding.encode(value))
-                except:
-                    print(f"Error on token counting - {key}: {value}")
+                    if model in tiktoken.list_encoding_names():
+                        encoder = tiktoken.get_encoding(model)
+                    else:
+                        encoder = tiktoken.encoding_for_model(model)
+                except KeyError:
+                    print("Warning: model not found. Using cl100k_base encoding.")
+                    encoder = tiktoken.get_encoding("cl100k_base")
+                _encoders[model] = encoder
+    return encoder
+
+
+def warm_up_encoders(models: Iterable[ChatGPTModel | str] | None = None, background: bool = False) -> Thread | None:
+    """
+    Load the tiktoken encoders eagerly, e.g., at server startup, so that the first token count does not pay for it.
+    :param models: Models to load encoders for. All ChatGPTModel values by default.
+    :param background: If True, load in a daemon thread and return it.
+    """
+    models = list(models) if models is not None else list(ChatGPTModel)
+
+    def load():
+        for model in models:
+            spec = model_registry.find(model, GPTChatCompletionAPI.provider_name())
+            get_encoder_for_model(spec.tokenizer if spec is not None and spec.tokenizer is not None else model)
+
+    if background:
+        thread = Thread(target=load, daemon=True)
+        thread.start()
+        return thread
+    else:
+        load()
+        return None
+
+
+def _count_tokens_in_text(encoding: tiktoken.Encoding, text: str) -> int:
+    try:
+        return len(encoding.encode(text))
+    except:
+        print(f"Error on token counting - {text}")
+        return 0
 
-                if key == "name":
-                    num_tokens += tokens_per_name
-        num_tokens += 3  # every reply is primed with <|start|>assistant<|message|>
-        return num_tokens
 
+def count_tokens_in_texts(encoding: tiktoken.Encoding, texts: list[str],
+                          num_threads: int = BATCH_ENCODING_NUM_THREADS) -> list[int]:
+    if len(texts) < BATCH_ENCODING_MIN_TEXTS:
+        return [_count_tokens_in_text(encoding, text) for text in texts]
 
-def get_encoder_for_model(model: ChatGPTModel | str) -> Any:
     try:
-        return tiktoken.encoding_for_model(model)
-    except KeyError:
-        print("Warning: model not found. Using cl100k_base encoding.")
-        return tiktoken.get_encoding("cl100k_base")
+        return [len(tokens) for tokens in encoding.encode_batch(texts, num_threads=num_threads)]
+    except ValueError:  # A text contains a disallowed special token. Fall back to isolate the failure.
+        return [_count_tokens_in_text(encoding, text) for text in texts]
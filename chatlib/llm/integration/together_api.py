@@ -1,12 +1,14 @@
 import json
-from asyncio import to_thread
 from enum import StrEnum
 from functools import cache
-from typing import Any
+from typing import Any, AsyncIterator
 
-import requests
+import httpx
 
-from chatlib.llm.chat_completion_api import ChatCompletionAPI, ChatCompletionMessage, ChatCompletionResult, ChatCompletionFinishReason
+from chatlib.llm.chat_completion_api import ChatCompletionAPI, ChatCompletionMessage, ChatCompletionResult, \
+    ChatCompletionFinishReason, ChatCompletionChunk, ChatCompletionMessageRole
+from chatlib.llm.client_registry import get_http_client, iter_sse_data
+from chatlib.llm.token_accounting import count_tokens_in_each_message_locally
 from chatlib.utils.integration import APIAuthorizationVariableType, APIAuthorizationVariableSpec
 
 
@@ -35,7 +37,20 @@ class TogetherAPI(ChatCompletionAPI):
 
     def is_messages_within_token_limit(self, messages: list[ChatCompletionMessage], model: str,
                                        tolerance: int = 120) -> bool:
-        return True
+        token_limit = self.get_token_limit(model)
+        if token_limit is None:
+            return True
+        return self.count_token_in_messages(messages, model) < token_limit - tolerance
+
+    def __get_client(self) -> httpx.AsyncClient:
+        return get_http_client(self.provider_name())
+
+    def __get_request_headers(self) -> dict:
+        return {
+            "accept": "application/json",
+            "content-type": "application/json",
+            "Authorization": f"Bearer {self.get_auth_variable_for_spec(self.__api_key_spec)}"
+        }
 
     async def _run_chat_completion_impl(self, model: str, messages: list[ChatCompletionMessage], params: dict) -> Any:
         body = {
@@ -45,25 +60,67 @@ class TogetherAPI(ChatCompletionAPI):
             "messages": [msg.dict() for msg in messages]
         }
 
-        headers = {
-            "accept": "application/json",
-            "content-type": "application/json",
-            "Authorization": f"Bearer {self.get_auth_variable_for_spec(self.__api_key_spec)}"
+        response = await self.__get_client().post(self.__ENDPOINT, json=body, headers=self.__get_request_headers())
+        # Raises httpx.HTTPStatusError, so that rate limits and server errors are retried with backoff.
+        response.raise_for_status()
+
+        json_response = response.json()
+        return ChatCompletionResult(
+            message=ChatCompletionMessage(**json_response["choices"][0]["message"]),
+            finish_reason=ChatCompletionFinishReason.Stop,
+            provider=self.provider_name(),
+            model=json_response["model"],
+            **json_response["usage"]
+        )
+
+    async def _run_chat_completion_stream_impl(self, model: str, messages: list[ChatCompletionMessage],
+                                               params: dict) -> AsyncIterator[ChatCompletionChunk]:
+        body = {
+            "model": model,
+            "n": 1,
+            "stream": True,
+            "messages": [msg.dict() for msg in messages]
         }
 
-        response = await to_thread(requests.post, url=self.__ENDPOINT, json=body, headers=headers, data=None)
-        if response.status_code == 200:
-            json_response = json.loads(response.text)
-            print(json_response)
-            return ChatCompletionResult(
-                message=ChatCompletionMessage(**json_response["choices"][0]["message"]),
-                finish_reason=ChatCompletionFinishReason.Stop,
-                provider=self.provider_name(),
-                model=json_response["model"],
-                **json_response["usage"]
-            )
-        else:
-            raise Exception(response.status_code, response.reason)
+        result_model = model
+        content_deltas = []
+        finish_reason = ChatCompletionFinishReason.Stop
+        usage = dict()
+        async with self.__get_client().stream("POST", self.__ENDPOINT, json=body,
+                                              headers=self.__get_request_headers()) as response:
+            if response.is_error:
+                await response.aread()
+                response.raise_for_status()
+
+            async for data in iter_sse_data(response):
+                json_chunk = json.loads(data)
+                result_model = json_chunk.get("model") or result_model
+                usage = json_chunk.get("usage") or usage
+                if len(json_chunk.get("choices") or []) == 0:
+                    continue
+
+                choice = json_chunk["choices"][0]
+                delta = (choice.get("delta") or dict()).get("content")
+                if delta:
+                    content_deltas.append(delta)
+                    yield ChatCompletionChunk(delta=delta)
+
+                if choice.get("finish_reason") == ChatCompletionFinishReason.Length:
+                    finish_reason = ChatCompletionFinishReason.Length
+
+        yield ChatCompletionChunk(result=ChatCompletionResult(
+            message=ChatCompletionMessage(content="".join(content_deltas), role=ChatCompletionMessageRole.ASSISTANT),
+            finish_reason=finish_reason,
+            provider=self.provider_name(),
+            model=result_model,
+            **usage
+        ))
+
+    def count_token_in_message(self, message: ChatCompletionMessage, model: str) -> int:
+        return self.count_token_in_each_message([message], model)[0]
+
+    def count_token_in_each_message(self, messages: list[ChatCompletionMessage], model: str) -> list[int]:
+        return count_tokens_in_each_message_locally(messages, self.get_model_spec(model))
 
     def count_token_in_messages(self, messages: list[ChatCompletionMessage], model: str) -> int:
-        return 0
+        return sum(self.count_token_in_each_message(messages, model)) + self.count_token_overhead(model)
@@ -0,0 +1,128 @@
+import json
+from importlib.resources import files
+from threading import Lock
+from typing import Iterable
+
+from pydantic import BaseModel, ConfigDict
+
+# Capabilities of the chat completion models, loaded from models.json next to this module.
+# Models are keyed by (provider, name), so a name or prefix of one provider never resolves to another provider's model.
+# Lookups by model name or alias are dictionary lookups. Names that are not registered (e.g., dated snapshots)
+# resolve to the entry with the longest matching prefix once, and the result is memoized.
+
+
+class ModelSpec(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
+    name: str
+    provider: str
+
+    aliases: list[str] = []
+
+    # If True, unregistered model names that start with this name resolve to this entry.
+    match_prefix: bool = False
+
+    context_window: int | None = None
+    max_output_tokens: int | None = None
+
+    # A tiktoken encoding or model name for OpenAI models, or a Hugging Face tokenizer for the others.
+    tokenizer: str | None = None
+    tokens_per_message: int = 3
+    tokens_per_name: int = 1
+    # Tokens added once per request, e.g., for priming the reply.
+    tokens_per_request: int = 3
+
+    # USD per million tokens.
+    input_price: float | None = None
+    output_price: float | None = None
+
+    # If False, streaming requests are served with a regular request, emitted as a single chunk.
+    supports_streaming: bool = True
+    supports_tools: bool = False
+
+    def get_cost(self, prompt_tokens: int, completion_tokens: int) -> float | None:
+        """
+        :return: The cost in USD, or None if the prices are unknown.
+        """
+        if self.input_price is None or self.output_price is None:
+            return None
+        return (prompt_tokens * self.input_price + completion_tokens * self.output_price) / 1000000
+
+
+class ModelRegistry:
+
+    def __init__(self, specs: Iterable[ModelSpec] | None = None):
+        self.__specs: dict[tuple[str, str], ModelSpec] = dict()
+        self.__prefix_specs: list[ModelSpec] = []
+        self.__resolved: dict[tuple[str | None, str], ModelSpec | None] = dict()
+        self.__lock = Lock()
+
+        if specs is not None:
+            for spec in specs:
+                self.register(spec)
+
+    def register(self, spec: ModelSpec):
+        """
+        Add a model or replace the registered model of the same provider with the same name or alias.
+        """
+        with self.__lock:
+            for name in [spec.name] + spec.aliases:
+                self.__specs[(spec.provider, name)] = spec
+            if spec.match_prefix:
+                self.__prefix_specs = [s for s in self.__prefix_specs
+                                       if (s.provider, s.name) != (spec.provider, spec.name)] + [spec]
+                self.__prefix_specs.sort(key=lambda s: len(s.name), reverse=True)
+            self.__resolved = dict()
+
+    def load_file(self, file_path: str):
+        """
+        Register the models in a JSON file with a list of model specs.
+        """
+        with open(file_path, "r", encoding="utf-8") as f:
+            for row in json.load(f):
+                self.register(ModelSpec.model_validate(row))
+
+    def find(self, model: str, provider: str | None = None) -> ModelSpec | None:
+        """
+        :param provider: The provider of the model. If None, models of any provider match, so pass it wherever
+        the provider is known.
+        """
+        if provider is not None:
+            spec = self.__specs.get((provider, model))
+            if spec is not None:
+                return spec
+
+        key = (provider, model)
+        if key in self.__resolved:
+            return self.__resolved[key]
+
+        spec = None
+        if provider is None:
+            spec = next((s for (_, name), s in self.__specs.items() if name == model), None)
+        if spec is None:
+            spec = next((s for s in self.__prefix_specs
+                         if (provider is None or s.provider == provider) and model.startswith(s.name)), None)
+        self.__resolved[key] = spec
+        return spec
+
+    def get(self, model: str, provider: str | None = None) -> ModelSpec:
+        spec = self.find(model, provider)
+        if spec is None:
+            raise KeyError(f"Model {model} is not registered{f' for {provider}' if provider is not None else ''}.")
+        return spec
+
+    def get_token_limit(self, model: str, provider: str | None = None) -> int | None:
+        spec = self.find(model, provider)
+        return spec.context_window if spec is not None else None
+
+    def list_models(self, provider: str | None = None) -> list[ModelSpec]:
+        specs = {(spec.provider, spec.name): spec for spec in self.__specs.values()}
+        return [spec for spec in specs.values() if provider is None or spec.provider == provider]
+
+
+def _load_default_specs() -> list[ModelSpec]:
+    rows = json.loads(files("chatlib.llm").joinpath("models.json").read_text(encoding="utf-8"))
+    return [ModelSpec.model_validate(row) for row in rows]
+
+
+model_registry = ModelRegistry(_load_default_specs())
@@ -0,0 +1,228 @@
+import asyncio
+import random
+from email.utils import parsedate_to_datetime
+from threading import Lock
+from time import monotonic, time
+from typing import Any
+
+import httpx
+from pydantic import BaseModel, ConfigDict, Field
+
+RETRYABLE_STATUS_CODES = {408, 409, 425, 429, 500, 502, 503, 504, 529}
+
+# Connection and timeout errors of the OpenAI and Anthropic SDKs, matched by name to avoid importing the SDKs.
+RETRYABLE_ERROR_CLASS_NAMES = {"APIConnectionError", "APITimeoutError"}
+
+
+class RateLimit(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
+    requests_per_minute: int | None = Field(None, gt=0)
+    tokens_per_minute: int | None = Field(None, gt=0)
+
+
+class BackoffPolicy(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
+    base_delay: float = Field(0.5, ge=0)
+    max_delay: float = Field(60.0, ge=0)
+    multiplier: float = Field(2.0, ge=1)
+
+    def get_delay(self, attempt: int, retry_after: float | None = None) -> float:
+        """
+        Exponential backoff with full jitter. A Retry-After given by the provider is used as the lower bound.
+        :param attempt: 1 for the first retry.
+        """
+        ceiling = min(self.max_delay, self.base_delay * (self.multiplier ** max(0, attempt - 1)))
+        delay = random.uniform(0, ceiling)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+
+class TokenBucket:
+    def __init__(self, capacity: float, refill_per_second: float):
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self.__available = capacity
+        self.__updated_at = monotonic()
+
+    @property
+    def available(self) -> float:
+        self.__refill()
+        return self.__available
+
+    def __refill(self):
+        now = monotonic()
+        self.__available = min(self.capacity, self.__available + (now - self.__updated_at) * self.refill_per_second)
+        self.__updated_at = now
+
+    def get_wait_time(self, amount: float) -> float:
+        self.__refill()
+        # A request larger than the bucket would never fit, so it only waits for a full bucket.
+        amount = min(amount, self.capacity)
+        if self.__available >= amount:
+            return 0
+        else:
+            return (amount - self.__available) / self.refill_per_second
+
+    def consume(self, amount: float):
+        """
+        Consume tokens without waiting. The bucket may go into debt, which delays the following requests.
+        """
+        self.__refill()
+        self.__available -= amount
+
+
+class AdaptiveRateLimiter:
+    """
+    Budgets requests per minute and tokens per minute with token buckets, and pauses all requests
+    for a while when the provider signals a rate limit.
+    """
+
+    def __init__(self, limit: RateLimit):
+        self.limit = limit
+        self.__request_bucket = TokenBucket(limit.requests_per_minute, limit.requests_per_minute / 60) \
+            if limit.requests_per_minute is not None else None
+        self.__token_bucket = TokenBucket(limit.tokens_per_minute, limit.tokens_per_minute / 60) \
+            if limit.tokens_per_minute is not None else None
+        self.__paused_until = 0.0
+
+    @property
+    def is_token_budgeted(self) -> bool:
+        return self.__token_bucket is not None
+
+    async def acquire(self, estimated_tokens: int = 0):
+        while True:
+            wait_time = max(0.0, self.__paused_until - monotonic())
+            if self.__request_bucket is not None:
+                wait_time = max(wait_time, self.__request_bucket.get_wait_time(1))
+            if self.__token_bucket is not None:
+                wait_time = max(wait_time, self.__token_bucket.get_wait_time(estimated_tokens))
+
+            if wait_time <= 0:
+                break
+            await asyncio.sleep(wait_time)
+
+        # No await between the check above and the consumption, so concurrent tasks cannot overdraw the buckets.
+        if self.__request_bucket is not None:
+            self.__request_bucket.consume(1)
+        if self.__token_bucket is not None:
+            self.__token_bucket.consume(estimated_tokens)
+
+    def reconcile(self, estimated_tokens: int, actual_tokens: int | None):
+        if self.__token_bucket is not None and actual_tokens is not None:
+            self.__token_bucket.consume(actual_tokens - estimated_tokens)
+
+    def pause(self, seconds: float):
+        self.__paused_until = max(self.__paused_until, monotonic() + seconds)
+
+
+class RateLimiterRegistry:
+
+    def __init__(self):
+        self.__limits: dict[tuple[str, str | None], RateLimit] = dict()
+        self.__limiters: dict[tuple[str, str], AdaptiveRateLimiter] = dict()
+        self.__lock = Lock()
+
+    def set_rate_limit(self, provider: str, limit: RateLimit | None, model: str | None = None):
+        """
+        Set the rate limit of a provider. If model is None, the limit applies to each model of the provider
+        that has no limit of its own.
+        """
+        with self.__lock:
+            if limit is not None:
+                self.__limits[(provider, model)] = limit
+            else:
+                self.__limits.pop((provider, model), None)
+
+            for key in [key for key in self.__limiters.keys() if key[0] == provider and (model is None or key[1] == model)]:
+                self.__limiters.pop(key)
+
+    def get_limiter(self, provider: str, model: str) -> AdaptiveRateLimiter | None:
+        key = (provider, model)
+        limiter = self.__limiters.get(key)
+        if limiter is None:
+            with self.__lock:
+                limit = self.__limits.get(key) or self.__limits.get((provider, None))
+                if limit is None:
+                    return None
+                limiter = self.__limiters.get(key)
+                if limiter is None:
+                    limiter = AdaptiveRateLimiter(limit)
+                    self.__limiters[key] = limiter
+        return limiter
+
+
+rate_limiter_registry = RateLimiterRegistry()
+
+
+def parse_retry_after(headers: Any) -> float | None:
+    if headers is None:
+        return None
+
+    try:
+        retry_after_ms = headers.get("retry-after-ms")
+        if retry_after_ms is not None:
+            return float(retry_after_ms) / 1000
+
+        retry_after = headers.get("retry-after") or headers.get("Retry-After")
+        if retry_after is None:
+            return None
+    except AttributeError:
+        return None
+
+    try:
+        return max(0.0, float(retry_after))
+    except ValueError:
+        try:
+            return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time())
+        except (TypeError, ValueError):
+            return None
+
+
+def _get_status_code(error: BaseException) -> int | None:
+    for attr in ["status_code", "http_status", "status", "code"]:
+        value = getattr(error, attr, None)
+        if isinstance(value, int):
+            return value
+
+    response = getattr(error, "response", None)
+    if response is not None:
+        for attr in ["status_code", "status"]:
+            value = getattr(response, attr, None)
+            if isinstance(value, int):
+                return value
+    return None
+
+
+def _get_headers(error: BaseException) -> Any:
+    headers = getattr(error, "headers", None)
+    if headers is None:
+        headers = getattr(getattr(error, "response", None), "headers", None)
+    return headers
+
+
+def classify_retryable_error(error: BaseException) -> tuple[bool, int | None, float | None]:
+    """
+    Classify an error raised by a provider SDK or HTTP client.
+    :return: (whether retryable, HTTP status code if any, Retry-After seconds if given)
+    """
+    # Provider SDKs wrap transport errors, so walk the cause chain.
+    chain = []
+    e = error
+    while e is not None and len(chain) < 8:
+        chain.append(e)
+        e = e.__cause__ or getattr(e, "caused_by", None)
+
+    for e in chain:
+        if isinstance(e, (TimeoutError, asyncio.TimeoutError, httpx.TimeoutException, httpx.NetworkError,
+                          ConnectionError)) \
+                or any(cls.__name__ in RETRYABLE_ERROR_CLASS_NAMES for cls in type(e).__mro__):
+            return True, None, None
+
+        status_code = _get_status_code(e)
+        if status_code is not None:
+            return status_code in RETRYABLE_STATUS_CODES, status_code, parse_retry_after(_get_headers(e))
+
+    return False, None, None
@@ -0,0 +1,202 @@
+import asyncio
+import hashlib
+import json
+import sqlite3
+from collections import OrderedDict
+from os import path, makedirs
+from threading import Lock
+from time import time
+
+from pydantic import BaseModel
+
+from chatlib.llm.chat_completion_api import ChatCompletionMessage, ChatCompletionResult
+
+
+class ResponseCacheStats(BaseModel):
+    memory_hits: int = 0
+    disk_hits: int = 0
+    misses: int = 0
+
+    @property
+    def hits(self) -> int:
+        return self.memory_hits + self.disk_hits
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else 0.0
+
+
+class ChatCompletionResponseCache:
+    """
+    Two-tier cache of chat completion results: an in-memory LRU in front of an optional SQLite file.
+    Since a hit replays the first result, only requests with temperature 0 are cached unless
+    cache_nondeterministic is set.
+    In an event loop, use aget() and aput(), which run the SQLite tier in a worker thread.
+    """
+
+    def __init__(self, db_path: str | None = None, memory_size: int = 1024, ttl: float | None = None,
+                 max_disk_entries: int | None = 100000, cache_nondeterministic: bool = False):
+        """
+        :param db_path: Path of the SQLite file. If None, only the in-memory tier is used.
+        :param cache_nondeterministic: Also cache requests sampled with a nonzero or the provider's default temperature,
+        e.g., to replay fixtures in tests.
+        :param ttl: Seconds until an entry expires. If None, entries never expire.
+        :param max_disk_entries: The oldest entries are evicted beyond this count. If None, the file grows unbounded.
+        """
+        self.memory_size = memory_size
+        self.ttl = ttl
+        self.max_disk_entries = max_disk_entries
+        self.cache_nondeterministic = cache_nondeterministic
+
+        self.__memory: OrderedDict[str, tuple[ChatCompletionResult, float]] = OrderedDict()
+        self.__lock = Lock()
+        # The connection has its own lock, so memory lookups on the event loop never wait for disk I/O.
+        self.__disk_lock = Lock()
+        self.__stats = ResponseCacheStats()
+        self.__puts_since_eviction = 0
+
+        if db_path is not None:
+            dir_path = path.dirname(db_path)
+            if dir_path != "" and not path.exists(dir_path):
+                makedirs(dir_path)
+            self.__connection = sqlite3.connect(db_path, check_same_thread=False)
+            self.__connection.execute("PRAGMA journal_mode=WAL")
+            self.__connection.execute("""CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                result TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )""")
+            self.__connection.execute("CREATE INDEX IF NOT EXISTS responses_created_at ON responses (created_at)")
+            self.__connection.commit()
+        else:
+            self.__connection = None
+
+    def is_cacheable(self, params: dict) -> bool:
+        return self.cache_nondeterministic or params.get("temperature") == 0
+
+    @staticmethod
+    def make_key(provider: str, model: str, messages: list[ChatCompletionMessage], params: dict) -> str:
+        payload = json.dumps({
+            "provider": provider,
+            "model": model,
+            "messages": [message.dict() for message in messages],
+            "params": params
+        }, sort_keys=True, ensure_ascii=False, separators=(',', ':'), default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    @property
+    def stats(self) -> ResponseCacheStats:
+        with self.__lock:
+            return self.__stats.model_copy()
+
+    def __is_expired(self, created_at: float) -> bool:
+        return self.ttl is not None and time() - created_at > self.ttl
+
+    def __put_memory(self, key: str, result: ChatCompletionResult, created_at: float):
+        self.__memory[key] = (result, created_at)
+        self.__memory.move_to_end(key)
+        if len(self.__memory) > self.memory_size:
+            self.__memory.popitem(last=False)
+
+    def __get_memory(self, key: str) -> ChatCompletionResult | None:
+        with self.__lock:
+            entry = self.__memory.get(key)
+            if entry is not None:
+                result, created_at = entry
+                if not self.__is_expired(created_at):
+                    self.__memory.move_to_end(key)
+                    self.__stats.memory_hits += 1
+                    return result
+                else:
+                    self.__memory.pop(key)
+
+            if self.__connection is None:
+                self.__stats.misses += 1
+            return None
+
+    def __get_disk(self, key: str) -> ChatCompletionResult | None:
+        result = None
+        with self.__disk_lock:
+            if self.__connection is not None:
+                row = self.__connection.execute("SELECT result, created_at FROM responses WHERE key = ?",
+                                                (key,)).fetchone()
+                if row is not None:
+                    result_json, created_at = row
+                    if not self.__is_expired(created_at):
+                        result = ChatCompletionResult.model_validate_json(result_json)
+                    else:
+                        self.__connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+                        self.__connection.commit()
+
+        with self.__lock:
+            if result is not None:
+                self.__put_memory(key, result, created_at)
+                self.__stats.disk_hits += 1
+            else:
+                self.__stats.misses += 1
+        return result
+
+    def get(self, key: str) -> ChatCompletionResult | None:
+        result = self.__get_memory(key)
+        if result is None and self.__connection is not None:
+            result = self.__get_disk(key)
+        return result
+
+    async def aget(self, key: str) -> ChatCompletionResult | None:
+        result = self.__get_memory(key)
+        if result is None and self.__connection is not None:
+            result = await asyncio.to_thread(self.__get_disk, key)
+        return result
+
+    def __put_disk(self, key: str, result: ChatCompletionResult, created_at: float):
+        with self.__disk_lock:
+            if self.__connection is not None:
+                self.__connection.execute("INSERT OR REPLACE INTO responses (key, result, created_at) VALUES (?, ?, ?)",
+                                          (key, result.model_dump_json(), created_at))
+                # Counting the rows is not free, so the size limit is enforced on every few writes.
+                self.__puts_since_eviction += 1
+                if self.__puts_since_eviction >= 64:
+                    self.__evict_disk()
+                    self.__puts_since_eviction = 0
+                self.__connection.commit()
+
+    def put(self, key: str, result: ChatCompletionResult):
+        created_at = time()
+        with self.__lock:
+            self.__put_memory(key, result, created_at)
+        if self.__connection is not None:
+            self.__put_disk(key, result, created_at)
+
+    async def aput(self, key: str, result: ChatCompletionResult):
+        created_at = time()
+        with self.__lock:
+            self.__put_memory(key, result, created_at)
+        if self.__connection is not None:
+            await asyncio.to_thread(self.__put_disk, key, result, created_at)
+
+    def __evict_disk(self):
+        if self.ttl is not None:
+            self.__connection.execute("DELETE FROM responses WHERE created_at < ?", (time() - self.ttl,))
+
+        if self.max_disk_entries is not None:
+            count = self.__connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            if count > self.max_disk_entries:
+                self.__connection.execute(
+                    "DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY created_at ASC LIMIT ?)",
+                    (count - self.max_disk_entries,))
+
+    def clear(self):
+        with self.__lock:
+            self.__memory.clear()
+            self.__stats = ResponseCacheStats()
+        with self.__disk_lock:
+            if self.__connection is not None:
+                self.__connection.execute("DELETE FROM responses")
+                self.__connection.commit()
+
+    def close(self):
+        with self.__disk_lock:
+            if self.__connection is not None:
+                self.__connection.close()
+                self.__connection = None
@@ -0,0 +1,246 @@
+import math
+from collections import OrderedDict
+from functools import cache
+from os import path
+from threading import Lock, Thread
+from typing import Callable, Hashable, Iterable, TYPE_CHECKING
+
+import tiktoken
+
+from chatlib.llm.chat_completion_api import ChatCompletionMessage, ChatCompletionAPI
+from chatlib.llm.model_registry import ModelSpec, model_registry
+
+if TYPE_CHECKING:
+    # Imported in the functions that load tokenizers, so that importing this module does not load tokenizers.
+    from tokenizers import Tokenizer
+
+# Used to estimate tokens of models whose tokenizer cannot be loaded. The estimate is calibrated with the usage
+# reported by the provider (see IncrementalTokenCounter).
+PROXY_TOKENIZER_ENCODING = "cl100k_base"
+
+
+class MessageTokenCountCache:
+    """
+    LRU cache of per-message token counts, keyed by the encoder and the message role, name and content.
+    """
+
+    def __init__(self, max_size: int = 100000):
+        self.max_size = max_size
+        self.__counts: OrderedDict[tuple, int] = OrderedDict()
+        self.__lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def __make_key(encoder_key: Hashable, message: ChatCompletionMessage) -> tuple | None:
+        if message.tool_calls is not None:
+            return None
+        return encoder_key, message.role, message.name, message.tool_call_id, message.content
+
+    def get(self, encoder_key: Hashable, message: ChatCompletionMessage) -> int | None:
+        key = self.__make_key(encoder_key, message)
+        if key is None:
+            return None
+
+        with self.__lock:
+            count = self.__counts.get(key)
+            if count is not None:
+                self.__counts.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+            return count
+
+    def put(self, encoder_key: Hashable, message: ChatCompletionMessage, count: int):
+        key = self.__make_key(encoder_key, message)
+        if key is None:
+            return
+
+        with self.__lock:
+            self.__counts[key] = count
+            if len(self.__counts) > self.max_size:
+                self.__counts.popitem(last=False)
+
+    def get_or_count(self, encoder_key: Hashable, message: ChatCompletionMessage,
+                     counter: Callable[[ChatCompletionMessage], int]) -> int:
+        count = self.get(encoder_key, message)
+        if count is None:
+            count = counter(message)
+            self.put(encoder_key, message, count)
+        return count
+
+    def clear(self):
+        with self.__lock:
+            self.__counts.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+message_token_count_cache = MessageTokenCountCache()
+
+
+class IncrementalTokenCounter:
+    """
+    Keeps a running prefix sum of the per-message token counts of the last counted message list.
+    Since a conversation mostly grows by appending, only the new messages have to be counted on each turn.
+    The estimate is calibrated with the prompt token usage reported by the provider.
+    """
+
+    def __init__(self, api: ChatCompletionAPI, calibration_smoothing: float = 0.3,
+                 min_calibration_ratio: float = 0.5, max_calibration_ratio: float = 2.0):
+        self.__api = api
+        self.__model: str | None = None
+        self.__messages: list[ChatCompletionMessage] = []
+        self.__prefix_sums: list[int] = [0]
+
+        self.__calibration_smoothing = calibration_smoothing
+        self.__min_calibration_ratio = min_calibration_ratio
+        self.__max_calibration_ratio = max_calibration_ratio
+        self.__calibration_ratio = 1.0
+
+    @property
+    def calibration_ratio(self) -> float:
+        return self.__calibration_ratio
+
+    def reset(self):
+        self.__model = None
+        self.__messages = []
+        self.__prefix_sums = [0]
+        self.__calibration_ratio = 1.0
+
+    def count(self, messages: list[ChatCompletionMessage], model: str) -> int | None:
+        """
+        :return: The uncalibrated token count of the messages, or None if the API cannot count messages individually.
+        """
+        if model != self.__model:
+            self.reset()
+            self.__model = model
+
+        common_length = 0
+        max_common_length = min(len(self.__messages), len(messages))
+        while common_length < max_common_length and self.__messages[common_length] == messages[common_length]:
+            common_length += 1
+
+        del self.__messages[common_length:]
+        del self.__prefix_sums[common_length + 1:]
+
+        new_messages = messages[common_length:]
+        if len(new_messages) > 0:
+            new_message_tokens = self.__api.count_token_in_each_message(new_messages, model)
+            if new_message_tokens is None:
+                self.reset()
+                return None
+
+            for message, message_tokens in zip(new_messages, new_message_tokens):
+                self.__messages.append(message)
+                self.__prefix_sums.append(self.__prefix_sums[-1] + message_tokens)
+
+        return self.__prefix_sums[len(messages)] + self.__api.count_token_overhead(model)
+
+    def estimate(self, messages: list[ChatCompletionMessage], model: str) -> int | None:
+        count = self.count(messages, model)
+        if count is not None:
+            return math.ceil(count * self.__calibration_ratio)
+        else:
+            return None
+
+    def calibrate(self, messages: list[ChatCompletionMessage], model: str, prompt_tokens: int | None):
+        if prompt_tokens is None or prompt_tokens <= 0:
+            return
+
+        count = self.count(messages, model)
+        if count is None or count <= 0:
+            return
+
+        ratio = min(self.__max_calibration_ratio, max(self.__min_calibration_ratio, prompt_tokens / count))
+        self.__calibration_ratio += self.__calibration_smoothing * (ratio - self.__calibration_ratio)
+
+
+_tokenizers: dict[str, 'Tokenizer'] = dict()
+_tokenizers_lock = Lock()
+
+
+def get_pretrained_tokenizer(tokenizer_name: str) -> 'Tokenizer | None':
+    """
+    Get a tokenizer from a local tokenizer.json file, or one loaded from the Hugging Face Hub with warm_up_tokenizers.
+    Nothing is downloaded here, since token counts run on the event loop.
+    :return: None if the tokenizer is not available.
+    """
+    tokenizer = _tokenizers.get(tokenizer_name)
+    if tokenizer is None and path.isfile(tokenizer_name):
+        with _tokenizers_lock:
+            tokenizer = _tokenizers.get(tokenizer_name)
+            if tokenizer is None:
+                try:
+                    from tokenizers import Tokenizer
+                    tokenizer = Tokenizer.from_file(tokenizer_name)
+                except Exception as e:
+                    print(f"Warning: tokenizer {tokenizer_name} cannot be loaded ({e}). Using {PROXY_TOKENIZER_ENCODING} to estimate tokens.")
+                    return None
+                _tokenizers[tokenizer_name] = tokenizer
+    return tokenizer
+
+
+def warm_up_tokenizers(models: Iterable[str], provider: str | None = None,
+                       background: bool = False) -> Thread | None:
+    """
+    Load the Hugging Face tokenizers of the models, downloading them from the Hub if needed (e.g., at server startup).
+    Until then, and for tokenizers that fail to load, tokens are estimated with the proxy encoding.
+    :param provider: The provider of the models. If None, models of any provider match.
+    :param background: If True, load in a daemon thread and return it.
+    """
+    tokenizer_names = [spec.tokenizer for spec in [model_registry.find(model, provider) for model in models]
+                       if spec is not None and spec.tokenizer is not None]
+
+    def load():
+        for tokenizer_name in tokenizer_names:
+            if get_pretrained_tokenizer(tokenizer_name) is not None:
+                continue
+            try:
+                from tokenizers import Tokenizer
+                tokenizer = Tokenizer.from_pretrained(tokenizer_name)
+            except Exception as e:
+                # Not remembered, so a later warm-up can retry.
+                print(f"Warning: tokenizer {tokenizer_name} is not available ({e}). Using {PROXY_TOKENIZER_ENCODING} to estimate tokens.")
+                continue
+            with _tokenizers_lock:
+                _tokenizers[tokenizer_name] = tokenizer
+
+    if background:
+        thread = Thread(target=load, daemon=True)
+        thread.start()
+        return thread
+    else:
+        load()
+        return None
+
+
+@cache
+def get_proxy_encoding() -> tiktoken.Encoding:
+    return tiktoken.get_encoding(PROXY_TOKENIZER_ENCODING)
+
+
+def count_tokens_in_each_message_locally(messages: list[ChatCompletionMessage], spec: ModelSpec | None) -> list[int]:
+    """
+    Count the tokens of each message's content with the tokenizer of the model, falling back to the proxy encoding.
+    Uncached messages are encoded in a single batch.
+    :param spec: The spec of the model. If None, the proxy encoding and the default per-message overhead are used.
+    """
+    tokenizer_name = spec.tokenizer if spec is not None else None
+    tokens_per_message = spec.tokens_per_message if spec is not None else ModelSpec.model_fields["tokens_per_message"].default
+    tokenizer = get_pretrained_tokenizer(tokenizer_name) if tokenizer_name is not None else None
+    encoder_key = (tokenizer_name if tokenizer is not None else PROXY_TOKENIZER_ENCODING, tokens_per_message)
+
+    counts = [message_token_count_cache.get(encoder_key, message) for message in messages]
+    uncounted_indices = [i for i, count in enumerate(counts) if count is None]
+    if len(uncounted_indices) > 0:
+        texts = [messages[i].content or "" for i in uncounted_indices]
+        if tokenizer is not None:
+            token_counts = [len(encoding.ids) for encoding in tokenizer.encode_batch(texts, add_special_tokens=False)]
+        else:
+            token_counts = [len(tokens) for tokens in get_proxy_encoding().encode_ordinary_batch(texts)]
+
+        for i, token_count in zip(uncounted_indices, token_counts):
+            counts[i] = token_count + tokens_per_message
+            message_token_count_cache.put(encoder_key, messages[i], counts[i])
+    return counts
@@ -1,6 +1,10 @@
+import asyncio
 import json
+from collections import OrderedDict
+from dataclasses import dataclass
 from itertools import chain
-from typing import TypeVar, Generic, Callable, Any
+from os import path
+from typing import TypeVar, Generic, Callable, Any, Iterable, AsyncIterable, AsyncIterator
 
 from pydantic import BaseModel, ConfigDict
 
@@ -29,6 +33,44 @@ class MapperInputOutputPair(BaseModel, Generic[InputType, OutputType]):
     output: OutputType
 
 
+@dataclass(frozen=True)
+class MapperBatchItemResult(Generic[InputType, OutputType]):
+    index: int
+    input: InputType
+    output: OutputType | None = None
+    error: Exception | None = None
+
+    @property
+    def is_success(self) -> bool:
+        return self.error is None
+
+
+@dataclass(frozen=True)
+class _PromptPrefix:
+    messages: list[ChatCompletionMessage]
+    token_counts: list[int] | None
+
+
+def _make_content_key(model: BaseModel) -> Any:
+    # Frozen models are hashable unless a field is not (e.g., a dict input or output). Fall back to their JSON.
+    try:
+        hash(model)
+        return model
+    except TypeError:
+        return model.model_dump_json()
+
+
+async def _enumerate_inputs(inputs: Iterable[InputType] | AsyncIterable[InputType]) -> AsyncIterator[tuple[int, InputType]]:
+    if isinstance(inputs, AsyncIterable):
+        index = 0
+        async for input in inputs:
+            yield index, input
+            index += 1
+    else:
+        for index, input in enumerate(inputs):
+            yield index, input
+
+
 class ChatCompletionFewShotMapper(Generic[InputType, OutputType, ParamsType]):
 
     @classmethod
@@ -41,7 +83,8 @@ class ChatCompletionFewShotMapper(Generic[InputType, OutputType, ParamsType]):
                  instruction_generator: Callable[[InputType, ParamsType | None], str] | str,
                  input_str_converter: Callable[[InputType, ParamsType], str] | None,
                  output_str_converter: Callable[[OutputType, ParamsType], str],
-                 str_output_converter: Callable[[str, ParamsType], OutputType]
+                 str_output_converter: Callable[[str, ParamsType], OutputType],
+                 prompt_prefix_cache_size: int = 32
                  ):
         self.__api = api
         self.__instruction_generator = instruction_generator
@@ -50,35 +93,80 @@ class ChatCompletionFewShotMapper(Generic[InputType, OutputType, ParamsType]):
         self.__input_str_converter = input_str_converter or str_to_str_noop
         self.__output_str_converter = output_str_converter
 
+        self.__prompt_prefix_cache_size = prompt_prefix_cache_size
+        self.__prompt_prefix_cache: OrderedDict[tuple, _PromptPrefix] = OrderedDict()
+
     @property
     def api(self) -> ChatCompletionAPI:
         return self.__api
 
-    async def run(self,
-                  examples: list[MapperInputOutputPair[InputType, OutputType]] | None,
-                  input: InputType,
-                  params: ParamsType,
-                  output_malformed_retry_count: int = 5
-                  ) -> OutputType:
-        if examples is not None:  # TODO cache example messages
-            example_messages = list(chain.from_iterable([[
+    def __get_prompt_prefix(self, examples: list[MapperInputOutputPair[InputType, OutputType]] | None,
+                            params: ParamsType) -> _PromptPrefix:
+        """
+        Get the instruction (if static) and example messages, compiled once per examples and params contents.
+        """
+        key = (tuple([_make_content_key(example) for example in examples]) if examples is not None else None,
+               _make_content_key(params))
+
+        prefix = self.__prompt_prefix_cache.get(key)
+        if prefix is not None:
+            self.__prompt_prefix_cache.move_to_end(key)
+            return prefix
+
+        messages = []
+        if isinstance(self.__instruction_generator, str):
+            messages.append(ChatCompletionMessage(content=self.__instruction_generator,
+                                                  role=ChatCompletionMessageRole.SYSTEM))
+
+        if examples is not None:
+            messages.extend(chain.from_iterable([[
                 ChatCompletionMessage(content=self.__input_str_converter(example.input, params),
                                       role=ChatCompletionMessageRole.SYSTEM, name="example_user"),
                 ChatCompletionMessage(content=self.__output_str_converter(example.output, params),
                                       role=ChatCompletionMessageRole.SYSTEM, name="example_assistant")
             ] for example in examples]))
-        else:
-            example_messages = None
 
-        if isinstance(self.__instruction_generator, str):
-            instruction = self.__instruction_generator
-        else:
-            instruction = self.__instruction_generator(input, params)
+        try:
+            # This also warms the per-message token count cache used by the token limit checks.
+            token_counts = self.__api.count_token_in_each_message(messages, params.model)
+        except Exception:
+            token_counts = None
+
+        prefix = _PromptPrefix(messages=messages, token_counts=token_counts)
+        self.__prompt_prefix_cache[key] = prefix
+        if len(self.__prompt_prefix_cache) > self.__prompt_prefix_cache_size:
+            self.__prompt_prefix_cache.popitem(last=False)
 
-        messages = [ChatCompletionMessage(content=instruction, role=ChatCompletionMessageRole.SYSTEM)]
+        return prefix
 
-        if example_messages is not None:
-            messages.extend(example_messages)
+    def count_prompt_tokens(self, examples: list[MapperInputOutputPair[InputType, OutputType]] | None,
+                            input: InputType, params: ParamsType) -> int | None:
+        prefix = self.__get_prompt_prefix(examples, params)
+        if prefix.token_counts is None:
+            return None
+
+        messages = [ChatCompletionMessage(content=self.__input_str_converter(input, params),
+                                          role=ChatCompletionMessageRole.USER)]
+        if not isinstance(self.__instruction_generator, str):
+            messages.append(ChatCompletionMessage(content=self.__instruction_generator(input, params),
+                                                  role=ChatCompletionMessageRole.SYSTEM))
+        counts = self.__api.count_token_in_each_message(messages, params.model)
+        if counts is None:
+            return None
+
+        return sum(prefix.token_counts) + sum(counts) + self.__api.count_token_overhead(params.model)
+
+    async def run(self,
+                  examples: list[MapperInputOutputPair[InputType, OutputType]] | None,
+                  input: InputType,
+                  params: ParamsType,
+                  output_malformed_retry_count: int = 5
+                  ) -> OutputType:
+        messages = list(self.__get_prompt_prefix(examples, params).messages)
+
+        if not isinstance(self.__instruction_generator, str):
+            messages.insert(0, ChatCompletionMessage(content=self.__instruction_generator(input, params),
+                                                     role=ChatCompletionMessageRole.SYSTEM))
 
         messages.append(ChatCompletionMessage(content=self.__input_str_converter(input, params),
                                               role=ChatCompletionMessageRole.USER))
@@ -102,3 +190,106 @@ class ChatCompletionFewShotMapper(Generic[InputType, OutputType, ParamsType]):
                             "Output malformed for conversion. Consumed all retry count. PLease check your instruction.")
             else:
                 raise Exception(chat_response.finish_reason)
+
+    def __read_checkpoint(self, checkpoint_path: str, params: ParamsType) -> dict[int, OutputType]:
+        outputs = dict()
+        if path.exists(checkpoint_path):
+            with open(checkpoint_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if len(line.strip()) > 0:
+                        row = json.loads(line)
+                        outputs[row["index"]] = self.__str_output_converter(row["output"], params)
+        return outputs
+
+    async def __run_item(self, examples: list[MapperInputOutputPair[InputType, OutputType]] | None,
+                         index: int, input: InputType, params: ParamsType,
+                         output_malformed_retry_count: int) -> MapperBatchItemResult[InputType, OutputType]:
+        try:
+            output = await self.run(examples, input, params, output_malformed_retry_count)
+            return MapperBatchItemResult(index=index, input=input, output=output)
+        except Exception as e:
+            return MapperBatchItemResult(index=index, input=input, error=e)
+
+    async def map_stream(self,
+                         examples: list[MapperInputOutputPair[InputType, OutputType]] | None,
+                         inputs: Iterable[InputType] | AsyncIterable[InputType],
+                         params: ParamsType,
+                         concurrency: int = 8,
+                         ordered: bool = False,
+                         checkpoint_path: str | None = None,
+                         output_malformed_retry_count: int = 5
+                         ) -> AsyncIterator[MapperBatchItemResult[InputType, OutputType]]:
+        """
+        Map many inputs with at most `concurrency` chat completions in flight.
+        A failed item is yielded with its error instead of stopping the whole job.
+
+        :param ordered: If True, yield results in input order. Otherwise, in completion order.
+        :param checkpoint_path: A JSONL file recording successful outputs. Items already in the file are not
+        run again, so an interrupted job resumes where it stopped. The inputs must be iterated in the same order.
+        """
+        checkpointed_outputs = self.__read_checkpoint(checkpoint_path, params) if checkpoint_path is not None else dict()
+        checkpoint_file = open(checkpoint_path, 'a', encoding='utf-8') if checkpoint_path is not None else None
+
+        # In ordered mode, stop scheduling while too many results wait for an earlier, slower item.
+        max_buffered_results = concurrency * 4
+
+        pending: set[asyncio.Task] = set()
+        buffered_results: dict[int, MapperBatchItemResult] = dict()
+        next_index_to_yield = 0
+        input_iterator = aiter(_enumerate_inputs(inputs))
+        is_input_exhausted = False
+
+        try:
+            while True:
+                while not is_input_exhausted and len(pending) < concurrency \
+                        and (not ordered or len(buffered_results) < max_buffered_results):
+                    try:
+                        index, input = await anext(input_iterator)
+                    except StopAsyncIteration:
+                        is_input_exhausted = True
+                        break
+
+                    if index in checkpointed_outputs:
+                        buffered_results[index] = MapperBatchItemResult(index=index, input=input,
+                                                                        output=checkpointed_outputs[index])
+                    else:
+                        pending.add(asyncio.create_task(
+                            self.__run_item(examples, index, input, params, output_malformed_retry_count)))
+
+                if len(pending) > 0:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        result = task.result()
+                        if checkpoint_file is not None and result.is_success:
+                            checkpoint_file.write(json.dumps({"index": result.index,
+                                                              "output": self.__output_str_converter(result.output,
+                                                                                                    params)}) + "\n")
+                            checkpoint_file.flush()
+                        buffered_results[result.index] = result
+
+                if ordered:
+                    while next_index_to_yield in buffered_results:
+                        yield buffered_results.pop(next_index_to_yield)
+                        next_index_to_yield += 1
+                else:
+                    for index in list(buffered_results.keys()):
+                        yield buffered_results.pop(index)
+
+                if is_input_exhausted and len(pending) == 0 and len(buffered_results) == 0:
+                    break
+        finally:
+            for task in pending:
+                task.cancel()
+            if checkpoint_file is not None:
+                checkpoint_file.close()
+
+    async def run_batch(self,
+                        examples: list[MapperInputOutputPair[InputType, OutputType]] | None,
+                        inputs: Iterable[InputType] | AsyncIterable[InputType],
+                        params: ParamsType,
+                        concurrency: int = 8,
+                        checkpoint_path: str | None = None,
+                        output_malformed_retry_count: int = 5
+                        ) -> list[MapperBatchItemResult[InputType, OutputType]]:
+        return [result async for result in self.map_stream(examples, inputs, params, concurrency, True,
+                                                            checkpoint_path, output_malformed_retry_count)]
@@ -0,0 +1,99 @@
+import json
+from abc import ABC, abstractmethod
+from typing import Any
+
+
+class JSONSerializer(ABC):
+    """
+    Compact JSON encoding to and from UTF-8 bytes.
+    """
+
+    @property
+    @abstractmethod
+    def name(self) -> str:
+        pass
+
+    @abstractmethod
+    def dumps(self, obj: Any) -> bytes:
+        pass
+
+    @abstractmethod
+    def loads(self, data: bytes | str) -> Any:
+        pass
+
+
+class StdJSONSerializer(JSONSerializer):
+
+    @property
+    def name(self) -> str:
+        return "json"
+
+    def dumps(self, obj: Any) -> bytes:
+        return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode("utf-8")
+
+    def loads(self, data: bytes | str) -> Any:
+        return json.loads(data)
+
+
+class OrjsonSerializer(JSONSerializer):
+
+    def __init__(self):
+        import orjson
+        self.__orjson = orjson
+        self.__options = orjson.OPT_NON_STR_KEYS
+
+    @property
+    def name(self) -> str:
+        return "orjson"
+
+    def dumps(self, obj: Any) -> bytes:
+        return self.__orjson.dumps(obj, option=self.__options)
+
+    def loads(self, data: bytes | str) -> Any:
+        return self.__orjson.loads(data)
+
+
+class MsgspecSerializer(JSONSerializer):
+
+    def __init__(self):
+        import msgspec
+        self.__encoder = msgspec.json.Encoder()
+        self.__decoder = msgspec.json.Decoder()
+
+    @property
+    def name(self) -> str:
+        return "msgspec"
+
+    def dumps(self, obj: Any) -> bytes:
+        return self.__encoder.encode(obj)
+
+    def loads(self, data: bytes | str) -> Any:
+        return self.__decoder.decode(data)
+
+
+def _create_fastest_serializer() -> JSONSerializer:
+    # orjson and msgspec are optional. Fall back to the standard library if neither is installed.
+    for serializer_class in [OrjsonSerializer, MsgspecSerializer]:
+        try:
+            return serializer_class()
+        except ImportError:
+            pass
+    return StdJSONSerializer()
+
+
+_default_serializer: JSONSerializer | None = None
+
+
+def get_default_json_serializer() -> JSONSerializer:
+    global _default_serializer
+    if _default_serializer is None:
+        _default_serializer = _create_fastest_serializer()
+    return _default_serializer
+
+
+def set_default_json_serializer(serializer: JSONSerializer | None):
+    """
+    :param serializer: None to pick the fastest available serializer again.
+    """
+    global _default_serializer
+    _default_serializer = serializer
@@ -0,0 +1,100 @@
+import asyncio
+import gc
+import weakref
+
+import httpx
+
+from chatlib.llm.client_registry import ClientRegistry, ClientPoolConfig, iter_sse_data, make_async_http_client
+
+
+def _collect_sse_data(body: bytes) -> list[str]:
+    async def collect():
+        response = httpx.Response(200, content=body)
+        return [data async for data in iter_sse_data(response)]
+
+    return asyncio.run(collect())
+
+
+def test_sse_data_events():
+    body = (b": keep-alive comment\n\n"
+            b"event: message\ndata: {\"a\": 1}\n\n"
+            b"data:no-space\n\n"
+            b"data: first line\ndata: second line\nid: 3\n\n"
+            b"\n\n")
+    assert _collect_sse_data(body) == ["{\"a\": 1}", "no-space", "first line\nsecond line"]
+
+
+def test_sse_data_stops_at_done():
+    assert _collect_sse_data(b"data: 1\n\ndata: [DONE]\n\ndata: 2\n\n") == ["1"]
+
+
+def test_sse_data_without_trailing_blank_line():
+    assert _collect_sse_data(b"data: 1\n\ndata: 2") == ["1", "2"]
+    assert _collect_sse_data(b"data: 1\n\ndata: [DONE]") == ["1"]
+
+
+def test_sse_data_with_crlf_lines():
+    assert _collect_sse_data(b"data: 1\r\n\r\ndata: 2\r\n\r\n") == ["1", "2"]
+
+
+def test_clients_are_reused_per_provider_and_credentials():
+    registry = ClientRegistry()
+    created = []
+
+    def factory(config: ClientPoolConfig):
+        created.append(config)
+        return object()
+
+    client = registry.get_client("a", "key", factory)
+    assert registry.get_client("a", "key", factory) is client
+    assert registry.get_client("a", "other key", factory) is not client
+    assert registry.get_client("b", "key", factory) is not client
+    assert len(created) == 3
+
+
+def test_provider_config_overrides_global_config():
+    registry = ClientRegistry()
+    registry.configure(ClientPoolConfig(max_connections=5), provider="a")
+
+    assert registry.get_config("a").max_connections == 5
+    assert registry.get_config("b").max_connections == ClientPoolConfig().max_connections
+
+
+def test_async_clients_are_bound_to_their_event_loop():
+    registry = ClientRegistry()
+
+    async def get_client() -> httpx.AsyncClient:
+        return registry.get_client("a", None, make_async_http_client)
+
+    async def get_client_and_close() -> bool:
+        client = await get_client()
+        await registry.aclose()
+        return client.is_closed
+
+    first = asyncio.run(get_client())
+    second = asyncio.run(get_client())
+    assert first is not second
+
+    assert asyncio.run(get_client_and_close())
+
+
+async def _has_client(registry: ClientRegistry) -> bool:
+    return registry.has_client("a", None)
+
+
+def test_registry_does_not_keep_finished_loops_alive():
+    registry = ClientRegistry()
+
+    async def get_client():
+        return registry.get_client("a", None, lambda config: object())
+
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(get_client())
+    loop.close()
+    loop_ref = weakref.ref(loop)
+    del loop
+    gc.collect()
+
+    assert loop_ref() is None
+    # A later loop may get the same id, but never the client of the finished loop.
+    assert not asyncio.run(_has_client(registry))
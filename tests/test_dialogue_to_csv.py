@@ -0,0 +1,64 @@
+import csv
+from io import StringIO
+
+import pendulum
+import pytest
+
+from chatlib.chatbot import DialogueTurn
+from chatlib.chatbot.dialogue_to_csv import DialogueCSVWriter, format_timestamps
+
+# Around midnight, noon, and the DST transitions of 2023 in New York.
+TIMESTAMPS = [0, 999, 1691499971615, 1691496000000, 1691539200001, 1678604399999, 1678604400000,
+              1699163999999, 1699164000000]
+
+
+@pytest.mark.parametrize("timezone", [None, "Asia/Seoul", "America/New_York"])
+def test_format_timestamps_matches_pendulum(timezone):
+    tz = timezone or pendulum.UTC
+    expected = [pendulum.from_timestamp(timestamp / 1000, tz=tz).format("YYYY-MM-DD hh:mm:ss.SSS zz")
+                for timestamp in TIMESTAMPS]
+    assert format_timestamps(TIMESTAMPS, timezone) == expected
+
+
+def _make_dialogue(count: int) -> list[DialogueTurn]:
+    return [DialogueTurn(message=f"message, \"{i}\"", is_user=i % 2 == 0, timestamp=1691499971615 + i * 1000,
+                         processing_time=None if i % 2 == 0 else 100 + i,
+                         metadata={"regenerated": True} if i == 1 else None)
+            for i in range(count)]
+
+
+def test_batch_rows_match_single_rows():
+    writer = DialogueCSVWriter()
+    dialogue = _make_dialogue(5)
+    params = {"timezone": "Asia/Seoul"}
+
+    assert writer.convert_turns_to_rows(dialogue, range(5), params) == \
+           [writer.convert_turn_to_row(turn, index, params) for index, turn in enumerate(dialogue)]
+
+
+def test_csv_string():
+    dialogue = _make_dialogue(2)
+    rows = list(csv.reader(StringIO(DialogueCSVWriter().to_csv_string(dialogue))))
+
+    assert rows[0] == ["id", "turn_index", "role", "message", "regenerated", "timestamp", "processing_time"]
+    assert rows[1][:5] == [dialogue[0].id, "1", "user", "message, \"0\"", "No"]
+    assert rows[2][:5] == [dialogue[1].id, "2", "system", "message, \"1\"", "Yes"]
+    assert rows[2][5] == format_timestamps([dialogue[1].timestamp])[0]
+
+
+def test_sessions_csv_streams_in_batches(tmp_path):
+    writer = DialogueCSVWriter()
+    sessions = [("a", _make_dialogue(5)), ("b", []), ("c", _make_dialogue(2))]
+
+    chunks = list(writer.iter_sessions_csv_lines(iter(sessions), batch_size=2))
+    writer.sessions_to_csv_file(str(tmp_path / "sessions.csv"), iter(sessions), batch_size=2)
+    with open(tmp_path / "sessions.csv", newline="", encoding="utf-8") as f:
+        file_content = f.read()
+
+    assert len(chunks) == 4
+    assert "".join(chunks) == file_content
+
+    rows = list(csv.reader(StringIO(file_content)))
+    assert rows[0][0] == "session_id"
+    assert [row[0] for row in rows[1:]] == ["a"] * 5 + ["c"] * 2
+    assert [row[2] for row in rows[1:]] == ["1", "2", "3", "4", "5", "1", "2"]
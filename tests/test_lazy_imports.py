@@ -0,0 +1,44 @@
+import json
+import subprocess
+import sys
+from os import path
+
+PROJECT_DIR = path.dirname(path.dirname(path.abspath(__file__)))
+
+HEAVY_MODULES = ["transformers", "torch", "tokenizers", "anthropic", "cohere", "google.generativeai", "requests"]
+
+
+def _get_loaded_modules(statement: str) -> list[str]:
+    # A fresh interpreter, since this test process may have imported the modules already.
+    code = f"""
+import json, sys
+{statement}
+print(json.dumps([name for name in {HEAVY_MODULES!r} if name in sys.modules]))
+"""
+    result = subprocess.run([sys.executable, "-c", code], cwd=PROJECT_DIR, capture_output=True, text=True,
+                            check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def test_gpt_generator_import_does_not_load_other_providers():
+    assert _get_loaded_modules("from chatlib.chatbot.generators import ChatGPTResponseGenerator") == []
+
+
+def test_integration_package_import_is_lazy():
+    assert _get_loaded_modules("import chatlib.llm.integration") == []
+
+
+# Far above the lazy import (about 1 ms) and far below an import that loads a provider SDK (seconds).
+INTEGRATION_IMPORT_TIME_BUDGET_US = 200000
+
+
+def test_integration_package_import_time_is_within_budget():
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import chatlib.llm.integration"],
+                            cwd=PROJECT_DIR, capture_output=True, text=True, check=True)
+    # Each line is "import time: <self us> | <cumulative us> | <module>", and the cumulative time includes
+    # the modules imported by the module.
+    cumulative_times = [int(line.split("|")[1]) for line in result.stderr.splitlines()
+                        if line.split("|")[-1].strip() == "chatlib.llm.integration"]
+
+    assert len(cumulative_times) == 1
+    assert cumulative_times[0] < INTEGRATION_IMPORT_TIME_BUDGET_US
@@ -0,0 +1,103 @@
+import json
+
+import pytest
+
+from chatlib.llm.model_registry import ModelRegistry, ModelSpec, model_registry
+
+
+def test_prefix_resolution_prefers_longest_prefix():
+    registry = ModelRegistry([
+        ModelSpec(name="gpt-4", provider="Open AI", match_prefix=True, context_window=8192),
+        ModelSpec(name="gpt-4-32k", provider="Open AI", match_prefix=True, context_window=32000),
+        ModelSpec(name="gpt-4-0613", provider="Open AI", context_window=8192),
+    ])
+
+    assert registry.find("gpt-4-32k-9999").name == "gpt-4-32k"
+    assert registry.find("gpt-4-9999").name == "gpt-4"
+    assert registry.find("gpt-4-0613").name == "gpt-4-0613"
+    assert registry.find("gpt-5") is None
+    with pytest.raises(KeyError):
+        registry.get("gpt-5")
+
+
+def test_exact_names_are_not_prefixes():
+    registry = ModelRegistry([ModelSpec(name="command", provider="Cohere", context_window=4096)])
+
+    assert registry.find("command-r") is None
+    assert registry.get_token_limit("command") == 4096
+    assert registry.get_token_limit("command-r") is None
+
+
+def test_register_invalidates_memoized_resolution():
+    registry = ModelRegistry([ModelSpec(name="gpt-4", provider="Open AI", match_prefix=True, context_window=8192)])
+    assert registry.find("gpt-4-turbo-2024").name == "gpt-4"
+
+    registry.register(ModelSpec(name="gpt-4-turbo", provider="Open AI", match_prefix=True, context_window=128000))
+    assert registry.find("gpt-4-turbo-2024").name == "gpt-4-turbo"
+
+
+def test_models_are_keyed_by_provider():
+    registry = ModelRegistry([
+        ModelSpec(name="chat", provider="x", aliases=["chat-latest"], match_prefix=True, context_window=1000),
+        ModelSpec(name="chat", provider="y", context_window=2000),
+    ])
+
+    assert registry.get_token_limit("chat", "x") == 1000
+    assert registry.get_token_limit("chat", "y") == 2000
+    assert registry.find("chat-latest", "y") is None
+    assert registry.find("chat-2024", "y") is None
+    assert registry.get("chat-2024", "x").provider == "x"
+    assert registry.get("chat-2024").provider == "x"
+    with pytest.raises(KeyError):
+        registry.get("chat-latest", "z")
+
+
+def test_cost():
+    spec = ModelSpec(name="a", provider="x", input_price=1.0, output_price=2.0)
+
+    assert spec.get_cost(1000000, 500000) == pytest.approx(2.0)
+    assert ModelSpec(name="b", provider="x").get_cost(1, 1) is None
+
+
+def test_aliases_and_listing(tmp_path):
+    file_path = tmp_path / "models.json"
+    file_path.write_text(json.dumps([
+        {"name": "a", "provider": "x", "aliases": ["a-1", "a-2"]},
+        {"name": "b", "provider": "y"},
+    ]), encoding="utf-8")
+    registry = ModelRegistry()
+    registry.load_file(str(file_path))
+
+    assert registry.get("a-2").name == "a"
+    assert [spec.name for spec in registry.list_models()] == ["a", "b"]
+    assert [spec.name for spec in registry.list_models(provider="y")] == ["b"]
+
+
+def test_default_registry_specs_are_complete():
+    for spec in model_registry.list_models():
+        assert spec.context_window is not None, spec.name
+
+    assert model_registry.get("gpt-4-turbo-2024-04-09", "Open AI").supports_tools
+    assert model_registry.get("gpt-4", "Open AI").get_cost(1000, 1000) == pytest.approx(0.09)
+    assert model_registry.find("gpt-4", "Anthropic") is None
+
+
+@pytest.mark.parametrize("model,expected", [
+    ("gpt-3.5-turbo-16k-0613", "gpt-3.5-turbo-16k"),
+    ("gpt-3.5-turbo-16k-9999", "gpt-3.5-turbo-16k"),
+    ("gpt-3.5-turbo-9999", "gpt-3.5-turbo"),
+    ("gpt-4-turbo-2024-04-09", "gpt-4-turbo"),
+    ("gpt-4-32k-9999", "gpt-4-32k"),
+    ("claude-3-5-sonnet-20240620", "claude-3"),
+])
+def test_default_registry_resolution(model, expected):
+    assert model_registry.get(model, "Open AI" if model.startswith("gpt") else "Anthropic").name == expected
+
+
+def test_unknown_claude_models_fall_back_to_default_token_limit():
+    pytest.importorskip("anthropic")
+    from chatlib.llm.integration.anthropic_api import AnthropicChatCompletionAPI, ANTHROPIC_DEFAULT_TOKEN_LIMIT
+
+    api = AnthropicChatCompletionAPI()
+    assert api.get_token_limit("claude-2.0") == 100000
+    assert api.get_token_limit("claude-9-unreleased") == ANTHROPIC_DEFAULT_TOKEN_LIMIT
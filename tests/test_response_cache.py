@@ -0,0 +1,73 @@
+import asyncio
+from typing import Any
+
+from chatlib.llm.chat_completion_api import ChatCompletionAPI, ChatCompletionMessage, ChatCompletionResult, \
+    ChatCompletionFinishReason, ChatCompletionMessageRole
+from chatlib.llm.response_cache import ChatCompletionResponseCache
+from chatlib.utils.integration import APIAuthorizationVariableSpec
+
+MESSAGES = [ChatCompletionMessage(content="hello", role=ChatCompletionMessageRole.USER)]
+
+
+class CountingChatCompletionAPI(ChatCompletionAPI):
+    """
+    Answers with the number of completions run so far, without a network call.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.run_count = 0
+
+    @classmethod
+    def provider_name(cls) -> str:
+        return "Counting"
+
+    @classmethod
+    def get_auth_variable_specs(cls) -> list[APIAuthorizationVariableSpec]:
+        return []
+
+    @classmethod
+    def _authorize_impl(cls, variables: dict[APIAuthorizationVariableSpec, Any]) -> bool:
+        return True
+
+    def is_messages_within_token_limit(self, messages: list[ChatCompletionMessage], model: str,
+                                       tolerance: int = 120) -> bool:
+        return True
+
+    def count_token_in_messages(self, messages: list[ChatCompletionMessage], model: str) -> int:
+        return 1
+
+    async def _run_chat_completion_impl(self, model: str, messages: list[ChatCompletionMessage],
+                                        params: dict) -> ChatCompletionResult:
+        self.run_count += 1
+        return ChatCompletionResult(message=ChatCompletionMessage(content=str(self.run_count),
+                                                                  role=ChatCompletionMessageRole.ASSISTANT),
+                                    finish_reason=ChatCompletionFinishReason.Stop, provider=self.provider_name(),
+                                    model=model, prompt_tokens=1, completion_tokens=1, total_tokens=2)
+
+
+def _run_twice(cache: ChatCompletionResponseCache, params: dict) -> list[str]:
+    api = CountingChatCompletionAPI()
+    api.authorize()
+    api.set_response_cache(cache)
+
+    async def run():
+        return [(await api.run_chat_completion("model", MESSAGES, params)).message.content for _ in range(2)]
+
+    return asyncio.run(run())
+
+
+def test_key_includes_provider():
+    params = {"temperature": 0}
+    assert ChatCompletionResponseCache.make_key("a", "model", MESSAGES, params) != \
+           ChatCompletionResponseCache.make_key("b", "model", MESSAGES, params)
+
+
+def test_only_deterministic_requests_are_cached():
+    assert _run_twice(ChatCompletionResponseCache(), {"temperature": 0}) == ["1", "1"]
+    assert _run_twice(ChatCompletionResponseCache(), {"temperature": 0.7}) == ["1", "2"]
+    assert _run_twice(ChatCompletionResponseCache(), {}) == ["1", "2"]
+
+
+def test_nondeterministic_requests_are_cached_on_opt_in():
+    assert _run_twice(ChatCompletionResponseCache(cache_nondeterministic=True), {"temperature": 0.7}) == ["1", "1"]
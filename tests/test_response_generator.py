@@ -0,0 +1,142 @@
+import asyncio
+from typing import Any, AsyncIterator
+
+from chatlib.chatbot import ChatCompletionResponseGenerator, DialogueTurn
+from chatlib.llm.chat_completion_api import ChatCompletionAPI, ChatCompletionMessage, ChatCompletionResult, \
+    ChatCompletionFinishReason, ChatCompletionMessageRole, ChatCompletionChunk
+from chatlib.utils.integration import APIAuthorizationVariableSpec
+
+
+class ScriptedChatCompletionAPI(ChatCompletionAPI):
+    """
+    Streams the given deltas without a network call, with or without a final result chunk.
+    """
+
+    def __init__(self, deltas: list[str], emit_result: bool = True, usage_estimated: bool = False):
+        super().__init__()
+        self.deltas = deltas
+        self.emit_result = emit_result
+        self.usage_estimated = usage_estimated
+
+    @classmethod
+    def provider_name(cls) -> str:
+        return "Scripted"
+
+    @classmethod
+    def get_auth_variable_specs(cls) -> list[APIAuthorizationVariableSpec]:
+        return []
+
+    @classmethod
+    def _authorize_impl(cls, variables: dict[APIAuthorizationVariableSpec, Any]) -> bool:
+        return True
+
+    def get_token_limit(self, model: str) -> int | None:
+        return 100000
+
+    def is_messages_within_token_limit(self, messages: list[ChatCompletionMessage], model: str,
+                                       tolerance: int = 120) -> bool:
+        return True
+
+    def count_token_in_message(self, message: ChatCompletionMessage, model: str) -> int:
+        return len(message.content or "")
+
+    def count_token_in_messages(self, messages: list[ChatCompletionMessage], model: str) -> int:
+        return sum(self.count_token_in_each_message(messages, model))
+
+    def __make_result(self) -> ChatCompletionResult:
+        return ChatCompletionResult(message=ChatCompletionMessage(content="".join(self.deltas),
+                                                                  role=ChatCompletionMessageRole.ASSISTANT),
+                                    finish_reason=ChatCompletionFinishReason.Stop, provider=self.provider_name(),
+                                    model="scripted", prompt_tokens=100000, completion_tokens=1, total_tokens=100001,
+                                    usage_estimated=self.usage_estimated)
+
+    async def _run_chat_completion_impl(self, model: str, messages: list[ChatCompletionMessage],
+                                        params: dict) -> ChatCompletionResult:
+        return self.__make_result()
+
+    async def _run_chat_completion_stream_impl(self, model: str, messages: list[ChatCompletionMessage],
+                                               params: dict) -> AsyncIterator[ChatCompletionChunk]:
+        for delta in self.deltas:
+            yield ChatCompletionChunk(delta=delta)
+        if self.emit_result:
+            yield ChatCompletionChunk(result=self.__make_result())
+
+
+def _make_generator(api: ChatCompletionAPI) -> ChatCompletionResponseGenerator:
+    api.authorize()
+    return ChatCompletionResponseGenerator(api, "scripted", base_instruction="Be brief.")
+
+
+def _stream(generator: ChatCompletionResponseGenerator) -> list:
+    async def collect():
+        return [chunk async for chunk in generator.get_response_stream([DialogueTurn(message="hello")])]
+
+    return asyncio.run(collect())
+
+
+def _get_calibration_ratio(generator: ChatCompletionResponseGenerator) -> float:
+    return generator._ChatCompletionResponseGenerator__token_counter.calibration_ratio
+
+
+def test_stream_without_result_chunk_falls_back_to_deltas():
+    chunks = _stream(_make_generator(ScriptedChatCompletionAPI(["Hel", "lo"], emit_result=False)))
+
+    assert [chunk.delta for chunk in chunks if not chunk.is_final] == ["Hel", "lo"]
+    assert chunks[-1].is_final
+    assert chunks[-1].message == "Hello"
+    assert chunks[-1].metadata is None
+
+
+def test_estimated_usage_is_marked_and_not_calibrated():
+    generator = _make_generator(ScriptedChatCompletionAPI(["Hi"], usage_estimated=True))
+    chunks = _stream(generator)
+
+    assert chunks[-1].metadata["chatcompletion"]["usage_estimated"] is True
+    assert _get_calibration_ratio(generator) == 1.0
+
+
+def test_reported_usage_calibrates():
+    generator = _make_generator(ScriptedChatCompletionAPI(["Hi"]))
+    chunks = _stream(generator)
+
+    assert "usage_estimated" not in chunks[-1].metadata["chatcompletion"]
+    assert _get_calibration_ratio(generator) > 1.0
+
+
+class MarginChatCompletionAPI(ScriptedChatCompletionAPI):
+    """
+    Counts exactly twice the local estimate, and only near the limit.
+    """
+
+    def __init__(self):
+        super().__init__(["Hi"])
+        self.exact_counts = 0
+
+    def get_token_limit(self, model: str) -> int | None:
+        return 1000
+
+    def get_token_estimate_margin(self, model: str) -> float | None:
+        return 0.1
+
+    def count_token_in_messages(self, messages: list[ChatCompletionMessage], model: str) -> int:
+        self.exact_counts += 1
+        return 2 * super().count_token_in_messages(messages, model)
+
+
+def _is_within_token_limit(generator: ChatCompletionResponseGenerator, message: str) -> bool:
+    messages = [ChatCompletionMessage(content=message, role=ChatCompletionMessageRole.USER)]
+    return generator._ChatCompletionResponseGenerator__is_messages_within_token_limit(messages)
+
+
+def test_tokens_are_counted_exactly_only_near_the_limit_and_calibrate_per_generator():
+    api = MarginChatCompletionAPI()
+    generator = ChatCompletionResponseGenerator(api, "scripted", base_instruction=None, token_limit_tolerance=0)
+    other_generator = ChatCompletionResponseGenerator(api, "scripted", base_instruction=None, token_limit_tolerance=0)
+
+    assert _is_within_token_limit(generator, "a" * 100)
+    assert api.exact_counts == 0
+
+    assert not _is_within_token_limit(generator, "a" * 950)
+    assert api.exact_counts == 1
+    assert _get_calibration_ratio(generator) > 1.0
+    assert _get_calibration_ratio(other_generator) == 1.0
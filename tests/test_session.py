@@ -0,0 +1,124 @@
+import asyncio
+import json
+from os import path
+from threading import Event
+
+import pytest
+
+from chatlib.chatbot import ResponseGenerator, Dialogue, DialogueTurn
+from chatlib.chatbot.session import TurnTakingChatSession, SessionSavePolicy, ChatSessionBase
+from chatlib.chatbot.session_writer import SessionFileWriter, SyncSessionWriterAdapter
+
+
+class EchoResponseGenerator(ResponseGenerator):
+
+    def __init__(self):
+        super().__init__()
+        self.state = {"responses": 0}
+
+    async def _get_response_impl(self, dialog: Dialogue, dry: bool = False) -> tuple[str, dict | None]:
+        self.state["responses"] += 1
+        return f"echo {len(dialog)}", None
+
+    def write_to_json(self, parcel: dict):
+        parcel["state"] = self.state
+
+    def restore_from_json(self, parcel: dict):
+        self.state = parcel["state"]
+
+
+@pytest.fixture
+def writer(tmp_path, monkeypatch) -> SessionFileWriter:
+    monkeypatch.chdir(tmp_path)
+    return SessionFileWriter()
+
+
+def _read_info(session_id: str) -> dict:
+    with open(path.join("data/sessions", session_id, "info.json"), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def test_flush_writes_snapshot_of_info(writer):
+    async def run():
+        session = TurnTakingChatSession("s", EchoResponseGenerator(), writer, save_policy=SessionSavePolicy.OnClose)
+        await session.push_user_message(DialogueTurn(message="hello"))
+        await session.aclose()
+        return session
+
+    session = asyncio.run(run())
+
+    assert not session.is_dirty
+    assert _read_info("s") == {"id": "s", "turns": 2, "response_generator": {"state": {"responses": 1}}}
+
+    loaded = TurnTakingChatSession("s", EchoResponseGenerator(), writer)
+    assert loaded.load()
+    assert [turn.message for turn in loaded.dialog] == ["hello", "echo 1"]
+    assert loaded.response_generator.state == {"responses": 1}
+
+
+def test_close_writes_pending_info(writer):
+    async def run():
+        session = TurnTakingChatSession("s", EchoResponseGenerator(), writer, save_policy=SessionSavePolicy.OnClose)
+        await session.push_user_message(DialogueTurn(message="hello"))
+        return session
+
+    session = asyncio.run(run())
+    session.close()
+
+    assert _read_info("s")["turns"] == 2
+
+
+def test_del_of_partially_initialized_session_is_silent(writer, capsys):
+    session = ChatSessionBase.__new__(TurnTakingChatSession)
+    session.__del__()
+
+    assert capsys.readouterr().err == ""
+
+
+class BlockingSessionFileWriter(SessionFileWriter):
+    """
+    Blocks turn writes of the session "slow" until released.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.release = Event()
+
+    def write_turn(self, session_id: str, turn: DialogueTurn):
+        if session_id == "slow":
+            assert self.release.wait(5)
+        super().write_turn(session_id, turn)
+
+
+def test_adapter_runs_sessions_in_parallel_and_keeps_order_within_session(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    writer = BlockingSessionFileWriter()
+    adapter = SyncSessionWriterAdapter(writer)
+    turns = [DialogueTurn(message=f"message {i}") for i in range(3)]
+
+    async def run():
+        slow_writes = [asyncio.ensure_future(adapter.write_turn("slow", turn)) for turn in turns]
+        # Not blocked by the writes of the other session.
+        await asyncio.wait_for(adapter.write_turn("fast", turns[0]), 5)
+        assert await adapter.read_dialogue("fast") == turns[:1]
+        read = asyncio.ensure_future(adapter.read_dialogue("slow"))
+        assert not any(write.done() for write in slow_writes)
+
+        writer.release.set()
+        await adapter.flush()
+        assert all(write.done() for write in slow_writes)
+        return await read
+
+    assert asyncio.run(run()) == turns
+
+
+def test_sync_push_new_turn_is_kept_for_subclasses(writer):
+    session = TurnTakingChatSession("s", EchoResponseGenerator(), writer, save_policy=SessionSavePolicy.OnClose)
+    session._push_new_turn(DialogueTurn(message="hello"))
+    session._push_new_turn(DialogueTurn(message="bye"))
+    assert session._pop_last_turn().message == "bye"
+    session.close()
+
+    loaded = TurnTakingChatSession("s", EchoResponseGenerator(), writer)
+    assert asyncio.run(loaded.aload())
+    assert [turn.message for turn in loaded.dialog] == ["hello"]
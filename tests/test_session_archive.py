@@ -0,0 +1,78 @@
+import pytest
+
+from chatlib.chatbot.session_archive import SessionArchiveWriter, SessionArchiveReader
+from chatlib.chatbot.session_sqlite_writer import SessionSQLiteWriter
+from chatlib.chatbot.types import DialogueTurn
+
+
+def _make_sessions() -> list[tuple[str, list[DialogueTurn], dict | None]]:
+    return [
+        ("a", [DialogueTurn(message="hello", metadata={"tags": ["x"]}),
+               DialogueTurn(message="hi", is_user=False, processing_time=30)], {"id": "a", "turns": 2}),
+        ("b", [], {"id": "b", "turns": 0}),
+        ("c", [DialogueTurn(message=f"message {i}") for i in range(5)], None),
+    ]
+
+
+def test_round_trip_across_shards(tmp_path):
+    sessions = _make_sessions()
+    with SessionArchiveWriter(str(tmp_path), shard_size=2) as writer:
+        for session_id, dialogue, info in sessions:
+            writer.add_session(session_id, dialogue, info)
+
+    reader = SessionArchiveReader(str(tmp_path))
+
+    assert list(reader.iter_sessions()) == sessions
+    assert reader.turn_count == 7
+    assert reader.session_count == 3
+    assert list(reader.iter_session_infos()) == [(session_id, info) for session_id, _, info in sessions]
+
+
+def test_read_subset_of_columns(tmp_path):
+    sessions = _make_sessions()
+    with SessionArchiveWriter(str(tmp_path), shard_size=2) as writer:
+        for session_id, dialogue, info in sessions:
+            writer.add_session(session_id, dialogue, info)
+
+    reader = SessionArchiveReader(str(tmp_path))
+
+    assert reader.read_column("message") == [turn.message for _, dialogue, _ in sessions for turn in dialogue]
+    assert list(reader.iter_rows(["session_id", "is_user"]))[:2] == [dict(session_id="a", is_user=True),
+                                                                    dict(session_id="a", is_user=False)]
+    with pytest.raises(KeyError):
+        list(reader.iter_rows(["unknown"]))
+
+
+def test_export_and_import_through_writers(tmp_path):
+    source = SessionSQLiteWriter(str(tmp_path / "source.db"))
+    target = SessionSQLiteWriter(str(tmp_path / "target.db"))
+    try:
+        for session_id, dialogue, info in _make_sessions():
+            for turn in dialogue:
+                source.write_turn(session_id, turn)
+            if info is not None:
+                source.write_session_info(session_id, info)
+
+        with SessionArchiveWriter(str(tmp_path / "archive")) as writer:
+            writer.add_from_writer(source, ["a", "b", "c"])
+
+        target.write_session_info("a", {"id": "a", "stale": True})
+        reader = SessionArchiveReader(str(tmp_path / "archive"))
+
+        assert reader.import_into(target) == 2
+        assert target.read_session_info("a") == {"id": "a", "stale": True}
+
+        assert reader.import_into(target, overwrite=True) == 3
+        for session_id in ["a", "b", "c"]:
+            assert target.read_dialogue(session_id) == source.read_dialogue(session_id)
+            assert target.read_session_info(session_id) == source.read_session_info(session_id)
+    finally:
+        source.close()
+        target.close()
+
+
+def test_closed_writer_rejects_sessions(tmp_path):
+    writer = SessionArchiveWriter(str(tmp_path))
+    writer.close()
+    with pytest.raises(ValueError):
+        writer.add_session("a", [])
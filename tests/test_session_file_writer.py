@@ -0,0 +1,75 @@
+from os import path
+
+import pytest
+
+from chatlib.chatbot.session_writer import SessionFileWriter, TOMBSTONE_KEY
+from chatlib.chatbot.types import DialogueTurn
+
+
+@pytest.fixture
+def writer(tmp_path, monkeypatch) -> SessionFileWriter:
+    # The writer stores sessions under data/sessions of the working directory.
+    monkeypatch.chdir(tmp_path)
+    return SessionFileWriter(compaction_threshold=3)
+
+
+def _read_log_lines(session_id: str) -> list[str]:
+    with open(path.join("data/sessions", session_id, "dialogue.jsonl"), encoding="utf-8") as f:
+        return [line for line in f.read().splitlines() if len(line.strip()) > 0]
+
+
+def test_delete_turn_appends_tombstone(writer):
+    turns = [DialogueTurn(message=f"message {i}", is_user=i % 2 == 0) for i in range(4)]
+    writer.write_turns("s", turns)
+
+    deleted = writer.delete_turn("s", turns[3].id)
+
+    assert deleted == turns[3]
+    assert writer.read_dialogue("s") == turns[:3]
+    assert len(_read_log_lines("s")) == 5
+    assert TOMBSTONE_KEY in _read_log_lines("s")[-1]
+
+
+def test_delete_turn_of_unknown_or_deleted_turn(writer):
+    turn = DialogueTurn(message="hello")
+    writer.write_turn("s", turn)
+
+    assert writer.delete_turn("s", "unknown") is None
+    assert writer.delete_turn("s", turn.id) == turn
+    assert writer.delete_turn("s", turn.id) is None
+    assert writer.delete_turn("no_session", turn.id) is None
+
+
+def test_tombstones_are_compacted_at_threshold(writer):
+    turns = [DialogueTurn(message=f"message {i}") for i in range(5)]
+    writer.write_turns("s", turns)
+
+    writer.delete_turn("s", turns[4].id)
+    writer.delete_turn("s", turns[3].id)
+    assert len(_read_log_lines("s")) == 7
+
+    writer.delete_turn("s", turns[2].id)
+    lines = _read_log_lines("s")
+    assert len(lines) == 2
+    assert all(TOMBSTONE_KEY not in line for line in lines)
+    assert writer.read_dialogue("s") == turns[:2]
+
+
+def test_rewritten_turn_after_tombstone_is_alive(writer):
+    turn = DialogueTurn(message="hello")
+    writer.write_turn("s", turn)
+    writer.delete_turn("s", turn.id)
+    writer.write_turn("s", turn)
+
+    assert writer.read_dialogue("s") == [turn]
+    writer.compact("s")
+    assert writer.read_dialogue("s") == [turn]
+    assert len(_read_log_lines("s")) == 1
+
+
+def test_trusted_rows_read_the_same_turns(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    turns = [DialogueTurn(message=f"message {i}", metadata={"index": i} if i % 2 else None) for i in range(3)]
+    SessionFileWriter().write_turns("s", turns)
+
+    assert SessionFileWriter(trusted_rows=True).read_dialogue("s") == turns
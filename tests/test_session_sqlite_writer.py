@@ -0,0 +1,97 @@
+import sqlite3
+
+import pytest
+
+from chatlib.chatbot.session_sqlite_writer import SessionSQLiteWriter
+from chatlib.chatbot.types import DialogueTurn
+from chatlib.utils.json_serializer import StdJSONSerializer
+
+
+@pytest.fixture
+def writer(tmp_path) -> SessionSQLiteWriter:
+    writer = SessionSQLiteWriter(str(tmp_path / "sessions.db"))
+    yield writer
+    writer.close()
+
+
+def test_database_uses_wal(writer, tmp_path):
+    connection = sqlite3.connect(str(tmp_path / "sessions.db"))
+    try:
+        assert connection.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    finally:
+        connection.close()
+
+
+def test_turns_and_info_round_trip(writer):
+    turns = [DialogueTurn(message="hello", metadata={"a": [1, 2]}),
+             DialogueTurn(message="hi", is_user=False, processing_time=12)]
+    for turn in turns:
+        writer.write_turn("s", turn)
+    writer.write_session_info("s", {"id": "s", "turns": 2})
+
+    assert writer.exists("s")
+    assert writer.read_dialogue("s") == turns
+    assert writer.read_session_info("s") == {"id": "s", "turns": 2}
+
+    assert writer.delete_turn("s", turns[1].id) == turns[1]
+    assert writer.delete_turn("s", turns[1].id) is None
+    assert writer.read_dialogue("s") == turns[:1]
+
+
+def test_missing_session(writer):
+    assert not writer.exists("none")
+    assert writer.read_dialogue("none") is None
+    assert writer.read_session_info("none") is None
+    assert not writer.clear_data("none")
+
+    # Same as SessionFileWriter, which has no dialogue file for a session without turns.
+    writer.write_session_info("empty", {})
+    assert writer.exists("empty")
+    assert writer.read_dialogue("empty") is None
+
+
+def test_list_sessions_pages_by_keyset(writer):
+    session_ids = [f"session_{i:03d}" for i in range(25)]
+    for session_id in reversed(session_ids):
+        writer.write_session_info(session_id, {"id": session_id})
+
+    pages = []
+    after = None
+    while True:
+        page = writer.list_sessions(limit=10, after=after)
+        if len(page) == 0:
+            break
+        pages.append(page)
+        after = page[-1]
+
+    assert [len(page) for page in pages] == [10, 10, 5]
+    assert sum(pages, []) == session_ids
+    assert writer.count_sessions() == 25
+
+
+def test_read_dialogues_spans_query_chunks(writer):
+    session_ids = [f"s{i}" for i in range(1000)]
+    for session_id in session_ids:
+        writer.write_turn(session_id, DialogueTurn(message=session_id))
+
+    dialogues = writer.read_dialogues(session_ids + ["none"])
+
+    assert len(dialogues) == 1000
+    assert all(dialogues[session_id][0].message == session_id for session_id in session_ids)
+
+
+def test_serializer_is_pluggable(tmp_path):
+    writer = SessionSQLiteWriter(str(tmp_path / "sessions.db"), serializer=StdJSONSerializer())
+    try:
+        turn = DialogueTurn(message="hello", metadata={"text": "안녕"})
+        writer.write_turn("s", turn)
+        writer.write_session_info("s", {"id": "s"})
+    finally:
+        writer.close()
+
+    writer = SessionSQLiteWriter(str(tmp_path / "sessions.db"))
+    try:
+        assert writer.read_dialogue("s") == [turn]
+        assert writer.read_session_info("s") == {"id": "s"}
+    finally:
+        writer.close()
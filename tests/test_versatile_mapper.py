@@ -0,0 +1,121 @@
+import asyncio
+import json
+from typing import Any
+
+import pytest
+
+from chatlib.chatbot import ChatCompletionParams
+from chatlib.llm.chat_completion_api import ChatCompletionAPI, ChatCompletionMessage, ChatCompletionResult, \
+    ChatCompletionFinishReason, ChatCompletionMessageRole
+from chatlib.tool.versatile_mapper import ChatCompletionFewShotMapper, ChatCompletionFewShotMapperParams, \
+    MapperInputOutputPair
+from chatlib.utils.integration import APIAuthorizationVariableSpec
+
+
+class UppercaseChatCompletionAPI(ChatCompletionAPI):
+    """
+    Replies with the last user message in upper case, without a network call. Fails on "fail".
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.requested_inputs: list[str] = []
+
+    @classmethod
+    def provider_name(cls) -> str:
+        return "Uppercase"
+
+    @classmethod
+    def get_auth_variable_specs(cls) -> list[APIAuthorizationVariableSpec]:
+        return []
+
+    @classmethod
+    def _authorize_impl(cls, variables: dict[APIAuthorizationVariableSpec, Any]) -> bool:
+        return True
+
+    def is_messages_within_token_limit(self, messages: list[ChatCompletionMessage], model: str,
+                                       tolerance: int = 120) -> bool:
+        return True
+
+    def count_token_in_messages(self, messages: list[ChatCompletionMessage], model: str) -> int:
+        return sum([len(message.content) for message in messages])
+
+    async def _run_chat_completion_impl(self, model: str, messages: list[ChatCompletionMessage],
+                                        params: dict) -> ChatCompletionResult:
+        input = messages[-1].content
+        self.requested_inputs.append(input)
+        if input == "fail":
+            raise ValueError("failed")
+        # Finish out of order, so that ordered mode has to buffer.
+        await asyncio.sleep(0.001 * (len(input) % 3))
+        return ChatCompletionResult(message=ChatCompletionMessage(content=input.upper(),
+                                                                  role=ChatCompletionMessageRole.ASSISTANT),
+                                    finish_reason=ChatCompletionFinishReason.Stop, provider=self.provider_name(),
+                                    model=model)
+
+
+@pytest.fixture
+def api() -> UppercaseChatCompletionAPI:
+    api = UppercaseChatCompletionAPI()
+    api.authorize()
+    return api
+
+
+def _make_mapper(api: ChatCompletionAPI) -> ChatCompletionFewShotMapper[str, str, ChatCompletionFewShotMapperParams]:
+    return ChatCompletionFewShotMapper.make_str_mapper(api, "Convert the input to upper case.")
+
+
+PARAMS = ChatCompletionFewShotMapperParams(model="uppercase", api_params=ChatCompletionParams())
+EXAMPLES = [MapperInputOutputPair(input="a", output="A")]
+
+
+def test_run_batch_keeps_input_order_and_isolates_failures(api):
+    inputs = ["abc", "d", "fail", "ef", "ghij"]
+    results = asyncio.run(_make_mapper(api).run_batch(EXAMPLES, inputs, PARAMS, concurrency=2))
+
+    assert [result.index for result in results] == list(range(5))
+    assert [result.output for result in results] == ["ABC", "D", None, "EF", "GHIJ"]
+    assert [result.is_success for result in results] == [True, True, False, True, True]
+    assert isinstance(results[2].error, ValueError)
+
+
+def test_map_stream_accepts_async_inputs(api):
+    async def inputs():
+        for input in ["x", "yy", "zzz"]:
+            yield input
+
+    async def collect():
+        return [result async for result in _make_mapper(api).map_stream(EXAMPLES, inputs(), PARAMS, concurrency=3)]
+
+    results = asyncio.run(collect())
+    assert sorted([(result.index, result.output) for result in results]) == [(0, "X"), (1, "YY"), (2, "ZZZ")]
+
+
+def test_checkpoint_resumes_after_interruption(api, tmp_path):
+    checkpoint_path = str(tmp_path / "checkpoint.jsonl")
+    inputs = [f"input {i}" for i in range(6)] + ["fail"]
+    mapper = _make_mapper(api)
+
+    async def run_first_items(count: int):
+        stream = mapper.map_stream(EXAMPLES, inputs, PARAMS, concurrency=1, ordered=True,
+                                   checkpoint_path=checkpoint_path)
+        results = [await anext(stream) for _ in range(count)]
+        await stream.aclose()
+        return results
+
+    assert [result.output for result in asyncio.run(run_first_items(3))] == ["INPUT 0", "INPUT 1", "INPUT 2"]
+    with open(checkpoint_path, encoding="utf-8") as f:
+        checkpointed_indices = [json.loads(line)["index"] for line in f]
+    assert checkpointed_indices[:3] == [0, 1, 2]
+
+    api.requested_inputs.clear()
+    results = asyncio.run(mapper.run_batch(EXAMPLES, inputs, PARAMS, concurrency=2,
+                                           checkpoint_path=checkpoint_path))
+
+    assert [result.output for result in results] == [input.upper() for input in inputs[:6]] + [None]
+    assert set(api.requested_inputs) == set(inputs[len(checkpointed_indices):])
+
+    # The failed item is not checkpointed, so it is the only one run again.
+    api.requested_inputs.clear()
+    asyncio.run(mapper.run_batch(EXAMPLES, inputs, PARAMS, checkpoint_path=checkpoint_path))
+    assert api.requested_inputs == ["fail"]